@@ -3,11 +3,18 @@ API dependencies and dependency injection
 API依存性注入
 """
 
-from fastapi import HTTPException, UploadFile
+from fastapi import Header, HTTPException, Query, Request, UploadFile
+from typing import Callable, List, NamedTuple, Optional
+import hmac
 import logging
 
+from app.core.config import settings
 from app.models.classifier import classifier
-from app.utils.image_processing import image_processor
+from app.models.scheduler import LANES
+from app.models.schemas import PredictionResult
+from app.utils.drain import Admission, drain
+from app.utils.encoding import JSON, negotiate, parse_fields
+from app.utils.image_processing import image_processor, TENSOR_CONTENT_TYPES
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +59,83 @@ async def validate_image_file(file: UploadFile) -> bytes:
     return content
 
 
+def _token_matches(value: str, expected: str) -> bool:
+    """Constant-time comparison that also accepts non-ASCII header values"""
+    # compare_digest raises TypeError for non-ASCII str, so compare bytes
+    return hmac.compare_digest(value.encode("utf-8"), expected.encode("utf-8"))
+
+
+def is_tensor_upload(file: UploadFile) -> bool:
+    """Check whether an upload is a pre-decoded tensor rather than an encoded image"""
+    return (file.content_type or "").split(";")[0].strip() in TENSOR_CONTENT_TYPES
+
+
+async def validate_tensor_file(file: UploadFile, client_token: Optional[str]) -> bytes:
+    """
+    Validate a pre-decoded tensor upload from a trusted client
+    
+    Args:
+        file: Uploaded .npy or raw uint8 file
+        client_token: Value of the X-Client-Token header
+        
+    Returns:
+        bytes: File content
+        
+    Raises:
+        HTTPException: If the client is not trusted or the upload is too large
+    """
+    if client_token is None or not any(
+        _token_matches(client_token, token) for token in settings.TENSOR_UPLOAD_TOKENS
+    ):
+        raise HTTPException(
+            status_code=403,
+            detail="Tensor uploads are only accepted from trusted clients"
+        )
+    
+    # 224x224x3 uint8 plus a .npy header
+    max_bytes = 224 * 224 * 3 + 4096
+    content = await file.read(max_bytes + 1)
+    
+    if len(content) == 0:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    
+    if len(content) > max_bytes:
+        raise HTTPException(
+            status_code=400,
+            detail="Tensor too large. Expected a uint8 224x224x3 array."
+        )
+    
+    return content
+
+
+class ResponseFormat(NamedTuple):
+    """Negotiated encoding and field projection for prediction responses"""
+    media_type: str
+    fields: Optional[List[str]]
+    
+    @property
+    def is_default(self) -> bool:
+        """Full JSON document (the documented response model)"""
+        return self.media_type == JSON and self.fields is None
+
+
+def get_response_format(
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated PredictionResult fields to return"),
+    compact: bool = Query(False, description="Return only predicted_class, confidence and all_probabilities")
+) -> ResponseFormat:
+    """
+    Resolve Accept, fields= and compact= for prediction endpoints
+    
+    Raises:
+        HTTPException: 406 for unsupported encodings, 400 for unknown fields
+    """
+    return ResponseFormat(
+        media_type=negotiate(request.headers.get("accept")),
+        fields=parse_fields(fields, compact, PredictionResult.model_fields.keys())
+    )
+
+
 def get_classifier():
     """
     Get classifier instance
@@ -67,6 +151,107 @@ def get_classifier():
     return classifier
 
 
+def _draining_error() -> HTTPException:
+    """503 so clients retry on another replica"""
+    return HTTPException(
+        status_code=503,
+        detail="Server is shutting down. Please retry.",
+        headers={"Retry-After": "1", "Connection": "close"}
+    )
+
+
+def reject_when_draining():
+    """
+    Refuse new inference work while the replica drains
+    
+    Raises:
+        HTTPException: 503 so clients retry on another replica
+    """
+    if drain.refuse():
+        raise _draining_error()
+
+
+def admit_inference() -> Admission:
+    """
+    Register a request's inference work with the drain controller
+    
+    reject_when_draining runs before the handler; a drain that begins in
+    between would otherwise see the replica idle and stop the pool under
+    an admitted request. Use as `with admit_inference():`.
+    
+    Raises:
+        HTTPException: 503 if draining started since the request arrived
+    """
+    admission = drain.admit()
+    if admission is None:
+        raise _draining_error()
+    return admission
+
+
+def priority_lane(default: str) -> Callable[..., str]:
+    """
+    Dependency factory: the inference lane for a route
+    
+    Args:
+        default: Lane used when the client sends no X-Priority header
+    """
+    def resolve(
+        x_priority: Optional[str] = Header(None, description="Inference lane: interactive or bulk")
+    ) -> str:
+        if x_priority is None:
+            return default
+        lane = x_priority.strip().lower()
+        if lane not in LANES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid X-Priority: {x_priority}. Use one of {', '.join(LANES)}."
+            )
+        return lane
+    
+    return resolve
+
+
+def get_request_timeout(
+    x_request_timeout: Optional[float] = Header(None, description="Seconds the client will wait for the result")
+) -> float:
+    """
+    Deadline for a predict request: X-Request-Timeout, capped at REQUEST_TIMEOUT
+    
+    Raises:
+        HTTPException: If the header is not a positive number of seconds
+    """
+    if x_request_timeout is None:
+        return float(settings.REQUEST_TIMEOUT)
+    if x_request_timeout <= 0:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds")
+    return min(x_request_timeout, float(settings.REQUEST_TIMEOUT))
+
+
 def get_image_processor():
     """Get image processor instance"""
-    return image_processor
\ No newline at end of file
+    return image_processor
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Authenticate admin requests via the X-Admin-Token header
+    
+    Raises:
+        HTTPException: If admin endpoints are disabled or the token is wrong
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    
+    if x_admin_token is None or not _token_matches(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def require_jobs_enabled():
+    """
+    Make the batch job endpoints disappear when JOBS_ENABLED is off
+    
+    Raises:
+        HTTPException: 404 (the job store is never opened in that case)
+    """
+    if not settings.JOBS_ENABLED:
+        raise HTTPException(status_code=404, detail="Batch jobs are disabled")
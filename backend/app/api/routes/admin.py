@@ -0,0 +1,208 @@
+"""
+Admin endpoints (model management, diagnostics)
+管理用エンドポイント
+
+All routes require the X-Admin-Token header to match settings.ADMIN_TOKEN.
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from typing import Optional
+import logging
+
+from app.models.classifier import classifier
+from app.core.config import settings
+from app.utils.cache import prediction_cache
+from app.utils.cpu_profiler import DETERMINISTIC, SAMPLING, cpu_profiler
+from app.utils.drain import drain
+from app.utils.image_processing import image_processor
+from app.utils.loop_monitor import loop_monitor
+from app.utils.memory_profiler import gc_stats, memory_profiler, rss_stats
+from app.utils.prediction_log import prediction_log
+from app.utils.traffic_capture import traffic_capture
+from app.api.deps import require_admin
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+logger = logging.getLogger(__name__)
+
+
+@router.get("/model", tags=["Admin"])
+async def model_status():
+    """Active model version, available versions and reload state"""
+    return {
+        "model_version": classifier.model_version,
+        "available_versions": classifier.registry.list_versions(),
+        "current_version": classifier.registry.current_version(),
+        "reloading": classifier.is_reloading(),
+        "last_reload_error": classifier.last_reload_error,
+        "cache": prediction_cache.stats(),
+        "inference_workers": classifier.pool.stats() if classifier.pool is not None else None,
+        "scheduler": classifier.scheduler.stats(),
+        "prediction_log": prediction_log.stats(),
+        "traffic_capture": traffic_capture.stats()
+    }
+
+
+@router.post("/model/reload", status_code=202, tags=["Admin"])
+async def reload_model(
+    version: Optional[str] = Query(None, description="Version to load (default: registry current)")
+):
+    """
+    Hot reload the model
+
+    The new version is loaded and warmed up in the background, then swapped
+    in atomically. In-flight requests finish on the old version.
+    With MODEL_WATCH_INTERVAL enabled, pin versions through the registry
+    CURRENT file instead, otherwise the watcher switches back to it.
+    """
+    if version is not None and version not in classifier.registry.list_versions():
+        raise HTTPException(status_code=404, detail=f"Unknown model version: {version}")
+
+    if not classifier.reload_in_background(version):
+        return JSONResponse(
+            status_code=409,
+            content={"error": "Conflict", "detail": "A model reload is already in progress"}
+        )
+
+    logger.info(f"Model reload requested: {version or 'current'}")
+    return {
+        "status": "reloading",
+        "requested_version": version or classifier.registry.current_version(),
+        "serving_version": classifier.model_version
+    }
+
+
+@router.get("/memory", tags=["Admin"])
+async def memory_status(
+    top: int = Query(20, ge=0, le=200, description="Number of allocation sites to return"),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    since_baseline: bool = Query(False, description="Show growth since the last baseline instead of totals")
+):
+    """
+    RSS, GC statistics and (with MEMORY_PROFILING) per-stage peaks and top allocation sites
+
+    `since_baseline=true` compares against the snapshot taken at startup or
+    by the last `POST /admin/memory/reset`, which is what shows slow creep.
+    Taking a snapshot walks every traced allocation (hundreds of ms on a
+    large heap), so it runs in the threadpool; keep `top` small on busy
+    replicas.
+    """
+    top_allocations = []
+    if top:
+        top_allocations = await run_in_threadpool(memory_profiler.top_allocations, top, group_by, since_baseline)
+    return {
+        "rss": rss_stats(),
+        "gc": gc_stats(),
+        "decode_budget": image_processor.budget.stats(),
+        "profiling": memory_profiler.stats(),
+        "top_allocations": top_allocations
+    }
+
+
+@router.post("/memory/reset", tags=["Admin"])
+async def reset_memory_stats():
+    """Clear per-stage peaks and take a new allocation baseline"""
+    await run_in_threadpool(memory_profiler.reset)  # snapshots the heap
+    return memory_profiler.stats()
+
+
+@router.get("/loop", tags=["Admin"])
+async def loop_status():
+    """
+    Event-loop lag and the stacks captured while the loop was blocked
+
+    Each stall is recorded when a probe waited longer than
+    LOOP_BLOCK_THRESHOLD_MS; its stack shows the code holding the loop.
+    """
+    return loop_monitor.stats()
+
+
+@router.post("/profile", status_code=202, tags=["Admin"])
+async def start_profile(
+    mode: str = Query(SAMPLING, pattern=f"^({DETERMINISTIC}|{SAMPLING})$"),
+    requests: int = Query(10, ge=1, description="deterministic: number of requests to profile"),
+    seconds: float = Query(30, gt=0, description="Session length (deterministic: upper bound)"),
+    path: str = Query("/api/v1/predict", description="deterministic: path prefix of profiled requests"),
+    interval_ms: float = Query(settings.PROFILING_SAMPLE_INTERVAL_MS, ge=1, le=1000, description="sampling: interval")
+):
+    """
+    Start a CPU profiling session
+
+    - **sampling** (default): records every thread's stack each
+      `interval_ms` for `seconds`. Low overhead; safe under real load.
+    - **deterministic**: cProfile around the next `requests` requests whose
+      path starts with `path`, one at a time, for at most `seconds`. Before
+      Python 3.12 this covers only the event-loop thread, not decode and
+      inference in the threadpool (see `threads` in the response).
+
+    Fetch the results from `GET /admin/profile`.
+    """
+    if requests > settings.PROFILING_MAX_REQUESTS or seconds > settings.PROFILING_MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Limits: {settings.PROFILING_MAX_REQUESTS} requests, {settings.PROFILING_MAX_SECONDS} seconds"
+        )
+
+    session = cpu_profiler.start(mode, requests, seconds, path, interval_ms / 1000)
+    if session is None:
+        return JSONResponse(
+            status_code=409,
+            content={"error": "Conflict", "detail": "A profiling session is already running"}
+        )
+    return session.summary()
+
+
+@router.get("/profile", tags=["Admin"])
+async def get_profile(
+    format: Optional[str] = Query(None, pattern="^(pstats|collapsed|raw)$", description="Return results in this format"),
+    limit: int = Query(50, ge=1, le=1000, description="Rows in the pstats table")
+):
+    """
+    Status of the current or last profiling session, or its results
+
+    - **pstats**: text table (cumulative time, or sample counts)
+    - **collapsed**: folded stacks for flamegraph.pl or speedscope
+    - **raw**: marshalled pstats data, loadable with `pstats.Stats(path)`
+      or snakeviz (deterministic sessions only)
+    """
+    session = cpu_profiler.session
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    if format is None:
+        return session.summary()
+    if format == "raw":
+        if session.mode != DETERMINISTIC:
+            raise HTTPException(status_code=400, detail="raw output is only available for deterministic sessions")
+        return Response(
+            session.render(format),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="profile.pstats"'}
+        )
+    return PlainTextResponse(session.render(format, limit))
+
+
+@router.delete("/profile", tags=["Admin"])
+async def stop_profile():
+    """Finish the current profiling session early (results are kept)"""
+    session = cpu_profiler.stop()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return session.summary()
+
+
+@router.post("/drain", tags=["Admin"])
+async def start_drain(
+    timeout: float = Query(settings.SHUTDOWN_GRACE_PERIOD, ge=0, description="Seconds to wait for in-flight work")
+):
+    """
+    Start draining this replica (use as the preStop hook)
+
+    Readiness fails immediately and new predict, batch, job and stream work
+    is refused with 503. Returns once accepted work has finished or
+    `timeout` expires. Draining cannot be undone; the replica is expected
+    to be terminated afterwards.
+    """
+    drain.begin()
+    idle = await drain.wait_idle(timeout)
+    return {"idle": idle, **drain.stats()}
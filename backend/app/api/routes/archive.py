@@ -0,0 +1,279 @@
+"""
+Archive classification with streamed NDJSON results
+アーカイブ一括分類 (NDJSONストリーミング)
+
+POST /predict/archive takes a zip or tar(.gz) archive and answers with one
+JSON line per image member as soon as it is classified. Members are read
+one at a time, decoded on a few threads and classified in batches while
+the following members decode. Every stage hands over through a bounded
+queue, so memory does not grow with the archive and a client that reads
+slowly pauses the pipeline instead of piling up results.
+"""
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import suppress
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.models.classifier import Prediction
+from app.models.scheduler import BULK, inference_lane
+from app.models.schemas import PredictionResult
+from app.utils.archive import ARCHIVE_ERRORS, iter_archive
+from app.utils.cache import image_hash, prediction_cache
+from app.utils.drain import Admission
+from app.utils.encoding import parse_fields
+from app.utils.image_processing import ImageTooLargeError, image_processor
+from app.utils.prediction_log import prediction_log
+from app.api.deps import admit_inference, get_classifier, priority_lane, reject_when_draining
+from app.api.routes.predict import project_prediction
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+NDJSON = "application/x-ndjson"
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+
+class ArchiveItem:
+    """One archive member on its way through the pipeline"""
+
+    __slots__ = ("index", "name", "content_hash", "image", "prediction", "error")
+
+    def __init__(self, index: int, name: str):
+        self.index = index
+        self.name = name
+        self.content_hash: Optional[str] = None
+        self.image: Optional[np.ndarray] = None
+        self.prediction: Optional[Prediction] = None
+        self.error: Optional[str] = None
+
+
+def _load_member(index: int, name: str, image_bytes: bytes, model_version: Optional[str]) -> ArchiveItem:
+    """Hash, look up and decode one member (runs in the threadpool)"""
+    item = ArchiveItem(index, name)
+    if len(image_bytes) > MAX_IMAGE_BYTES:
+        item.error = "Image larger than 10MB"
+        return item
+
+    item.content_hash = image_hash(image_bytes)
+    item.prediction = prediction_cache.get(item.content_hash, model_version)
+    if item.prediction is not None:
+        return item
+
+    try:
+        # Waits for decode budget like background jobs do, instead of failing the member
+        item.image = image_processor.decode(image_bytes, block=True)
+    except ImageTooLargeError as e:
+        item.error = str(e)
+        return item
+    except Exception as e:
+        logger.warning(f"Failed to decode archive member {name}: {e}")
+    if item.image is None:
+        item.error = "Failed to process image"
+    return item
+
+
+async def _read_members(
+    members: Iterator[Tuple[str, bytes]],
+    decoded: "asyncio.Queue[object]",
+    model_version: Optional[str]
+):
+    """
+    Read members in archive order, decoding up to ARCHIVE_DECODE_WORKERS at a time
+
+    Puts ArchiveItems on `decoded`, then an error message if the archive
+    turned out to be damaged, then None.
+    """
+    slots = asyncio.Semaphore(settings.ARCHIVE_DECODE_WORKERS)
+    loading = set()
+
+    async def load(index: int, name: str, image_bytes: bytes):
+        try:
+            item = await run_in_threadpool(_load_member, index, name, image_bytes, model_version)
+            await decoded.put(item)
+        finally:
+            slots.release()
+
+    try:
+        try:
+            for index in itertools.count():
+                await slots.acquire()
+                member = await run_in_threadpool(next, members, None)
+                if member is None:
+                    slots.release()
+                    break
+                task = asyncio.create_task(load(index, *member))
+                loading.add(task)
+                task.add_done_callback(loading.discard)
+        except Exception as e:
+            # Damaged part way through (ARCHIVE_ERRORS) or anything unexpected:
+            # report it as a line instead of leaving the stream open
+            if not isinstance(e, ARCHIVE_ERRORS):
+                logger.error(f"Archive read failed: {e}", exc_info=True)
+            await asyncio.gather(*loading, return_exceptions=True)
+            await decoded.put(f"Archive read failed: {e}")
+        else:
+            await asyncio.gather(*loading, return_exceptions=True)
+    finally:
+        for task in loading:
+            task.cancel()
+        # Always end the stream, or _stream_results waits on the queue
+        # forever (unless it cancelled this task: then nobody reads it)
+        if not asyncio.current_task().cancelling():
+            await decoded.put(None)
+
+
+def _line(payload: dict) -> str:
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+
+async def _stream_results(
+    members: Iterator[Tuple[str, bytes]],
+    fields: Optional[List[str]],
+    lane: str,
+    admission: Admission,
+    start_time: float
+) -> AsyncIterator[str]:
+    """Classify decoded members in batches and yield one NDJSON line per member (releases `admission`)"""
+    clf = get_classifier()
+    decoded: "asyncio.Queue[object]" = asyncio.Queue(maxsize=settings.ARCHIVE_PIPELINE_DEPTH)
+    count = succeeded = 0
+
+    def render(item: ArchiveItem) -> str:
+        nonlocal count, succeeded
+        count += 1
+        result = None
+        if item.prediction is not None:
+            succeeded += 1
+            processing_time = (time.time() - start_time) * 1000
+            result = project_prediction(item.prediction, processing_time, clf.confidence_threshold, fields)
+        return _line({"index": item.index, "filename": item.name, "result": result, "error": item.error})
+
+    with inference_lane(lane), admission:
+        reader = asyncio.create_task(_read_members(members, decoded, clf.model_version))
+        try:
+            finished = False
+            while not finished:
+                # Take whatever has been decoded (at least one), up to a batch
+                received = [await decoded.get()]
+                while len(received) < settings.ARCHIVE_BATCH_SIZE and not decoded.empty():
+                    received.append(decoded.get_nowait())
+
+                lines = []
+                batch: List[ArchiveItem] = []
+                for item in received:
+                    if item is None:
+                        finished = True
+                    elif isinstance(item, str):
+                        lines.append(_line({"index": None, "filename": None, "result": None, "error": item}))
+                    elif item.image is not None:
+                        batch.append(item)
+                    else:
+                        if item.prediction is not None:
+                            processing_time = (time.time() - start_time) * 1000
+                            prediction_log.record(item.content_hash, item.prediction, processing_time, "archive", True)
+                        lines.append(render(item))
+
+                if batch:
+                    try:
+                        predictions = await run_in_threadpool(clf.predict_batch, np.stack([item.image for item in batch]))
+                    except Exception as e:
+                        logger.error(f"Archive batch failed: {e}")
+                        predictions = [None] * len(batch)
+                    processing_time = (time.time() - start_time) * 1000
+                    for item, prediction in zip(batch, predictions):
+                        item.image = None
+                        item.prediction = prediction
+                        if prediction is None:
+                            item.error = "Inference failed"
+                            continue
+                        prediction_cache.set(item.content_hash, prediction)
+                        prediction_log.record(item.content_hash, prediction, processing_time, "archive", False)
+                    lines.extend(render(item) for item in batch)
+
+                if lines:
+                    yield "".join(lines)
+
+            processing_time = (time.time() - start_time) * 1000
+            logger.info(f"✅ Archive complete: {succeeded}/{count} images in {processing_time:.2f}ms")
+            yield _line({"summary": {
+                "count": count,
+                "succeeded": succeeded,
+                "failed": count - succeeded,
+                "processing_time_ms": processing_time
+            }})
+        finally:
+            # Client gone or stream finished: stop reading and decoding
+            reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await reader
+
+
+@router.post(
+    "/predict/archive",
+    dependencies=[Depends(reject_when_draining)],
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON: {}}, "description": "One JSON object per line"}},
+    tags=["Classification"]
+)
+async def predict_archive(
+    file: UploadFile = File(..., description="zip or tar(.gz) archive of images"),
+    fields: Optional[str] = Query(None, description="Comma-separated PredictionResult fields to return"),
+    compact: bool = Query(False, description="Return only predicted_class, confidence and all_probabilities"),
+    lane: str = Depends(priority_lane(BULK))
+):
+    """
+    Classify every image in an archive, streaming results as NDJSON
+
+    Each line is `{"index", "filename", "result", "error"}` for one image
+    member, written as soon as that image is classified (so not
+    necessarily in archive order); the last line is `{"summary": {...}}`.
+    Members that cannot be classified get an `error` instead of failing the
+    archive. Memory use is bounded regardless of archive size.
+
+    **Parameters:**
+    - **file**: zip, tar, tar.gz, tar.bz2 or tar.xz archive (images up to 10MB each)
+    - **fields** / **compact**: return only some fields of each result
+    - **X-Priority** (header, optional): `interactive` to run ahead of bulk
+      traffic (default `bulk`)
+    """
+    start_time = time.time()
+
+    max_bytes = settings.ARCHIVE_MAX_UPLOAD_MB * 1024 * 1024
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Archive too large. Max {settings.ARCHIVE_MAX_UPLOAD_MB}MB allowed."
+        )
+    result_fields = parse_fields(fields, compact, PredictionResult.model_fields.keys())
+
+    # Open the archive and read the first member here, so an unreadable or
+    # empty archive is a 400 rather than an error line in a 200 stream
+    try:
+        members = iter_archive(file.file, MAX_IMAGE_BYTES)
+        first = await run_in_threadpool(next, members, None)
+    except ARCHIVE_ERRORS as e:
+        raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+    if first is None:
+        raise HTTPException(status_code=400, detail="No images found in archive")
+
+    # Admitted here, before the response starts, so a drain waits for the
+    # whole stream. The generator releases it; the background task covers a
+    # stream that was never iterated (release is idempotent)
+    admission = admit_inference()
+    logger.info(f"Processing archive: {file.filename}")
+    return StreamingResponse(
+        _stream_results(itertools.chain([first], members), result_fields, lane, admission, start_time),
+        media_type=NDJSON,
+        background=BackgroundTask(admission.release)
+    )
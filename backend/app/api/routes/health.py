@@ -3,12 +3,15 @@ Health check endpoints
 ヘルスチェックエンドポイント
 """
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
+from fastapi.responses import JSONResponse
 from datetime import datetime
 
 from app.models.schemas import HealthResponse
 from app.models.classifier import classifier
 from app.core.config import settings
+from app.core.metrics import CONTENT_TYPE_LATEST, render_metrics
+from app.utils.drain import drain
 
 router = APIRouter()
 
@@ -28,7 +31,28 @@ async def health_check():
     )
 
 
+@router.get("/ready", tags=["Health"])
+async def readiness_check():
+    """
+    Readiness probe
+    
+    503 until the model is loaded and as soon as the replica starts
+    draining, so load balancers stop routing new requests here.
+    """
+    if drain.draining:
+        return JSONResponse(status_code=503, content={"status": "draining", **drain.stats()})
+    if not classifier.is_loaded():
+        return JSONResponse(status_code=503, content={"status": "model_not_loaded"})
+    return {"status": "ready", "model_version": classifier.model_version}
+
+
 @router.get("/model-info", tags=["Health"])
 async def model_info():
     """Get detailed model information"""
-    return classifier.get_model_info()
\ No newline at end of file
+    return classifier.get_model_info()
+
+
+@router.get("/metrics", tags=["Health"])
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,153 @@
+"""
+Asynchronous batch job endpoints
+非同期バッチジョブのエンドポイント
+"""
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import List
+import asyncio
+import json
+import logging
+
+from app.api.deps import admit_inference, reject_when_draining, require_jobs_enabled
+from app.core.config import settings
+from app.models.schemas import JobStatus
+from app.utils.archive import ARCHIVE_ERRORS, iter_archive
+from app.utils.job_store import TERMINAL_STATUSES, job_store
+from app.utils.job_worker import job_worker
+
+router = APIRouter(dependencies=[Depends(require_jobs_enabled)])
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+
+def _store_inputs(job_id: str, files: List[UploadFile]) -> List[str]:
+    """
+    Write uploaded images and archive members to the job directory
+
+    Returns:
+        List[str]: Item names in submission order
+    """
+    names: List[str] = []
+    max_total = settings.JOB_MAX_UPLOAD_MB * 1024 * 1024
+    total_bytes = 0
+
+    for upload in files:
+        content_type = upload.content_type or ""
+        if content_type.startswith("image/"):
+            members = [(upload.filename or f"image_{len(names)}", upload.file.read(MAX_IMAGE_BYTES + 1))]
+        else:
+            members = iter_archive(upload.file, MAX_IMAGE_BYTES)
+
+        # Archives are read lazily, so a damaged one only fails part way through
+        members = iter(members)
+        while True:
+            try:
+                member = next(members, None)
+            except ARCHIVE_ERRORS as e:
+                raise HTTPException(status_code=400, detail=f"{upload.filename}: unreadable archive ({e})")
+            if member is None:
+                break
+            name, image_bytes = member
+            if len(image_bytes) > MAX_IMAGE_BYTES:
+                raise HTTPException(status_code=400, detail=f"{name}: image larger than 10MB")
+            total_bytes += len(image_bytes)
+            if total_bytes > max_total:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Job too large. Max {settings.JOB_MAX_UPLOAD_MB}MB allowed."
+                )
+            job_store.input_path(job_id, len(names)).write_bytes(image_bytes)
+            names.append(name)
+
+    return names
+
+
+@router.post(
+    "/jobs",
+    status_code=202,
+    response_model=JobStatus,
+    dependencies=[Depends(reject_when_draining)],
+    tags=["Jobs"]
+)
+async def create_job(
+    files: List[UploadFile] = File(..., description="Images and/or zip/tar archives")
+):
+    """
+    Submit a batch classification job
+
+    Returns immediately with a job id. Images are classified in the
+    background at lower priority than /predict; poll `/jobs/{job_id}` or
+    stream `/jobs/{job_id}/events` for progress.
+    """
+    # Tracked so a drain waits until the job is persisted. SQLite and file
+    # I/O run in the threadpool: the worker thread holds the store's lock
+    # while it writes results
+    with admit_inference():
+        job_id = await run_in_threadpool(job_store.new_job_id)
+        try:
+            names = await run_in_threadpool(_store_inputs, job_id, files)
+            if not names:
+                raise HTTPException(status_code=400, detail="No images found in upload")
+            await run_in_threadpool(job_store.create_job, job_id, names)
+        except Exception:
+            await run_in_threadpool(job_store.discard_inputs, job_id)
+            raise
+        job_worker.notify()
+
+    logger.info(f"Job {job_id} queued with {len(names)} images")
+    return await run_in_threadpool(job_store.get_job, job_id)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus, tags=["Jobs"])
+async def get_job(job_id: str):
+    """Job status and progress"""
+    job = await run_in_threadpool(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+@router.get("/jobs/{job_id}/results", tags=["Jobs"])
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Finished results in submission order (paginated)"""
+    job = await run_in_threadpool(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    items = await run_in_threadpool(job_store.get_results, job_id, offset, limit)
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "offset": offset,
+        "items": items,
+        "next_offset": offset + len(items) if len(items) == limit else None
+    }
+
+
+@router.get("/jobs/{job_id}/events", tags=["Jobs"])
+async def stream_job_events(job_id: str):
+    """Server-Sent Events stream of job progress until the job finishes"""
+    if await run_in_threadpool(job_store.get_job, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    async def events():
+        last = None
+        while True:
+            job = await run_in_threadpool(job_store.get_job, job_id)
+            snapshot = (job["status"], job["completed"], job["failed"])
+            if snapshot != last:
+                yield f"data: {json.dumps(job)}\n\n"
+                last = snapshot
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(1.0)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -3,24 +3,247 @@ Prediction endpoints
 予測エンドポイント
 """
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, Query
-from typing import Optional
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Path, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
 import logging
 import time
 
-from app.models.schemas import PredictionResult, ErrorResponse
-from app.models.classifier import classifier
-from app.utils.image_processing import image_processor
-from app.api.deps import validate_image_file, get_classifier, get_image_processor
+import numpy as np
+
+from app.core.config import settings
+from app.core.tracing import span
+from app.models.schemas import BatchItemResult, BatchPredictionResponse, PredictionResult, ErrorResponse
+from app.models.classifier import Prediction
+from app.models.scheduler import BULK, INTERACTIVE, inference_lane
+from app.models.tf_preprocess import TF, UndecodableImageError
+from app.utils.cache import image_hash, prediction_cache
+from app.utils.deadline import ClientDisconnected, RequestAborted, request_deadline
+from app.utils.encoding import encode
+from app.utils.image_processing import DecodeBudgetExceeded, ImageTooLargeError
+from app.utils.prediction_log import prediction_log
+from app.utils.memory_profiler import memory_profiler
+from app.api.deps import (
+    ResponseFormat,
+    admit_inference,
+    get_classifier,
+    get_image_processor,
+    get_request_timeout,
+    get_response_format,
+    is_tensor_upload,
+    priority_lane,
+    reject_when_draining,
+    validate_image_file,
+    validate_tensor_file,
+)
 from app.core.garbage_rules import GARBAGE_RULES
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/predict", response_model=PredictionResult, tags=["Classification"])
+
+def build_prediction_result(
+    prediction: Prediction,
+    processing_time: float,
+    confidence_threshold: float
+) -> PredictionResult:
+    """
+    Build the API response for a prediction
+    
+    Args:
+        prediction: Model prediction
+        processing_time: Request processing time in milliseconds
+        confidence_threshold: Threshold below which users should confirm
+        
+    Returns:
+        PredictionResult: Prediction with Japanese garbage rules
+        
+    Raises:
+        HTTPException: If the model returned an unknown category
+    """
+    predicted_class = prediction.predicted_class
+    confidence = prediction.confidence
+    
+    # Get garbage rules
+    if predicted_class not in GARBAGE_RULES:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Unknown category returned: {predicted_class}"
+        )
+    
+    rule = GARBAGE_RULES[predicted_class]
+    
+    return PredictionResult(
+        # Prediction
+        predicted_class=predicted_class,
+        confidence=confidence,
+        confidence_percentage=f"{confidence*100:.1f}%",
+        
+        # Bilingual names
+        japanese_name=rule.japanese_name,
+        hiragana=rule.hiragana,
+        english_name=rule.english_name,
+        
+        # Descriptions
+        description_ja=rule.description_ja,
+        description_en=rule.description_en,
+        
+        # Examples
+        examples_ja=rule.examples_ja,
+        examples_en=rule.examples_en,
+        
+        # Collection
+        collection_day_ja=rule.collection_day_ja,
+        collection_day_en=rule.collection_day_en,
+        collection_frequency=rule.collection_frequency,
+        
+        # Preparation
+        preparation_steps=[
+            {"japanese": step.japanese, "english": step.english}
+            for step in rule.preparation_steps
+        ],
+        
+        # Notes
+        notes_ja=rule.notes_ja,
+        notes_en=rule.notes_en,
+        
+        # Visual
+        color=rule.color,
+        icon=rule.icon,
+        
+        # Probabilities
+        all_probabilities=prediction.all_probabilities,
+        
+        # Confidence check
+        needs_confirmation=confidence < confidence_threshold,
+        confidence_level="high" if confidence >= 0.80 else "medium" if confidence >= 0.60 else "low",
+        
+        # Metadata
+        processing_time_ms=processing_time,
+        model_version=prediction.model_version
+    )
+
+
+async def read_upload(file: UploadFile, client_token: Optional[str]) -> Tuple[bytes, bool]:
+    """
+    Validate an upload as an encoded image or a trusted tensor
+    
+    Returns:
+        Tuple of (content, is_tensor)
+    """
+    if is_tensor_upload(file):
+        return await validate_tensor_file(file, client_token), True
+    return await validate_image_file(file), False
+
+
+def abandoned(error: RequestAborted) -> HTTPException:
+    """
+    Response for a request whose work was cancelled
+    
+    504 when the deadline passed; 499 (the nginx convention, logged only)
+    when the client is already gone.
+    """
+    if isinstance(error, ClientDisconnected):
+        return HTTPException(status_code=499, detail="Client closed request")
+    return HTTPException(
+        status_code=504,
+        detail=f"Request deadline exceeded before {error.stage}. Please retry."
+    )
+
+
+def decode_upload(image_bytes: bytes, content_type: str, is_tensor: bool) -> Optional[np.ndarray]:
+    """
+    Decode an upload to a uint8 batch of one (1, 224, 224, 3)
+    
+    Tensor uploads are wrapped without copying; images go through PIL.
+    """
+    img_processor = get_image_processor()
+    if is_tensor:
+        return img_processor.from_tensor(image_bytes, content_type.split(";")[0].strip())
+    
+    image = img_processor.decode(image_bytes)
+    return image[np.newaxis] if image is not None else None
+
+
+def predict_encoded(clf, encoded: List[bytes], decoded_bytes: int) -> List[Prediction]:
+    """
+    Classify encoded images with the TF preprocessing backend
+    
+    Holds decode budget for the pixels TF decodes, under the same rules as
+    PIL decoding.
+    """
+    with get_image_processor().reserve(decoded_bytes):
+        return clf.predict_encoded(encoded)
+
+
+async def _predict_encoded_one(clf, image_bytes: bytes) -> Prediction:
+    """Check one upload's header, then decode and classify it in TF"""
+    with span("validate_header"):
+        decoded_bytes = await run_in_threadpool(get_image_processor().inspect, image_bytes)
+    try:
+        if decoded_bytes is not None:
+            return (await run_in_threadpool(predict_encoded, clf, [image_bytes], decoded_bytes))[0]
+    except UndecodableImageError as e:
+        logger.warning(f"⚠️ TF could not decode upload: {e}")
+    raise HTTPException(
+        status_code=400,
+        detail="Failed to process image. Please upload a valid image file."
+    )
+
+
+def render_prediction(
+    prediction: Prediction,
+    processing_time: float,
+    confidence_threshold: float,
+    fmt: ResponseFormat
+):
+    """
+    Build the response for one prediction in the negotiated format
+    
+    Projections that only need model output skip building the full
+    PredictionResult (rules, descriptions, timestamp) altogether.
+    """
+    if fmt.is_default:
+        return build_prediction_result(prediction, processing_time, confidence_threshold)
+    return encode(project_prediction(prediction, processing_time, confidence_threshold, fmt.fields), fmt.media_type)
+
+
+def project_prediction(
+    prediction: Prediction,
+    processing_time: float,
+    confidence_threshold: float,
+    fields: Optional[List[str]]
+) -> dict:
+    """JSON-compatible prediction document restricted to `fields` (None = all)"""
+    model_fields = {
+        "predicted_class": prediction.predicted_class,
+        "confidence": prediction.confidence,
+        "all_probabilities": prediction.all_probabilities,
+        "model_version": prediction.model_version,
+        "processing_time_ms": processing_time
+    }
+    if fields is not None and set(fields) <= model_fields.keys():
+        return {name: model_fields[name] for name in fields}
+    
+    result = build_prediction_result(prediction, processing_time, confidence_threshold)
+    return result.model_dump(mode="json", include=set(fields) if fields is not None else None)
+
+
+@router.post(
+    "/predict",
+    response_model=PredictionResult,
+    dependencies=[Depends(reject_when_draining)],
+    tags=["Classification"]
+)
 async def predict_garbage(
+    request: Request,
     file: UploadFile = File(..., description="Image file to classify"),
-    language: str = Query("both", regex="^(ja|en|both)$", description="Response language")
+    language: str = Query("both", regex="^(ja|en|both)$", description="Response language"),
+    x_client_token: Optional[str] = Header(None, description="Trusted client token (tensor uploads)"),
+    x_content_sha256: Optional[str] = Header(None, description="SHA-256 of the file, as sent to /predict/lookup"),
+    fmt: ResponseFormat = Depends(get_response_format),
+    lane: str = Depends(priority_lane(INTERACTIVE)),
+    timeout: float = Depends(get_request_timeout)
 ):
     """
     Classify garbage image
@@ -28,8 +251,19 @@ async def predict_garbage(
     Upload an image and get classification with Japanese garbage rules.
     
     **Parameters:**
-    - **file**: Image file (JPEG, PNG, WEBP)
+    - **file**: Image file (JPEG, PNG, WEBP), or for trusted clients a
+      pre-decoded uint8 224x224x3 tensor (`application/x-npy` or raw
+      `application/octet-stream`)
     - **language**: Response language (ja=Japanese, en=English, both=Bilingual)
+    - **X-Content-SHA256** (header, optional): hash the client already sent
+      to `/predict/lookup`; the upload is rejected if it does not match
+    - **fields** / **compact**: return only some fields of the result
+    - **Accept**: `application/msgpack` or `application/cbor` for binary
+      responses (JSON is the default)
+    - **X-Priority** (header, optional): `bulk` to run behind interactive
+      traffic (default `interactive`)
+    - **X-Request-Timeout** (header, optional): seconds the client will
+      wait; work still pending after that is dropped and 504 is returned
     
     **Returns:**
     - Predicted category with confidence
@@ -39,98 +273,95 @@ async def predict_garbage(
     """
     start_time = time.time()
     
+    # Work for expired or disconnected requests is dropped before decode and inference
+    async with request_deadline(request, timeout):
+        with inference_lane(lane), admit_inference(), memory_profiler.request():
+            return await _predict(file, x_client_token, x_content_sha256, fmt, start_time)
+
+
+async def _predict(
+    file: UploadFile,
+    client_token: Optional[str],
+    claimed_hash: Optional[str],
+    fmt: ResponseFormat,
+    start_time: float
+):
+    """Validate, classify and build the response for one upload"""
     try:
         # Validate file
-        image_bytes = await validate_image_file(file)
+        with memory_profiler.stage("upload"), span("validate"):
+            image_bytes, is_tensor = await read_upload(file, client_token)
         logger.info(f"Processing file: {file.filename}")
         
-        # Preprocess image
-        img_processor = get_image_processor()
-        image_array = img_processor.preprocess(image_bytes)
-        
-        if image_array is None:
-            raise HTTPException(
-                status_code=400,
-                detail="Failed to process image. Please upload a valid image file."
-            )
-        
         # Get classifier
         clf = get_classifier()
         
-        # Predict
-        predicted_class, confidence, all_probs = clf.predict(image_array)
-        
-        # Get garbage rules
-        if predicted_class not in GARBAGE_RULES:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Unknown category returned: {predicted_class}"
-            )
+        # Serve repeat images from the cache (keyed by content hash + model version)
+        with span("cache"):
+            content_hash = image_hash(image_bytes)
+            if claimed_hash is not None and claimed_hash.lower() != content_hash:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Content hash mismatch: X-Content-SHA256 does not match the uploaded file"
+                )
+            prediction = prediction_cache.get(content_hash, clf.model_version)
         
-        rule = GARBAGE_RULES[predicted_class]
+        if prediction is None:
+            if settings.PREPROCESS_BACKEND == TF and not is_tensor:
+                # Decode, resize and scaling run inside the model's graph
+                with memory_profiler.stage("predict"):
+                    prediction = await _predict_encoded_one(clf, image_bytes)
+            else:
+                # Decode to uint8 (tensor uploads skip PIL; scaling happens inside the model
+                # call); decoding may wait for budget
+                with memory_profiler.stage("decode"):
+                    if is_tensor:
+                        image_array = decode_upload(image_bytes, file.content_type, is_tensor)
+                    else:
+                        image_array = await run_in_threadpool(decode_upload, image_bytes, file.content_type, is_tensor)
+                
+                if image_array is None:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Failed to process image. Please upload a valid image file."
+                    )
+                
+                # Predict
+                with memory_profiler.stage("predict"):
+                    prediction = await run_in_threadpool(clf.predict, image_array)
+            prediction_cache.set(content_hash, prediction)
+            cached = False
+        else:
+            logger.info(f"Cache hit: {content_hash[:12]} (model {prediction.model_version})")
+            cached = True
         
         # Calculate processing time
         processing_time = (time.time() - start_time) * 1000
+        prediction_log.record(content_hash, prediction, processing_time, "predict", cached)
         
         # Build response
-        result = PredictionResult(
-            # Prediction
-            predicted_class=predicted_class,
-            confidence=confidence,
-            confidence_percentage=f"{confidence*100:.1f}%",
-            
-            # Bilingual names
-            japanese_name=rule.japanese_name,
-            hiragana=rule.hiragana,
-            english_name=rule.english_name,
-            
-            # Descriptions
-            description_ja=rule.description_ja,
-            description_en=rule.description_en,
-            
-            # Examples
-            examples_ja=rule.examples_ja,
-            examples_en=rule.examples_en,
-            
-            # Collection
-            collection_day_ja=rule.collection_day_ja,
-            collection_day_en=rule.collection_day_en,
-            collection_frequency=rule.collection_frequency,
-            
-            # Preparation
-            preparation_steps=[
-                {"japanese": step.japanese, "english": step.english}
-                for step in rule.preparation_steps
-            ],
-            
-            # Notes
-            notes_ja=rule.notes_ja,
-            notes_en=rule.notes_en,
-            
-            # Visual
-            color=rule.color,
-            icon=rule.icon,
-            
-            # Probabilities
-            all_probabilities=all_probs,
-            
-            # Confidence check
-            needs_confirmation=confidence < clf.confidence_threshold,
-            confidence_level="high" if confidence >= 0.80 else "medium" if confidence >= 0.60 else "low",
-            
-            # Metadata
-            processing_time_ms=processing_time
-        )
+        with memory_profiler.stage("response"), span("response"):
+            result = render_prediction(prediction, processing_time, clf.confidence_threshold, fmt)
         
         logger.info(
-            f"✅ Prediction complete: {predicted_class} "
-            f"({confidence*100:.1f}%) in {processing_time:.2f}ms"
+            f"✅ Prediction complete: {prediction.predicted_class} "
+            f"({prediction.confidence*100:.1f}%) in {processing_time:.2f}ms"
         )
         
         return result
         
     except HTTPException:
         raise
+    except RequestAborted as e:
+        raise abandoned(e)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except DecodeBudgetExceeded:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy decoding other images. Please retry.",
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
         logger.error(f"Prediction error: {e}", exc_info=True)
         raise HTTPException(
@@ -139,14 +370,192 @@ async def predict_garbage(
         )
 
 
-@router.post("/predict/batch", tags=["Classification"])
-async def predict_batch():
+@router.get("/predict/lookup/{content_hash}", response_model=PredictionResult, tags=["Classification"])
+async def lookup_prediction(
+    content_hash: str = Path(..., pattern="^[0-9a-fA-F]{64}$", description="SHA-256 of the image file"),
+    fmt: ResponseFormat = Depends(get_response_format)
+):
+    """
+    Look up a cached prediction by image hash
+    
+    Hash-first upload protocol: send the SHA-256 of the file first and only
+    upload it to `/predict` (with `X-Content-SHA256`) on a 404. Only
+    predictions from the currently served model version are returned.
+    """
+    start_time = time.time()
+    clf = get_classifier()
+    
+    prediction = prediction_cache.get(content_hash.lower(), clf.model_version)
+    if prediction is None:
+        raise HTTPException(status_code=404, detail="No cached prediction for this hash")
+    
+    processing_time = (time.time() - start_time) * 1000
+    logger.info(f"✅ Lookup hit: {content_hash[:12]} (model {prediction.model_version})")
+    
+    return render_prediction(prediction, processing_time, clf.confidence_threshold, fmt)
+
+
+@router.post(
+    "/predict/batch",
+    response_model=BatchPredictionResponse,
+    dependencies=[Depends(reject_when_draining)],
+    tags=["Classification"]
+)
+async def predict_batch(
+    request: Request,
+    files: List[UploadFile] = File(..., description="Images or trusted tensors to classify"),
+    x_client_token: Optional[str] = Header(None, description="Trusted client token (tensor uploads)"),
+    fmt: ResponseFormat = Depends(get_response_format),
+    lane: str = Depends(priority_lane(BULK)),
+    timeout: float = Depends(get_request_timeout)
+):
     """
-    Batch prediction endpoint (future feature)
+    Classify several images with a single batched model call
     
-    For processing multiple images at once.
+    Accepts the same inputs and response options (`fields`, `compact`,
+    `Accept`) as `/predict`. Invalid files are reported per item without
+    failing the whole batch. Runs in the bulk lane unless the request sends
+    `X-Priority: interactive`. `X-Request-Timeout` applies to the whole batch.
     """
-    return {
-        "message": "Batch prediction not yet implemented",
-        "status": "coming_soon"
-    }
\ No newline at end of file
+    start_time = time.time()
+    
+    async with request_deadline(request, timeout):
+        with inference_lane(lane), admit_inference():
+            try:
+                return await _predict_batch(files, x_client_token, fmt, start_time)
+            except RequestAborted as e:
+                raise abandoned(e)
+
+
+async def _predict_batch(
+    files: List[UploadFile],
+    client_token: Optional[str],
+    fmt: ResponseFormat,
+    start_time: float
+):
+    """Validate, classify and build the response for a batch of uploads"""
+    if len(files) > settings.BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files: {len(files)}. Max {settings.BATCH_MAX_FILES} allowed."
+        )
+    
+    clf = get_classifier()
+    predictions: List[Optional[Prediction]] = [None] * len(files)
+    errors: List[Optional[str]] = [None] * len(files)
+    hashes: List[Optional[str]] = [None] * len(files)
+    pending: List[int] = []
+    arrays: List[np.ndarray] = []
+    use_tf = settings.PREPROCESS_BACKEND == TF
+    encoded_pending: List[int] = []
+    encoded: List[bytes] = []
+    decoded_bytes = 0
+    
+    for i, file in enumerate(files):
+        try:
+            image_bytes, is_tensor = await read_upload(file, client_token)
+        except HTTPException as e:
+            errors[i] = e.detail
+            continue
+        
+        hashes[i] = image_hash(image_bytes)
+        predictions[i] = prediction_cache.get(hashes[i], clf.model_version)
+        if predictions[i] is not None:
+            continue
+        
+        if use_tf and not is_tensor:
+            # Header checks only; the pixels are decoded in one TF call below
+            try:
+                image_size = await run_in_threadpool(get_image_processor().inspect, image_bytes)
+            except ImageTooLargeError as e:
+                errors[i] = str(e)
+                continue
+            if image_size is None:
+                errors[i] = "Failed to process image"
+                continue
+            encoded_pending.append(i)
+            encoded.append(image_bytes)
+            decoded_bytes += image_size
+            continue
+        
+        try:
+            image_array = await run_in_threadpool(decode_upload, image_bytes, file.content_type, is_tensor)
+        except (ImageTooLargeError, DecodeBudgetExceeded) as e:
+            errors[i] = str(e)
+            continue
+        if image_array is None:
+            errors[i] = "Failed to process image"
+            continue
+        
+        pending.append(i)
+        arrays.append(image_array)
+    
+    if encoded:
+        try:
+            batch_predictions = await run_in_threadpool(predict_encoded, clf, encoded, decoded_bytes)
+        except DecodeBudgetExceeded as e:
+            for i in encoded_pending:
+                errors[i] = str(e)
+        except UndecodableImageError as e:
+            # An image is broken past its header: fall back to PIL, which reports it per file
+            logger.warning(f"⚠️ TF could not decode the batch, using PIL: {e}")
+            for i, image_bytes in zip(encoded_pending, encoded):
+                try:
+                    image_array = await run_in_threadpool(decode_upload, image_bytes, files[i].content_type, False)
+                except (ImageTooLargeError, DecodeBudgetExceeded) as e:
+                    errors[i] = str(e)
+                    continue
+                if image_array is None:
+                    errors[i] = "Failed to process image"
+                    continue
+                pending.append(i)
+                arrays.append(image_array)
+        else:
+            for i, prediction in zip(encoded_pending, batch_predictions):
+                predictions[i] = prediction
+                prediction_cache.set(hashes[i], prediction)
+    
+    if arrays:
+        batch_predictions = await run_in_threadpool(clf.predict_batch, np.concatenate(arrays))
+        for i, prediction in zip(pending, batch_predictions):
+            predictions[i] = prediction
+            prediction_cache.set(hashes[i], prediction)
+    
+    processing_time = (time.time() - start_time) * 1000
+    inferred = set(pending) | set(encoded_pending)
+    for i, prediction in enumerate(predictions):
+        if prediction is not None:
+            prediction_log.record(hashes[i], prediction, processing_time, "batch", i not in inferred)
+    succeeded = sum(1 for prediction in predictions if prediction is not None)
+    logger.info(f"✅ Batch complete: {succeeded}/{len(files)} images in {processing_time:.2f}ms")
+    
+    if not fmt.is_default:
+        return encode({
+            "count": len(files),
+            "succeeded": succeeded,
+            "processing_time_ms": processing_time,
+            "results": [
+                {
+                    "filename": file.filename,
+                    "result": project_prediction(prediction, processing_time, clf.confidence_threshold, fmt.fields)
+                    if prediction is not None else None,
+                    "error": error
+                }
+                for file, prediction, error in zip(files, predictions, errors)
+            ]
+        }, fmt.media_type)
+    
+    return BatchPredictionResponse(
+        count=len(files),
+        succeeded=succeeded,
+        processing_time_ms=processing_time,
+        results=[
+            BatchItemResult(
+                filename=file.filename,
+                result=build_prediction_result(prediction, processing_time, clf.confidence_threshold)
+                if prediction is not None else None,
+                error=error
+            )
+            for file, prediction, error in zip(files, predictions, errors)
+        ]
+    )
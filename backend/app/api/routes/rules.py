@@ -0,0 +1,144 @@
+"""
+Garbage rules endpoints (cacheable)
+ゴミ分別ルールのエンドポイント（キャッシュ可能）
+
+The rules are static, so every response body is serialized and compressed
+once at import time. Responses carry strong ETags and a long Cache-Control,
+and conditional requests (If-None-Match) are answered with 304.
+"""
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+import gzip
+import hashlib
+import json
+import logging
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.garbage_rules import GARBAGE_RULES, get_garbage_rule
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+LANGUAGES = ("both", "ja", "en")
+
+
+class PrecomputedBody:
+    """One JSON document with its compressed variants and their ETags"""
+
+    def __init__(self, payload):
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:32]
+
+        # encoding -> (body, etag); each representation has its own strong ETag
+        self.variants: Dict[str, Tuple[bytes, str]] = {
+            "identity": (body, f'"{digest}"'),
+            "gzip": (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"'),
+        }
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+
+        self.etags = {etag for _, etag in self.variants.values()}
+
+
+def _build_bodies() -> Dict[Tuple[Optional[str], str], PrecomputedBody]:
+    """Serialize the full rule set and each category in every language"""
+    bodies = {}
+    for language in LANGUAGES:
+        bodies[(None, language)] = PrecomputedBody({
+            category: get_garbage_rule(category, language) for category in GARBAGE_RULES
+        })
+        for category in GARBAGE_RULES:
+            bodies[(category, language)] = PrecomputedBody(get_garbage_rule(category, language))
+    return bodies
+
+
+RULE_BODIES = _build_bodies()
+
+
+def _choose_encoding(accept_encoding: str, available) -> str:
+    """Pick the best encoding the client accepts (br > gzip > identity)"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def _if_none_match(header: Optional[str], etags) -> Optional[str]:
+    """Return the matching ETag if If-None-Match matches any variant (weak comparison)"""
+    if not header:
+        return None
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return next(iter(etags))
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate in etags:
+            return candidate
+    return None
+
+
+def _serve(request: Request, body: PrecomputedBody) -> Response:
+    """Serve a precomputed body, honoring If-None-Match and Accept-Encoding"""
+    headers = {
+        "Cache-Control": f"public, max-age={settings.RULES_CACHE_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+
+    matched = _if_none_match(request.headers.get("if-none-match"), body.etags)
+    if matched is not None:
+        headers["ETag"] = matched
+        return Response(status_code=304, headers=headers)
+
+    encoding = _choose_encoding(request.headers.get("accept-encoding", ""), body.variants)
+    content, etag = body.variants[encoding]
+    headers["ETag"] = etag
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+@router.get("/rules", tags=["Rules"])
+async def get_all_rules(
+    request: Request,
+    language: str = Query("both", pattern="^(ja|en|both)$", description="Response language")
+):
+    """
+    Collection rules for every category
+
+    Static and cacheable: clients can fetch the rules once and revalidate
+    with `If-None-Match`.
+    """
+    return _serve(request, RULE_BODIES[(None, language)])
+
+
+@router.get("/rules/{category}", tags=["Rules"])
+async def get_category_rules(
+    request: Request,
+    category: str,
+    language: str = Query("both", pattern="^(ja|en|both)$", description="Response language")
+):
+    """Collection rules for one category"""
+    body = RULE_BODIES.get((category, language))
+    if body is None:
+        raise HTTPException(status_code=404, detail=f"Unknown category: {category}")
+    return _serve(request, body)
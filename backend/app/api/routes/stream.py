@@ -0,0 +1,235 @@
+"""
+WebSocket streaming classification for live cameras
+ライブカメラ用WebSocketストリーミング分類
+
+Clients send encoded frames (JPEG/PNG/WEBP) as binary messages over one
+connection. The server keeps only the latest unprocessed frame: frames that
+arrive while inference is busy replace the pending one and are counted as
+dropped. Frames nearly identical to the last classified frame reuse its
+prediction instead of running the model.
+"""
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from typing import Dict, Optional, Tuple
+import asyncio
+import itertools
+import logging
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.models.classifier import Prediction, classifier
+from app.utils.drain import drain
+from app.utils.image_processing import DecodeBudgetExceeded, ImageTooLargeError, image_processor
+from app.utils.prediction_log import prediction_log
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_SIZE = 16
+
+_connection_ids = itertools.count(1)
+
+
+class StreamStats:
+    """Per-connection frame counters"""
+
+    def __init__(self, connection_id: int, client: str):
+        self.connection_id = connection_id
+        self.client = client
+        self.started_at = time.monotonic()
+        self.received = 0
+        self.dropped = 0       # replaced by a newer frame before inference
+        self.skipped = 0       # near-duplicate, previous prediction reused
+        self.inferred = 0
+        self.failed = 0
+
+    def as_dict(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return {
+            "connection_id": self.connection_id,
+            "client": self.client,
+            "duration_s": round(elapsed, 1),
+            "frames_received": self.received,
+            "frames_dropped": self.dropped,
+            "frames_skipped": self.skipped,
+            "frames_inferred": self.inferred,
+            "frames_failed": self.failed,
+            "receive_fps": round(self.received / elapsed, 2),
+            "inference_fps": round(self.inferred / elapsed, 2),
+            "drop_rate": round(self.dropped / self.received, 3) if self.received else 0.0
+        }
+
+
+# Active connections, for the /stream/stats endpoint
+active_streams: Dict[int, StreamStats] = {}
+
+
+class LatestFrame:
+    """Single-slot mailbox: a new frame replaces the one still waiting"""
+
+    def __init__(self):
+        self.frame: Optional[Tuple[int, bytes]] = None
+        self.ready = asyncio.Event()
+
+    def put(self, seq: int, data: bytes) -> bool:
+        """Store a frame; returns True if a pending frame was dropped"""
+        dropped = self.frame is not None
+        self.frame = (seq, data)
+        self.ready.set()
+        return dropped
+
+    async def take(self) -> Tuple[int, bytes]:
+        await self.ready.wait()
+        self.ready.clear()
+        frame, self.frame = self.frame, None
+        return frame
+
+
+def _fingerprint(image: np.ndarray) -> np.ndarray:
+    """16x16 grayscale thumbnail of a decoded (224, 224, 3) frame"""
+    h, w = image.shape[:2]
+    block_h, block_w = h // FINGERPRINT_SIZE, w // FINGERPRINT_SIZE
+    gray = image[:block_h * FINGERPRINT_SIZE, :block_w * FINGERPRINT_SIZE].mean(axis=2)
+    return gray.reshape(FINGERPRINT_SIZE, block_h, FINGERPRINT_SIZE, block_w).mean(axis=(1, 3))
+
+
+class FrameClassifier:
+    """Decode frames and classify them, reusing predictions for unchanged scenes"""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._last_fingerprint: Optional[np.ndarray] = None
+        self._last_prediction: Optional[Prediction] = None
+
+    def classify(self, frame: bytes) -> Tuple[Optional[Prediction], bool]:
+        """
+        Classify one frame (runs in a worker thread)
+
+        Returns:
+            Tuple of (prediction or None if decoding failed, reused)
+        """
+        try:
+            image = image_processor.decode(frame)
+        except (ImageTooLargeError, DecodeBudgetExceeded):
+            return None, False
+        if image is None:
+            return None, False
+
+        fingerprint = _fingerprint(image)
+        if (
+            self._last_prediction is not None
+            and self._last_prediction.model_version == classifier.model_version
+            and float(np.abs(fingerprint - self._last_fingerprint).mean()) < self.threshold
+        ):
+            return self._last_prediction, True
+
+        prediction = classifier.predict_batch(image[np.newaxis])[0]
+        self._last_fingerprint = fingerprint
+        self._last_prediction = prediction
+        return prediction, False
+
+
+@router.websocket("/stream")
+async def stream_classify(websocket: WebSocket):
+    """
+    Continuous classification over a WebSocket
+
+    Send frames as binary messages; each processed frame gets a JSON reply
+    with the prediction and the connection's frame statistics.
+    """
+    if drain.refuse():
+        await websocket.close(code=1013)  # try again later (another replica)
+        return
+
+    await websocket.accept()
+
+    client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
+    stats = StreamStats(next(_connection_ids), client)
+    active_streams[stats.connection_id] = stats
+    mailbox = LatestFrame()
+    frame_classifier = FrameClassifier(settings.STREAM_SIMILARITY_THRESHOLD)
+    max_frame_bytes = settings.STREAM_MAX_FRAME_MB * 1024 * 1024
+
+    logger.info(f"Stream {stats.connection_id} opened from {client}")
+
+    async def receive_frames():
+        seq = 0
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                continue  # text messages are ignored
+            seq += 1
+            stats.received += 1
+            if len(data) > max_frame_bytes:
+                stats.failed += 1
+                continue
+            if mailbox.put(seq, data):
+                stats.dropped += 1
+
+    async def classify_frames():
+        while True:
+            seq, data = await mailbox.take()
+            start = time.perf_counter()
+
+            if not classifier.is_loaded():
+                await websocket.send_json({"type": "error", "frame": seq, "detail": "Model not loaded"})
+                continue
+
+            with drain.track():
+                prediction, reused = await run_in_threadpool(frame_classifier.classify, data)
+
+            if prediction is None:
+                stats.failed += 1
+                await websocket.send_json({"type": "error", "frame": seq, "detail": "Failed to decode frame"})
+                continue
+
+            processing_time = (time.perf_counter() - start) * 1000
+            if reused:
+                stats.skipped += 1
+            else:
+                stats.inferred += 1
+                prediction_log.record(None, prediction, processing_time, "stream")
+
+            await websocket.send_json({
+                "type": "prediction",
+                "frame": seq,
+                "predicted_class": prediction.predicted_class,
+                "confidence": prediction.confidence,
+                "all_probabilities": prediction.all_probabilities,
+                "model_version": prediction.model_version,
+                "reused": reused,
+                "processing_time_ms": processing_time,
+                "stats": stats.as_dict()
+            })
+
+            if drain.draining:
+                await websocket.close(code=1012)  # service restart: reconnect elsewhere
+                return
+
+    receiver = asyncio.create_task(receive_frames())
+    worker = asyncio.create_task(classify_frames())
+    try:
+        done, _ = await asyncio.wait({receiver, worker}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.error(f"Stream {stats.connection_id} error: {task.exception()}")
+    finally:
+        receiver.cancel()
+        worker.cancel()
+        active_streams.pop(stats.connection_id, None)
+        logger.info(f"Stream {stats.connection_id} closed: {stats.as_dict()}")
+
+
+@router.get("/stream/stats", tags=["Streaming"])
+async def stream_stats():
+    """Frame, drop and skip rates of all open streaming connections"""
+    return {
+        "connections": len(active_streams),
+        "streams": [stats.as_dict() for stats in active_streams.values()]
+    }
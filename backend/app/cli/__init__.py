@@ -0,0 +1,4 @@
+"""
+Command-line tools
+コマンドラインツール
+"""
@@ -0,0 +1,248 @@
+"""
+Offline bulk classification
+オフライン一括分類
+
+Re-score a directory or a tar/zip archive of images without going through
+HTTP. Images are decoded on all cores, classified in batches and written
+incrementally as JSONL or CSV. Re-running with the same output file resumes
+where the previous run stopped.
+
+Usage:
+    python -m app.cli.bulk_classify photos/ -o results.jsonl
+    python -m app.cli.bulk_classify archive.tar.gz -o results.csv --batch-size 64
+"""
+
+import argparse
+from collections import deque
+import csv
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Iterator, Optional, Set, Tuple
+
+import numpy as np
+
+from app.utils.archive import iter_source
+from app.utils.image_processing import ImageTooLargeError, image_processor
+
+logger = logging.getLogger(__name__)
+
+CLASS_NAMES = ['glass', 'metal', 'organic', 'paper', 'plastic']
+
+
+def _decode(item: Tuple[str, bytes]) -> Tuple[str, Optional[np.ndarray]]:
+    """Decode one image in a worker process (uint8, to keep IPC small)"""
+    name, image_bytes = item
+    try:
+        return name, image_processor.decode(image_bytes, block=True)
+    except ImageTooLargeError:
+        return name, None
+
+
+def _load_done_ids(output: Path, fmt: str) -> Set[str]:
+    """
+    Read ids already written by a previous run
+
+    A partially written last line (from an interrupted run) is truncated so
+    that the file stays valid when we append to it.
+    """
+    done: Set[str] = set()
+    if not output.exists():
+        return done
+
+    valid_size = 0
+    with open(output, 'rb') as f:
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            line = raw.decode('utf-8')
+            try:
+                if fmt == 'jsonl':
+                    done.add(json.loads(line)['id'])
+                else:
+                    row = next(csv.reader([line]))
+                    if row and row[0] != 'id':
+                        done.add(row[0])
+            except (ValueError, KeyError, StopIteration):
+                break
+            valid_size += len(raw)
+
+    if valid_size != output.stat().st_size:
+        logger.warning(f"Truncating incomplete output after {valid_size} bytes")
+        with open(output, 'r+b') as f:
+            f.truncate(valid_size)
+
+    return done
+
+
+class ResultWriter:
+    """Append results to a JSONL or CSV file, flushing after every batch"""
+
+    def __init__(self, output: Path, fmt: str):
+        self.fmt = fmt
+        write_header = fmt == 'csv' and (not output.exists() or output.stat().st_size == 0)
+        self._file = open(output, 'a', encoding='utf-8', newline='')
+        self._csv = csv.writer(self._file) if fmt == 'csv' else None
+        if write_header:
+            self._csv.writerow(
+                ['id', 'predicted_class', 'confidence', 'model_version']
+                + [f"prob_{name}" for name in CLASS_NAMES]
+                + ['error']
+            )
+
+    def write(self, name: str, prediction=None, error: Optional[str] = None):
+        if self.fmt == 'jsonl':
+            record = {"id": name}
+            if prediction is not None:
+                record.update({
+                    "predicted_class": prediction.predicted_class,
+                    "confidence": prediction.confidence,
+                    "all_probabilities": prediction.all_probabilities,
+                    "model_version": prediction.model_version
+                })
+            else:
+                record["error"] = error
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        elif prediction is not None:
+            self._csv.writerow(
+                [name, prediction.predicted_class, f"{prediction.confidence:.6f}", prediction.model_version]
+                + [f"{prediction.all_probabilities.get(c, 0.0):.6f}" for c in CLASS_NAMES]
+                + ['']
+            )
+        else:
+            self._csv.writerow([name, '', '', ''] + [''] * len(CLASS_NAMES) + [error])
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def _decoded(pool, items: Iterator[Tuple[str, bytes]], max_pending: int):
+    """
+    Decode items in the pool, keeping at most max_pending in flight
+
+    Pool.imap would consume the whole input up front; a bounded window of
+    async results keeps memory flat and preserves input order.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(_decode, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def run(
+    source: str,
+    output: Path,
+    fmt: str,
+    batch_size: int = 32,
+    workers: int = 0,
+    progress_interval: float = 10.0
+) -> dict:
+    """
+    Classify every image in source and append results to output
+
+    Returns:
+        dict: Run summary (counts and throughput)
+    """
+    # Import lazily so decode workers never load TensorFlow
+    from app.models.classifier import classifier
+
+    if not classifier.is_loaded():
+        raise RuntimeError("Model failed to load")
+
+    done = _load_done_ids(output, fmt)
+    if done:
+        logger.info(f"Resuming: {len(done)} images already classified")
+
+    workers = workers or os.cpu_count() or 1
+    writer = ResultWriter(output, fmt)
+    todo = ((name, data) for name, data in iter_source(source) if name not in done)
+
+    processed = failed = 0
+    start = last_report = time.perf_counter()
+    names, arrays = [], []
+
+    def flush_batch():
+        nonlocal processed
+        if not arrays:
+            return
+        predictions = classifier.predict_batch(image_processor.normalize(np.stack(arrays)))
+        for name, prediction in zip(names, predictions):
+            writer.write(name, prediction)
+        writer.flush()
+        processed += len(arrays)
+        names.clear()
+        arrays.clear()
+
+    # spawn: forked children would inherit TensorFlow's thread pools
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        try:
+            for name, array in _decoded(pool, todo, max_pending=workers * batch_size * 2):
+                if array is None:
+                    writer.write(name, error="decode_failed")
+                    failed += 1
+                else:
+                    names.append(name)
+                    arrays.append(array)
+                    if len(arrays) >= batch_size:
+                        flush_batch()
+
+                now = time.perf_counter()
+                if now - last_report >= progress_interval:
+                    rate = processed / (now - start)
+                    print(f"{processed} classified, {failed} failed, {rate:.1f} images/s", file=sys.stderr)
+                    last_report = now
+
+            flush_batch()
+        finally:
+            writer.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "classified": processed,
+        "failed": failed,
+        "skipped": len(done),
+        "seconds": round(elapsed, 2),
+        "images_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        "model_version": classifier.model_version
+    }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk classify a directory or tar/zip archive of images")
+    parser.add_argument("source", help="Directory, .tar(.gz/.bz2/.xz) or .zip file")
+    parser.add_argument("-o", "--output", required=True, help="Output file (.jsonl or .csv)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Output format (default: from extension)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per inference batch")
+    parser.add_argument("--workers", type=int, default=0, help="Decode processes (default: all cores)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=getattr(logging, args.log_level.upper()),
+        format='%(asctime)s | %(levelname)-8s | %(name)s | %(message)s'
+    )
+
+    output = Path(args.output)
+    fmt = args.format or ('csv' if output.suffix.lower() == '.csv' else 'jsonl')
+
+    summary = run(args.source, output, fmt, args.batch_size, args.workers, args.progress_interval)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Evaluate the fast/full model cascade on a labelled dataset
+モデルカスケードの評価
+
+The dataset is a directory with one sub-directory per class:
+    dataset/glass/*.jpg, dataset/metal/*.jpg, ...
+
+Both stages run on every image once; the cascade outcome for each
+threshold is then derived from those outputs. Reports escalation rate,
+accuracy against the full model alone, and average latency per image.
+
+Usage:
+    CASCADE_ENABLED=true python -m app.cli.evaluate_cascade dataset/ --thresholds 0.5 0.6 0.7 0.8
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import List
+
+import numpy as np
+
+from app.utils.archive import iter_directory
+from app.utils.image_processing import ImageTooLargeError, image_processor
+
+logger = logging.getLogger(__name__)
+
+
+def evaluate(dataset: str, thresholds: List[float], batch_size: int = 32) -> dict:
+    """
+    Run the evaluation
+
+    Returns:
+        dict: Per-threshold metrics plus full-model baseline
+    """
+    from app.models.classifier import classifier
+
+    if not classifier.is_loaded():
+        raise RuntimeError("Model failed to load")
+
+    class_index = {name: i for i, name in enumerate(classifier.class_names)}
+    labels, fast_probs, full_probs = [], [], []
+    fast_seconds = full_seconds = 0.0
+
+    def run_batch(batch):
+        nonlocal fast_seconds, full_seconds
+        images = image_processor.normalize(np.stack(batch))
+        model_input = classifier._as_model_input(images)
+        with classifier._acquire() as handle:
+            if handle.fast_model is None:
+                raise RuntimeError("No cascade model loaded (set CASCADE_ENABLED and ship fast.keras)")
+            if not fast_probs:
+                # Untimed pass so graph tracing for this batch shape isn't counted
+                handle.fast_model.predict_on_batch(model_input)
+                handle.model.predict_on_batch(model_input)
+            start = time.perf_counter()
+            fast = np.asarray(handle.fast_model.predict_on_batch(model_input))
+            fast_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            full = np.asarray(handle.model.predict_on_batch(model_input))
+            full_seconds += time.perf_counter() - start
+        fast_probs.append(fast)
+        full_probs.append(full)
+
+    batch = []
+    for name, image_bytes in iter_directory(dataset):
+        label = name.split('/', 1)[0]
+        if label not in class_index:
+            continue
+        try:
+            image = image_processor.decode(image_bytes, block=True)
+        except ImageTooLargeError:
+            continue
+        if image is None:
+            continue
+        labels.append(class_index[label])
+        batch.append(image)
+        if len(batch) >= batch_size:
+            run_batch(batch)
+            batch = []
+    if batch:
+        run_batch(batch)
+
+    if not labels:
+        raise RuntimeError(f"No labelled images found in {dataset}")
+
+    labels = np.array(labels)
+    fast = np.concatenate(fast_probs)
+    full = np.concatenate(full_probs)
+    n = len(labels)
+
+    fast_ms = fast_seconds * 1000 / n
+    full_ms = full_seconds * 1000 / n
+    full_accuracy = float((full.argmax(axis=1) == labels).mean())
+
+    report = {
+        "images": n,
+        "full_model": {"accuracy": round(full_accuracy, 4), "latency_ms_per_image": round(full_ms, 3)},
+        "fast_model": {
+            "accuracy": round(float((fast.argmax(axis=1) == labels).mean()), 4),
+            "latency_ms_per_image": round(fast_ms, 3)
+        },
+        "thresholds": []
+    }
+
+    for threshold in thresholds:
+        escalate = fast.max(axis=1) < threshold
+        predicted = np.where(escalate, full.argmax(axis=1), fast.argmax(axis=1))
+        accuracy = float((predicted == labels).mean())
+        escalation_rate = float(escalate.mean())
+        # Every image pays the fast model; escalated ones also pay the full model
+        cascade_ms = fast_ms + escalation_rate * full_ms
+
+        report["thresholds"].append({
+            "threshold": threshold,
+            "escalation_rate": round(escalation_rate, 4),
+            "accuracy": round(accuracy, 4),
+            "accuracy_change": round(accuracy - full_accuracy, 4),
+            "latency_ms_per_image": round(cascade_ms, 3),
+            "latency_saved_ms_per_image": round(full_ms - cascade_ms, 3)
+        })
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the model cascade on a labelled dataset")
+    parser.add_argument("dataset", help="Directory with one sub-directory per class")
+    parser.add_argument("--thresholds", type=float, nargs="+", help="Confidence thresholds to evaluate")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    from app.models.classifier import classifier
+    thresholds = args.thresholds or [classifier.cascade_threshold]
+
+    report = evaluate(args.dataset, thresholds, args.batch_size)
+
+    print(f"{report['images']} images")
+    print(f"Full model: accuracy {report['full_model']['accuracy']:.2%}, "
+          f"{report['full_model']['latency_ms_per_image']:.2f}ms/image")
+    print(f"Fast model: accuracy {report['fast_model']['accuracy']:.2%}, "
+          f"{report['fast_model']['latency_ms_per_image']:.2f}ms/image")
+    print(f"{'threshold':>10} {'escalated':>10} {'accuracy':>10} {'Δacc':>8} {'ms/image':>10} {'saved':>8}")
+    for row in report["thresholds"]:
+        print(
+            f"{row['threshold']:>10.2f} {row['escalation_rate']:>10.1%} {row['accuracy']:>10.2%} "
+            f"{row['accuracy_change']:>+8.2%} {row['latency_ms_per_image']:>10.2f} "
+            f"{row['latency_saved_ms_per_image']:>8.2f}"
+        )
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
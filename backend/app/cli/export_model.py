@@ -0,0 +1,119 @@
+"""
+Export the startup-optimized model artifact
+起動用モデル成果物のエクスポート
+
+Converts a .keras model to a .tflite flatbuffer next to it (model.keras ->
+model.tflite; fast.keras -> fast.tflite for a cascade), then checks that
+both formats agree on random inputs. GarbageClassifier memory-maps the
+artifact at startup instead of rebuilding the Keras model (MODEL_FORMAT).
+
+Usage:
+    python -m app.cli.export_model                      # current version (or MODEL_PATH)
+    python -m app.cli.export_model --version v3
+    python -m app.cli.export_model models/registry/v3/model.keras --tolerance 1e-4
+"""
+
+import argparse
+import json
+import logging
+from pathlib import Path
+import sys
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def check_parity(keras_path: Path, tflite_path: Path, samples: int = 8) -> float:
+    """
+    Compare predictions of both formats on random images
+
+    Returns:
+        float: Largest absolute difference in any class probability
+    """
+    import tensorflow as tf
+    from app.models.tflite_model import TFLiteModel
+
+    keras_model = tf.keras.models.load_model(str(keras_path))
+    tflite_model = TFLiteModel(tflite_path)
+
+    rng = np.random.default_rng(0)
+    images = rng.random((samples, 224, 224, 3), dtype=np.float32)
+    expected = np.asarray(keras_model.predict_on_batch(images))
+    actual = tflite_model.predict_on_batch(images)
+    return float(np.abs(expected - actual).max())
+
+
+def export(model_path: Path, tolerance: float, output: Optional[Path] = None) -> dict:
+    """
+    Export one model and verify it
+
+    Raises:
+        RuntimeError: If the artifact's predictions differ by more than `tolerance`
+    """
+    from app.models.tflite_model import export_tflite
+
+    artifact = export_tflite(model_path, output)
+    max_diff = check_parity(model_path, artifact)
+    if max_diff > tolerance:
+        artifact.unlink()
+        raise RuntimeError(
+            f"{artifact} differs from {model_path} by {max_diff:.2e} (tolerance {tolerance:.0e}); removed"
+        )
+
+    return {
+        "source": str(model_path),
+        "artifact": str(artifact),
+        "source_mb": round(model_path.stat().st_size / 2**20, 2),
+        "artifact_mb": round(artifact.stat().st_size / 2**20, 2),
+        "max_abs_diff": max_diff
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the memory-mappable .tflite model artifact")
+    parser.add_argument("model", nargs="?", help=".keras file (default: the served version)")
+    parser.add_argument("--version", help="Registry version to export")
+    parser.add_argument("-o", "--output", help="Artifact path (default: next to the .keras file)")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Max allowed probability difference")
+    parser.add_argument("--no-fast", action="store_true", help="Skip the cascade's fast model")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from app.core.config import settings
+    from app.models.registry import model_registry
+    from app.models.tflite_model import KERAS
+
+    if args.model:
+        model_path = Path(args.model)
+    else:
+        _, model_path = model_registry.resolve(args.version)
+    if not model_path.exists():
+        sys.exit(f"Model not found: {model_path}")
+
+    paths = [model_path]
+    fast_path = None if args.no_fast or args.output else model_registry.resolve_fast(model_path)
+    if fast_path is not None:
+        paths.append(fast_path)
+
+    results = []
+    for path in paths:
+        try:
+            results.append(export(path, args.tolerance, Path(args.output) if args.output else None))
+        except RuntimeError as e:
+            sys.exit(f"❌ {e}")
+
+    for result in results:
+        print(
+            f"{result['artifact']}: {result['artifact_mb']}MB "
+            f"(.keras {result['source_mb']}MB), max |Δp| {result['max_abs_diff']:.2e}"
+        )
+    if settings.MODEL_FORMAT == KERAS:
+        print("MODEL_FORMAT=keras: set it to auto or tflite to serve the artifact")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Replay captured traffic
+記録したトラフィックの再生
+
+Re-drives a capture written by TRAFFIC_CAPTURE_ENABLED (see
+app.utils.traffic_capture) with the recorded arrival pattern, against the
+app in this process or a local server, and reports latency per route.
+
+Requests are sent open-loop at their recorded offsets divided by --speed,
+and latency is measured from the scheduled send time, so a server that
+falls behind shows up as latency instead of a slower replay. Requests
+whose body was not sampled reuse the sampled body of the same route with
+the closest size.
+
+Usage:
+    python -m app.cli.replay data/capture                              # in process, 1x
+    python -m app.cli.replay data/capture --target http://localhost:8000 --speed 4
+    python -m app.cli.replay data/capture --speed 0 -o after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+from bisect import bisect_left
+from collections import Counter, defaultdict
+import json
+import logging
+from pathlib import Path
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+
+def load_capture(directory: Path) -> List[dict]:
+    """Read every requests-*.jsonl in a capture directory, in arrival order"""
+    entries = []
+    for path in sorted(directory.glob("requests-*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # partially written last line
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries
+
+
+class PayloadPool:
+    """Sampled bodies by route, to fill in requests captured without one"""
+
+    def __init__(self, directory: Path, entries: List[dict]):
+        self.directory = directory
+        self._by_route: Dict[str, List[Tuple[int, dict]]] = defaultdict(list)
+        for entry in entries:
+            if "payload" in entry and (directory / "payloads" / f"{entry['payload']}.bin").exists():
+                self._by_route[entry["route"]].append((entry["body_bytes"], entry))
+        for donors in self._by_route.values():
+            donors.sort(key=lambda donor: donor[0])
+        self._bodies: Dict[str, bytes] = {}
+
+    def __len__(self) -> int:
+        return sum(len(donors) for donors in self._by_route.values())
+
+    def _read(self, digest: str) -> bytes:
+        if digest not in self._bodies:
+            self._bodies[digest] = (self.directory / "payloads" / f"{digest}.bin").read_bytes()
+        return self._bodies[digest]
+
+    def body_for(self, entry: dict) -> Optional[Tuple[bytes, dict]]:
+        """
+        Body and headers to send for a captured request
+
+        Returns:
+            (body, headers), or None if the request had a body and no
+            sampled body exists for its route
+        """
+        if entry.get("body_bytes", 0) == 0:
+            return b"", entry["headers"]
+        if "payload" in entry and (self.directory / "payloads" / f"{entry['payload']}.bin").exists():
+            return self._read(entry["payload"]), entry["headers"]
+
+        donors = self._by_route.get(entry["route"])
+        if not donors:
+            return None
+        # Closest size; the donor's headers come along (multipart boundaries are in the body)
+        i = bisect_left(donors, entry["body_bytes"], key=lambda donor: donor[0])
+        candidates = donors[max(i - 1, 0):i + 1]
+        _, donor = min(candidates, key=lambda donor: abs(donor[0] - entry["body_bytes"]))
+        return self._read(donor["payload"]), {**donor["headers"], **{
+            key: value for key, value in entry["headers"].items() if key != "content-type"
+        }}
+
+
+async def replay(client: httpx.AsyncClient, entries: List[dict], pool: PayloadPool,
+                 speed: float, concurrency: int, extra_headers: Dict[str, str]) -> dict:
+    """
+    Send the captured requests and collect per-request results
+
+    Returns:
+        dict: Raw results (route, status, latency_ms, lag_ms per request) and totals
+    """
+    semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+    results = []
+    skipped = 0
+    first_ts = entries[0]["ts"] if entries else 0.0
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def send(entry: dict, body: bytes, headers: Dict[str, str], scheduled: float):
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if semaphore is not None:
+            await semaphore.acquire()
+        sent = loop.time()
+        try:
+            response = await client.request(
+                entry["method"],
+                entry["path"] + (f"?{entry['query']}" if entry.get("query") else ""),
+                content=body or None,
+                headers={**headers, **extra_headers}
+            )
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = f"error:{type(e).__name__}"
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+        done = loop.time()
+        results.append({
+            "route": entry["route"],
+            "status": status,
+            # From the scheduled time: client-side backlog counts as latency
+            "latency_ms": (done - (scheduled if speed > 0 else sent)) * 1000,
+            "lag_ms": max(sent - scheduled, 0.0) * 1000 if speed > 0 else 0.0,
+            "captured_ms": entry.get("duration_ms")
+        })
+
+    tasks = []
+    for entry in entries:
+        request = pool.body_for(entry)
+        if request is None:
+            skipped += 1
+            continue
+        body, headers = request
+        scheduled = start + ((entry["ts"] - first_ts) / speed if speed > 0 else 0.0)
+        tasks.append(asyncio.create_task(send(entry, body, headers, scheduled)))
+    await asyncio.gather(*tasks)
+
+    return {"results": results, "skipped": skipped, "wall_seconds": loop.time() - start}
+
+
+def summarize(raw: dict, label: str, speed: float) -> dict:
+    """Latency distribution and status counts per route"""
+    by_route: Dict[str, list] = defaultdict(list)
+    for result in raw["results"]:
+        by_route[result["route"]].append(result)
+
+    def distribution(results: list) -> dict:
+        latencies = np.array([result["latency_ms"] for result in results])
+        captured = [result["captured_ms"] for result in results if result["captured_ms"] is not None]
+        summary = {
+            "count": len(results),
+            "status": dict(Counter(str(result["status"]) for result in results)),
+            "mean_ms": round(float(latencies.mean()), 2),
+            "max_ms": round(float(latencies.max()), 2),
+            "max_lag_ms": round(max(result["lag_ms"] for result in results), 2),
+        }
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = round(float(np.percentile(latencies, p)), 2)
+        if captured:
+            summary["captured_p50_ms"] = round(float(np.percentile(captured, 50)), 2)
+        return summary
+
+    wall = raw["wall_seconds"]
+    return {
+        "label": label,
+        "speed": speed,
+        "requests": len(raw["results"]),
+        "skipped": raw["skipped"],
+        "wall_seconds": round(wall, 3),
+        "achieved_rps": round(len(raw["results"]) / wall, 2) if wall > 0 else None,
+        "overall": distribution(raw["results"]) if raw["results"] else None,
+        "routes": {route: distribution(results) for route, results in sorted(by_route.items())},
+    }
+
+
+def print_report(report: dict):
+    speed = f"{report['speed']:g}x" if report["speed"] else "max"
+    print(
+        f"\n{report['label']}: {report['requests']} requests in {report['wall_seconds']}s "
+        f"({report['achieved_rps']} req/s, speed {speed}, {report['skipped']} skipped)"
+    )
+    header = f"{'route':<32}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'lag':>10}  status"
+    print(header)
+    print("-" * len(header))
+    rows = list(report["routes"].items())
+    if report["overall"] is not None:
+        rows.append(("(all)", report["overall"]))
+    for route, summary in rows:
+        print(
+            f"{route:<32}{summary['count']:>7}{summary['p50_ms']:>10.1f}{summary['p90_ms']:>10.1f}"
+            f"{summary['p99_ms']:>10.1f}{summary['max_ms']:>10.1f}{summary['max_lag_ms']:>10.1f}  "
+            + " ".join(f"{status}={count}" for status, count in sorted(summary["status"].items()))
+        )
+
+
+def print_comparison(baseline: dict, candidate: dict):
+    """Per-route latency change from one build's report to another's"""
+    print(f"\n{baseline['label']} -> {candidate['label']}")
+    header = f"{'route':<32}" + "".join(f"{f'p{p}':>22}" for p in PERCENTILES)
+    print(header)
+    print("-" * len(header))
+    routes = dict(baseline["routes"], **{"(all)": baseline["overall"]})
+    for route, after in list(candidate["routes"].items()) + [("(all)", candidate["overall"])]:
+        before = routes.get(route)
+        if before is None or after is None:
+            continue
+        cells = []
+        for p in PERCENTILES:
+            old, new = before[f"p{p}_ms"], after[f"p{p}_ms"]
+            change = f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+            cells.append(f"{old:.1f}->{new:.1f} ({change})".rjust(22))
+        print(f"{route:<32}" + "".join(cells))
+
+
+async def _run(args, entries: List[dict], pool: PayloadPool, extra_headers: Dict[str, str]) -> dict:
+    timeout = httpx.Timeout(args.timeout)
+    if args.target:
+        async with httpx.AsyncClient(base_url=args.target, timeout=timeout) as client:
+            return await replay(client, entries, pool, args.speed, args.concurrency, extra_headers)
+
+    from app.core.config import settings
+    from app.main import app
+
+    # In process: run the app's lifespan (model load, workers) around the
+    # replay, without capturing the replayed traffic into the capture itself
+    settings.TRAFFIC_CAPTURE_ENABLED = False
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=timeout) as client:
+            return await replay(client, entries, pool, args.speed, args.concurrency, extra_headers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured traffic and report latency")
+    parser.add_argument("capture", help="Capture directory (TRAFFIC_CAPTURE_DIR)")
+    parser.add_argument("--target", help="Base URL of a running server (default: the app in this process)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time compression (2 = twice as fast, 0 = no pauses)")
+    parser.add_argument("--concurrency", type=int, default=0, help="Max requests in flight (0 = unlimited)")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    parser.add_argument("--header", action="append", default=[], metavar="NAME:VALUE",
+                        help="Extra header on every request (e.g. credentials, which are never captured)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--label", help="Name of this run in reports (default: the target)")
+    parser.add_argument("-o", "--output", help="Write the report as JSON")
+    parser.add_argument("--compare", help="Report JSON of a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    directory = Path(args.capture)
+    entries = load_capture(directory)
+    if args.limit > 0:
+        entries = entries[:args.limit]
+    if not entries:
+        sys.exit(f"No captured requests in {directory}")
+
+    extra_headers = {}
+    for header in args.header:
+        name, _, value = header.partition(":")
+        extra_headers[name.strip()] = value.strip()
+
+    pool = PayloadPool(directory, entries)
+    span = entries[-1]["ts"] - entries[0]["ts"]
+    print(f"Replaying {len(entries)} requests spanning {span:.1f}s ({len(pool)} sampled payloads)")
+
+    started = time.time()
+    raw = asyncio.run(_run(args, entries, pool, extra_headers))
+    report = summarize(raw, args.label or args.target or "in-process", args.speed)
+    report["started_at"] = started
+    print_report(report)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        print_comparison(json.loads(Path(args.compare).read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
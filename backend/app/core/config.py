@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import os
 
 class Settings(BaseSettings):
@@ -25,6 +25,63 @@ class Settings(BaseSettings):
     MODEL_PATH: str = "models/garbage_classifier_final.keras"
     CONFIDENCE_THRESHOLD: float = 0.70
     
+    # Model registry (versioned models, hot reload)
+    MODEL_REGISTRY_DIR: str = "models/registry"
+    MODEL_FILENAME: str = "model.keras"
+    MODEL_WATCH_INTERVAL: int = 0  # seconds between registry checks, 0 = disabled
+    
+    # Startup-optimized artifact (model.tflite next to model.keras, see app.cli.export_model)
+    MODEL_FORMAT: str = "auto"             # "keras", "tflite" or "auto" (tflite when exported)
+    TFLITE_THREADS: int = 0                # interpreter threads, 0 = TFLite default
+    TFLITE_DEFAULT_DELEGATES: bool = True  # XNNPACK is faster but copies weights out of the mmap
+    
+    # Model cascade: a small model answers first, the full model only when it is unsure
+    CASCADE_ENABLED: bool = False
+    CASCADE_MODEL_FILENAME: str = "fast.keras"  # next to the full model in a registry version
+    CASCADE_MODEL_PATH: str = ""                # legacy MODEL_PATH deployments
+    CASCADE_THRESHOLD: Optional[float] = None   # default: CONFIDENCE_THRESHOLD
+    
+    # Pre-decoded tensor uploads (uint8 224x224x3), allowed only for these client tokens
+    TENSOR_UPLOAD_TOKENS: List[str] = []
+    
+    # Batch prediction
+    BATCH_MAX_FILES: int = 32
+    
+    # Archive uploads (/predict/archive, results streamed as NDJSON)
+    ARCHIVE_MAX_UPLOAD_MB: int = 500
+    ARCHIVE_DECODE_WORKERS: int = 4         # members decoded concurrently
+    ARCHIVE_PIPELINE_DEPTH: int = 32        # decoded images waiting for inference
+    ARCHIVE_BATCH_SIZE: int = 16            # max images per model call
+    
+    # Image preprocessing: "pil" (decode/resize in Python) or "tf" (decoded
+    # inside the model's graph; compare with benchmarks/bench_preprocess.py)
+    PREPROCESS_BACKEND: str = "pil"
+    
+    # Image decoding limits
+    MAX_IMAGE_PIXELS: int = 50_000_000      # rejected from the header, before decoding
+    DECODE_MEMORY_BUDGET_MB: int = 512      # decoded pixels in flight across the process
+    DECODE_BUDGET_TIMEOUT: float = 2.0      # seconds a request waits for budget, 0 = fail fast
+    
+    # Inference worker processes (0 = run the model in the web process)
+    INFERENCE_WORKERS: int = 0
+    INFERENCE_RING_SLOTS: int = 4           # shared-memory batch slots per worker
+    INFERENCE_WORKER_TIMEOUT: float = 30.0  # seconds before falling back to the in-process model
+    INFERENCE_PIN_CPUS: bool = True         # give each worker its own share of the CPUs
+    
+    # Priority lanes: interactive vs bulk inference
+    INFERENCE_SLOTS: int = 0                # concurrent model calls (0 = one per worker, or 1 in process)
+    LANE_POLICY: str = "strict"             # "strict" or "weighted"
+    LANE_WEIGHT_INTERACTIVE: int = 4        # weighted policy only
+    LANE_WEIGHT_BULK: int = 1
+    BULK_CHUNK_SIZE: int = 8                # bulk batches run in chunks so interactive calls can cut in
+    
+    # Prediction cache (in-process LRU)
+    CACHE_ENABLED: bool = True
+    CACHE_MAX_ENTRIES: int = 2048
+    CACHE_SNAPSHOT_PATH: str = "data/prediction_cache.snap"  # hottest entries kept across restarts ("" = off)
+    CACHE_SNAPSHOT_ENTRIES: int = 2048
+    CACHE_SNAPSHOT_INTERVAL: int = 300  # seconds between snapshots (also written at shutdown)
+    
     # Redis
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
@@ -34,11 +91,72 @@ class Settings(BaseSettings):
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = 60
     
+    # Prediction log for analytics/retraining (columnar files; needs pyarrow)
+    PREDICTION_LOG_ENABLED: bool = False
+    PREDICTION_LOG_DIR: str = "data/predictions"
+    PREDICTION_LOG_FORMAT: str = "parquet"        # "parquet" or "arrow" (Arrow IPC file)
+    PREDICTION_LOG_FLUSH_ROWS: int = 1024         # flush early once this many rows are buffered
+    PREDICTION_LOG_FLUSH_SECONDS: float = 10.0
+    PREDICTION_LOG_MAX_BUFFER_ROWS: int = 50_000  # rows beyond this are dropped (and counted)
+    PREDICTION_LOG_ROTATE_ROWS: int = 1_000_000
+    PREDICTION_LOG_ROTATE_SECONDS: float = 3600.0
+    
+    # Batch jobs
+    JOBS_ENABLED: bool = True
+    JOBS_DB_PATH: str = "data/jobs.db"
+    JOBS_DIR: str = "data/jobs"
+    JOB_BATCH_SIZE: int = 32
+    JOB_NICENESS: int = 10  # job worker thread priority (0-19, higher = lower priority)
+    JOB_MAX_UPLOAD_MB: int = 500
+    JOB_RETRY_ATTEMPTS: int = 4     # model calls per batch before its items are marked failed
+    JOB_RETRY_BACKOFF: float = 2.0  # seconds before the first retry, doubling after each
+    
+    # WebSocket streaming
+    STREAM_SIMILARITY_THRESHOLD: float = 2.0  # mean abs diff (0-255) below which a frame reuses the last prediction
+    STREAM_MAX_FRAME_MB: int = 5
+    
+    # Rules endpoints
+    RULES_CACHE_MAX_AGE: int = 86400  # seconds
+    
+    # Admin endpoints (disabled when empty)
+    ADMIN_TOKEN: str = ""
+    
+    # Memory instrumentation (tracemalloc; off by default)
+    MEMORY_PROFILING: bool = False
+    MEMORY_PROFILE_SAMPLE_RATE: float = 0.01  # fraction of /predict requests sampled
+    MEMORY_PROFILE_FRAMES: int = 10           # traceback depth kept per allocation
+    
+    # CPU profiling sessions (started on demand via /admin/profile)
+    PROFILING_MAX_SECONDS: int = 300
+    PROFILING_MAX_REQUESTS: int = 100
+    PROFILING_SAMPLE_INTERVAL_MS: float = 10.0
+    
+    # Tracing: Server-Timing header on every response, sampled traces to a file
+    SERVER_TIMING_ENABLED: bool = True
+    TRACE_SAMPLE_RATE: float = 0.0          # fraction of requests exported (sampled traceparent always is)
+    TRACE_FILE: str = "logs/traces.jsonl"   # OTLP/JSON lines ("" = no export)
+    
+    # Event-loop lag monitor
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL: float = 0.1     # seconds between lag probes
+    LOOP_BLOCK_THRESHOLD_MS: float = 100.0  # lag at which the blocking stack is captured
+    LOOP_BLOCK_BUDGET_MS: float = 0.0       # debug/CI: fail requests that block the loop longer (0 = off)
+    
+    # Traffic capture for replay (app.cli.replay); off by default
+    TRAFFIC_CAPTURE_ENABLED: bool = False
+    TRAFFIC_CAPTURE_DIR: str = "data/capture"
+    TRAFFIC_CAPTURE_PATHS: List[str] = ["/api/v1/predict"]  # path prefixes
+    TRAFFIC_CAPTURE_PAYLOAD_RATE: float = 0.0  # fraction of requests whose bodies are kept
+    TRAFFIC_CAPTURE_MAX_PAYLOAD_MB: int = 16
+    
+    # Graceful shutdown: seconds to let accepted inference finish once draining
+    SHUTDOWN_GRACE_PERIOD: float = 25.0  # keep below the orchestrator's termination grace period
+    
     # Logging
     LOG_LEVEL: str = "INFO"
     
     # Timeout settings
-    REQUEST_TIMEOUT: int = 120  # 2 minutes for slow connections
+    REQUEST_TIMEOUT: int = 120  # 2 minutes for slow connections; predict deadline (X-Request-Timeout may shorten it)
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,90 @@
+"""
+Prometheus metrics
+Prometheusメトリクス
+"""
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Buckets in seconds, tuned for 1ms-10s request latencies
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time until the last response body chunk was sent (whole stream for NDJSON/SSE), by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests currently being handled"
+)
+
+REQUEST_ERRORS = Counter(
+    "http_request_exceptions_total",
+    "Requests that raised before a response was sent",
+    ["method", "route"]
+)
+
+DECODE_BYTES_IN_USE = Gauge(
+    "image_decode_bytes_in_use",
+    "Estimated decoded image bytes currently reserved from the decode budget"
+)
+
+DECODE_REJECTED = Counter(
+    "image_decode_rejected_total",
+    "Images rejected before decoding",
+    ["reason"]
+)
+
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "inference_queue_depth",
+    "Model calls waiting for an inference slot",
+    ["lane"]
+)
+
+INFERENCE_QUEUE_WAIT = Histogram(
+    "inference_queue_wait_seconds",
+    "Time model calls waited for an inference slot",
+    ["lane"],
+    buckets=LATENCY_BUCKETS
+)
+
+INFERENCE_LANE_LATENCY = Histogram(
+    "inference_lane_duration_seconds",
+    "Queue wait plus model time per inference slot",
+    ["lane"],
+    buckets=LATENCY_BUCKETS
+)
+
+REQUESTS_ABANDONED = Counter(
+    "requests_abandoned_total",
+    "Requests whose remaining work was cancelled (deadline passed or client gone)",
+    ["reason", "stage"]
+)
+
+PREDICTION_LOG_ROWS = Counter(
+    "prediction_log_rows_total",
+    "Predictions written to the columnar prediction log"
+)
+
+PREDICTION_LOG_DROPPED = Counter(
+    "prediction_log_dropped_total",
+    "Predictions not logged because the buffer was full or a write failed"
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay before a ready callback ran on the event loop (sampled)",
+    buckets=LATENCY_BUCKETS
+)
+
+EVENT_LOOP_BLOCKED = Counter(
+    "event_loop_blocked_total",
+    "Times the event loop was blocked past LOOP_BLOCK_THRESHOLD_MS (stack captured)"
+)
+
+
+def render_metrics() -> bytes:
+    """Current metrics in Prometheus text format"""
+    return generate_latest()
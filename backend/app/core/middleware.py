@@ -0,0 +1,144 @@
+"""
+Request timing middleware (pure ASGI)
+リクエスト計測ミドルウェア
+
+Unlike @app.middleware("http") (BaseHTTPMiddleware), this does not wrap the
+request in an extra task or re-stream the response body: it only intercepts
+the http.response.start message to add X-Process-Time and Server-Timing
+(and, while traffic capture is on, tees the request body).
+"""
+
+import logging
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import REQUEST_ERRORS, REQUEST_LATENCY, REQUESTS_IN_PROGRESS
+from app.core.tracing import active_trace, start_trace, trace_exporter
+from app.utils.cpu_profiler import cpu_profiler
+from app.utils.deadline import ARRIVED_AT
+from app.utils.loop_monitor import BlockingGuard
+from app.utils.traffic_capture import traffic_capture
+
+logger = logging.getLogger(__name__)
+
+
+def route_template(scope: Scope) -> str:
+    """
+    Request path with path parameters put back as placeholders
+    (e.g. /api/v1/jobs/{job_id}) so metric labels stay bounded
+    """
+    if "endpoint" not in scope:
+        return "unmatched"
+
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
+
+
+def _header(scope: Scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class TimingMiddleware:
+    """
+    Time requests with a monotonic clock, set X-Process-Time and Server-Timing,
+    record metrics, export sampled traces, capture traffic and log one line
+
+    With LOOP_BLOCK_BUDGET_MS set (tests/CI), requests whose handler blocked
+    the event loop past the budget raise LoopBlockedError after responding.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        scope[ARRIVED_AT] = time.monotonic()  # request deadlines count from here
+        status_code = 500
+        trace = start_trace(scope["method"], _header(scope, b"traceparent"))
+        capture = traffic_capture.begin(scope)
+
+        if capture is not None:
+            inner_receive = receive
+
+            async def receive() -> Message:
+                message = await inner_receive()
+                if message["type"] == "http.request":
+                    capture.add_body(message.get("body", b""))
+                return message
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                # Time to headers; streamed bodies (NDJSON, SSE) keep going after this
+                headers.append("X-Process-Time", f"{(time.perf_counter() - start) * 1000:.2f}ms")
+                if trace is not None:
+                    headers.append("Server-Timing", trace.server_timing())
+            await send(message)
+
+        budget = settings.LOOP_BLOCK_BUDGET_MS / 1000
+        guard = None
+
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            with active_trace(trace):
+                if budget > 0:
+                    guard = BlockingGuard(self.app(scope, receive, send_wrapper), budget)
+                    await guard
+                else:
+                    await self.app(scope, receive, send_wrapper)
+            if guard is not None:
+                guard.check(scope["method"], route_template(scope))
+        except Exception:
+            REQUEST_ERRORS.labels(scope["method"], route_template(scope)).inc()
+            raise
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            # Until the last body chunk was sent, not just the headers
+            duration_ms = (time.perf_counter() - start) * 1000
+            route = route_template(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, str(status_code)).observe(duration_ms / 1000)
+            if trace is not None and trace.sampled:
+                trace.name = f"{scope['method']} {route}"
+                trace.finish(**{
+                    "http.request.method": scope["method"],
+                    "http.route": route,
+                    "url.path": scope["path"],
+                    "http.response.status_code": status_code,
+                })
+                trace_exporter.export(trace)
+            if capture is not None:
+                traffic_capture.finish(capture, route, status_code, duration_ms)
+            logger.info(
+                f"method={scope['method']} path={scope['path']} route={route} "
+                f"status={status_code} duration_ms={duration_ms:.2f}"
+            )
+
+
+class ProfilingMiddleware:
+    """Run requests under cProfile while a deterministic profiling session wants them"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        session = cpu_profiler.session_for(scope["path"]) if scope["type"] == "http" else None
+        if session is None:
+            await self.app(scope, receive, send)
+            return
+
+        with session.profile_request():
+            await self.app(scope, receive, send)
@@ -0,0 +1,263 @@
+"""
+Lightweight request tracing
+リクエストトレーシング
+
+TimingMiddleware opens a Trace per HTTP request; code on the request path
+wraps its stages in span("decode") etc. Span durations are summed per
+name into a Server-Timing header, and sampled traces are appended to a
+JSONL file in OTLP/JSON form (the same shape as the OpenTelemetry
+Collector's file exporter, so it can be replayed into any OTLP backend).
+
+With SERVER_TIMING_ENABLED off and the request not sampled, no Trace is
+created and span() costs one context variable lookup.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+import os
+from pathlib import Path
+import queue
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "garbage-classifier-api"
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+        Tuple of (trace_id, parent_span_id, sampled), or None if invalid
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 0x01)
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    def __init__(self, name: str, sampled: bool, trace_id: Optional[str] = None,
+                 parent_span_id: Optional[str] = None):
+        self.name = name
+        self.sampled = sampled
+        self.trace_id = trace_id or _new_id(16)
+        self.parent_span_id = parent_span_id
+        self.root_span_id = _new_id(8)
+        self.start_unix_ns = time.time_ns()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, object] = {}
+        # (name, span_id, parent_id, start_ns, end_ns, attributes)
+        self.spans: List[Tuple[str, str, str, int, int, dict]] = []
+
+    def add(self, name: str, start_ns: int, end_ns: int, parent_id: Optional[str] = None, **attributes):
+        """Record a finished span (list.append is atomic, so threads may add spans)"""
+        self.spans.append((name, _new_id(8), parent_id or self.root_span_id, start_ns, end_ns, attributes))
+
+    def finish(self, **attributes):
+        self.end_ns = time.perf_counter_ns()
+        self.attributes.update(attributes)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: per-stage totals plus the overall duration"""
+        totals: Dict[str, float] = {}
+        for name, _, _, start_ns, end_ns, _ in self.spans:
+            totals[name] = totals.get(name, 0.0) + (end_ns - start_ns) / 1e6
+        end_ns = self.end_ns or time.perf_counter_ns()
+        totals["total"] = (end_ns - self.start_ns) / 1e6
+        return ", ".join(f"{name};dur={duration:.2f}" for name, duration in totals.items())
+
+    def to_otlp(self) -> dict:
+        """OTLP/JSON ResourceSpans document"""
+        def unix_ns(perf_ns: int) -> str:
+            return str(self.start_unix_ns + perf_ns - self.start_ns)
+
+        def attributes(values: dict) -> list:
+            result = []
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    typed = {"boolValue": value}
+                elif isinstance(value, int):
+                    typed = {"intValue": str(value)}
+                elif isinstance(value, float):
+                    typed = {"doubleValue": value}
+                else:
+                    typed = {"stringValue": str(value)}
+                result.append({"key": key, "value": typed})
+            return result
+
+        root = {
+            "traceId": self.trace_id,
+            "spanId": self.root_span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_SERVER,
+            "startTimeUnixNano": unix_ns(self.start_ns),
+            "endTimeUnixNano": unix_ns(self.end_ns or time.perf_counter_ns()),
+            "attributes": attributes(self.attributes),
+        }
+        if self.parent_span_id:
+            root["parentSpanId"] = self.parent_span_id
+
+        spans = [root] + [
+            {
+                "traceId": self.trace_id,
+                "spanId": span_id,
+                "parentSpanId": parent_id,
+                "name": name,
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": unix_ns(start_ns),
+                "endTimeUnixNano": unix_ns(end_ns),
+                "attributes": attributes(attrs),
+            }
+            for name, span_id, parent_id, start_ns, end_ns, attrs in self.spans
+        ]
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": attributes({
+                    "service.name": SERVICE_NAME,
+                    "service.version": settings.APP_VERSION,
+                    "deployment.environment": settings.ENVIRONMENT,
+                })},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+            }]
+        }
+
+
+def start_trace(name: str, traceparent: Optional[str] = None) -> Optional[Trace]:
+    """
+    Create a trace for a request, if Server-Timing or sampling wants one
+
+    An incoming sampled traceparent is always honoured; otherwise requests
+    are sampled at TRACE_SAMPLE_RATE.
+    """
+    parent = parse_traceparent(traceparent)
+    if parent is not None and parent[2]:
+        sampled = True
+    else:
+        sampled = settings.TRACE_SAMPLE_RATE > 0 and random.random() < settings.TRACE_SAMPLE_RATE
+
+    if not sampled and not settings.SERVER_TIMING_ENABLED:
+        return None
+
+    return Trace(name, sampled, *(parent[:2] if parent else (None, None)))
+
+
+@contextmanager
+def active_trace(trace: Optional[Trace]):
+    """Make `trace` the current trace for the enclosed block"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a child of the current span (no-op without a trace)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    span_id = _new_id(8)
+    parent_id = _current_span.get() or trace.root_span_id
+    token = _current_span.set(span_id)
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end_ns = time.perf_counter_ns()
+        _current_span.reset(token)
+        trace.spans.append((name, span_id, parent_id, start_ns, end_ns, attributes))
+
+
+class TraceExporter:
+    """Append sampled traces to a JSONL file from a background thread"""
+
+    def __init__(self, path: str, max_queue: int = 1000):
+        self.path = Path(path)
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Trace]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        logger.info(f"Trace export enabled: {self.path} (sample rate {settings.TRACE_SAMPLE_RATE})")
+
+    def stop(self, timeout: float = 5.0):
+        """Flush queued traces and stop"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def export(self, trace: Trace):
+        """Queue a finished trace; dropped (and counted) if the writer falls behind"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        sink = None  # opened on the first trace, so an idle exporter leaves no file
+        try:
+            while True:
+                trace = self._queue.get()
+                if trace is None:
+                    return
+                if sink is None:
+                    sink = open(self.path, "a", encoding="utf-8")
+                sink.write(json.dumps(trace.to_otlp(), separators=(",", ":")) + "\n")
+                self.exported += 1
+                if self._queue.empty():
+                    sink.flush()
+        finally:
+            if sink is not None:
+                sink.close()
+
+
+# Global instance (started from the app lifespan when TRACE_FILE is set)
+trace_exporter = TraceExporter(settings.TRACE_FILE)
@@ -10,13 +10,24 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from contextlib import asynccontextmanager
-import time
+import asyncio
 import logging
 
 from app.core.config import settings
 from app.core.logging_config import setup_logging
-from app.models.classifier import classifier
-from app.api.routes import health, predict
+from app.core.middleware import ProfilingMiddleware, TimingMiddleware
+from app.core.tracing import trace_exporter
+from app.models.classifier import classifier, ModelWatcher
+from app.models.worker_pool import inference_pool
+from app.api.routes import admin, archive, health, jobs, predict, rules, stream
+from app.utils.cache import CacheSnapshotter, prediction_cache
+from app.utils.drain import drain
+from app.utils.job_store import job_store
+from app.utils.job_worker import job_worker
+from app.utils.memory_profiler import memory_profiler
+from app.utils.prediction_log import prediction_log
+from app.utils.loop_monitor import loop_monitor
+from app.utils.traffic_capture import traffic_capture
 
 # Setup logging
 logger = setup_logging(settings.LOG_LEVEL)
@@ -37,6 +48,22 @@ async def lifespan(app: FastAPI):
     logger.info(f"Environment: {settings.ENVIRONMENT}")
     logger.info("="*60)
     
+    # Opt-in allocation tracing (before the model, so its allocations are attributed)
+    memory_profiler.start()
+    
+    # Sampled request traces to the OTLP/JSON file sink (also at a local rate
+    # of 0: requests arriving with a sampled traceparent are exported)
+    if settings.TRACE_FILE:
+        trace_exporter.start()
+    
+    # Event-loop lag metric and stacks of whatever blocks the loop
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start(asyncio.get_running_loop())
+    
+    # Record production-shaped traffic for app.cli.replay
+    if settings.TRAFFIC_CAPTURE_ENABLED:
+        traffic_capture.start()
+    
     # Load ML model
     logger.info("Loading ML model...")
     if classifier.is_loaded():
@@ -45,6 +72,39 @@ async def lifespan(app: FastAPI):
     else:
         logger.error("❌ Failed to load model")
     
+    # Pre-warm the cache from the last snapshot (mapped lazily, so readiness doesn't wait)
+    cache_snapshotter = None
+    if settings.CACHE_ENABLED and settings.CACHE_SNAPSHOT_PATH:
+        prediction_cache.open_snapshot(settings.CACHE_SNAPSHOT_PATH, classifier.model_version)
+        cache_snapshotter = CacheSnapshotter(
+            prediction_cache,
+            settings.CACHE_SNAPSHOT_PATH,
+            settings.CACHE_SNAPSHOT_INTERVAL,
+            settings.CACHE_SNAPSHOT_ENTRIES,
+            model_info=lambda: (classifier.model_version, classifier.class_names)
+        )
+        cache_snapshotter.start()
+    
+    # Columnar prediction log for analytics and retraining
+    if settings.PREDICTION_LOG_ENABLED:
+        prediction_log.start(classifier.class_names)
+    
+    # Run inference in dedicated worker processes (the local model stays as fallback)
+    if settings.INFERENCE_WORKERS > 0:
+        inference_pool.start()
+        classifier.pool = inference_pool
+    
+    # Watch the model registry for new versions
+    model_watcher = None
+    if settings.MODEL_WATCH_INTERVAL > 0:
+        model_watcher = ModelWatcher(classifier, settings.MODEL_WATCH_INTERVAL)
+        model_watcher.start()
+    
+    # Resume and process batch jobs in the background
+    if settings.JOBS_ENABLED:
+        job_store.open()
+        job_worker.start()
+    
     logger.info("="*60)
     logger.info("✅ Application startup complete")
     logger.info(f"API available at: http://{settings.HOST}:{settings.PORT}")
@@ -56,8 +116,42 @@ async def lifespan(app: FastAPI):
     # ========== SHUTDOWN ==========
     logger.info("="*60)
     logger.info("Shutting down application...")
-    logger.info("✅ Cleanup complete")
+    
+    # Fail readiness and refuse new work (no-op if /admin/drain already ran),
+    # then let accepted inference finish
+    drain.begin()
+    if not await drain.wait_idle(settings.SHUTDOWN_GRACE_PERIOD):
+        logger.warning(f"⚠️ Shutting down with {drain.in_flight} request(s) still in flight")
+    
+    if model_watcher is not None:
+        model_watcher.stop()
+    if settings.JOBS_ENABLED:
+        # Current batch finishes; unfinished jobs resume on the next start
+        job_worker.stop(timeout=settings.SHUTDOWN_GRACE_PERIOD)
+        job_store.close()
+    
+    # Flush the prediction log (no new predictions after the drain)
+    prediction_log.stop()
+    
+    # Keep the hottest cache entries for the next start
+    if cache_snapshotter is not None:
+        cache_snapshotter.stop()
+    
+    # Release memory before the process exits
+    if classifier.pool is not None:
+        classifier.pool = None
+        inference_pool.stop()
+    prediction_cache.clear()
+    classifier.unload()
+    memory_profiler.stop()
+    trace_exporter.stop()
+    traffic_capture.stop()
+    loop_monitor.stop()
+    
+    logger.info(f"✅ Cleanup complete (drain: {drain.stats()})")
     logger.info("="*60)
+    for handler in logging.getLogger().handlers:
+        handler.flush()
 
 
 # ============================================
@@ -126,31 +220,11 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
-# Request logging middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    """Log all requests with timing"""
-    start_time = time.time()
-    
-    # Log request
-    logger.info(f"➡️  {request.method} {request.url.path}")
-    
-    # Process request
-    response = await call_next(request)
-    
-    # Calculate duration
-    duration = (time.time() - start_time) * 1000
-    
-    # Log response
-    logger.info(
-        f"⬅️  {request.method} {request.url.path} "
-        f"| Status: {response.status_code} | {duration:.2f}ms"
-    )
-    
-    # Add custom header
-    response.headers["X-Process-Time"] = f"{duration:.2f}ms"
-    
-    return response
+# On-demand cProfile sessions (inert unless started via /admin/profile)
+app.add_middleware(ProfilingMiddleware)
+
+# Request timing middleware (pure ASGI: X-Process-Time, metrics, one log line)
+app.add_middleware(TimingMiddleware)
 
 # ============================================
 # Exception Handlers
@@ -188,6 +262,11 @@ async def global_exception_handler(request: Request, exc: Exception):
 # Include routers
 app.include_router(health.router, prefix="/api/v1", tags=["Health"])
 app.include_router(predict.router, prefix="/api/v1", tags=["Classification"])
+app.include_router(archive.router, prefix="/api/v1", tags=["Classification"])
+app.include_router(rules.router, prefix="/api/v1", tags=["Rules"])
+app.include_router(jobs.router, prefix="/api/v1", tags=["Jobs"])
+app.include_router(stream.router, prefix="/api/v1", tags=["Streaming"])
+app.include_router(admin.router, prefix="/api/v1", tags=["Admin"])
 
 # Root endpoint
 @app.get("/", tags=["Root"])
@@ -214,9 +293,14 @@ async def api_v1_info():
         "version": "1.0",
         "endpoints": {
             "health": "/api/v1/health",
+            "ready": "/api/v1/ready",
             "model_info": "/api/v1/model-info",
             "predict": "/api/v1/predict",
-            "batch_predict": "/api/v1/predict/batch (coming soon)"
+            "batch_predict": "/api/v1/predict/batch",
+            "archive_predict": "/api/v1/predict/archive (NDJSON)",
+            "rules": "/api/v1/rules",
+            "jobs": "/api/v1/jobs",
+            "stream": "/api/v1/stream (WebSocket)"
         },
         "supported_categories": classifier.class_names if classifier.is_loaded() else [],
         "model_accuracy": "86.20%"
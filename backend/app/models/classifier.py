@@ -7,17 +7,65 @@ import tensorflow as tf
 import numpy as np
 from pathlib import Path
 import logging
-from typing import Dict, Tuple, Optional
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+import threading
 import time
 
 from app.core.config import settings
+from app.core.tracing import span
+from app.models.registry import model_registry
+from app.models.scheduler import LaneScheduler, current_lane, lane_scheduler
+from app.models.tf_preprocess import TF, FusedModel, TFPreprocessor, UndecodableImageError
+from app.models.tflite_model import KERAS, TFLITE, TFLiteModel, load_model_file, tflite_path_for
+from app.models.worker_pool import InferencePool, InferenceWorkerError
+from app.utils.deadline import RequestAborted
 
 logger = logging.getLogger(__name__)
 
+
+class Prediction(NamedTuple):
+    """Single prediction result"""
+    predicted_class: str
+    confidence: float
+    all_probabilities: Dict[str, float]
+    model_version: str
+    stage: str = "full"  # cascade stage that answered: "fast" or "full"
+
+
+class LoadedModel:
+    """
+    A loaded model version and the requests currently using it
+    
+    Retired versions are released once the last in-flight request finishes.
+    """
+    
+    def __init__(self, model: tf.keras.Model, version: str, path: Path,
+                 fast_model: Optional[tf.keras.Model] = None):
+        self.model = model
+        self.fast_model = fast_model
+        self.fused: Optional[FusedModel] = None  # PREPROCESS_BACKEND=tf, Keras model without cascade
+        self.version = version
+        self.path = path
+        self.in_flight = 0
+        self.retired = False
+        self.loaded_at = time.time()
+    
+    def release(self):
+        """Drop the model so TF can free its memory"""
+        logger.info(f"Releasing model version {self.version}")
+        self.model = None
+        self.fast_model = None
+        self.fused = None
+
+
 class GarbageClassifier:
     """
     Wrapper for TensorFlow garbage classification model
     Thread-safe, singleton pattern
+    
+    Model versions are swapped atomically: requests hold a reference to the
+    version they started on, so a reload never interrupts in-flight work.
     """
     
     _instance = None
@@ -32,102 +80,434 @@ class GarbageClassifier:
         if self._initialized:
             return
             
-        self.model: Optional[tf.keras.Model] = None
+        self._active: Optional[LoadedModel] = None
+        self._lock = threading.Lock()          # guards _active and in-flight counts
+        self._reload_lock = threading.Lock()   # one reload at a time
         self.class_names = ['glass', 'metal', 'organic', 'paper', 'plastic']
-        self.model_path = Path(settings.MODEL_PATH)
+        self.registry = model_registry
         self.confidence_threshold = settings.CONFIDENCE_THRESHOLD
+        self.cascade_enabled = settings.CASCADE_ENABLED
+        self.cascade_threshold = (
+            settings.CASCADE_THRESHOLD
+            if settings.CASCADE_THRESHOLD is not None
+            else settings.CONFIDENCE_THRESHOLD
+        )
+        self.last_reload_error: Optional[str] = None
+        self.pool: Optional[InferencePool] = None  # set when inference workers run
+        self.scheduler: LaneScheduler = lane_scheduler
+        self.preprocess_backend = settings.PREPROCESS_BACKEND
+        self.tf_preprocessor = TFPreprocessor()
         self._initialized = True
         
         # Load model on initialization
         self.load_model()
     
-    def load_model(self) -> bool:
+    @property
+    def model(self) -> Optional[tf.keras.Model]:
+        """Currently active model"""
+        active = self._active
+        return active.model if active is not None else None
+    
+    @property
+    def model_version(self) -> Optional[str]:
+        """Version of the currently active model"""
+        active = self._active
+        return active.version if active is not None else None
+    
+    @property
+    def model_path(self) -> Optional[Path]:
+        """File of the currently active model"""
+        active = self._active
+        return active.path if active is not None else None
+    
+    def load_model(self, version: Optional[str] = None) -> bool:
         """
-        Load the TensorFlow model
+        Load and warm up a model version, then swap it in atomically
+        
+        Args:
+            version: Registry version to load (None = current version)
         
         Returns:
             bool: True if successful
         """
-        try:
-            if not self.model_path.exists():
-                logger.error(f"Model file not found: {self.model_path}")
-                raise FileNotFoundError(f"Model not found at {self.model_path}")
-            
-            logger.info(f"Loading model from {self.model_path}...")
-            start_time = time.time()
-            
-            # Load model
-            self.model = tf.keras.models.load_model(str(self.model_path))
-            
-            load_time = (time.time() - start_time) * 1000
-            logger.info(f"✅ Model loaded successfully in {load_time:.2f}ms")
-            
-            # Log model info
-            logger.info(f"Model input shape: {self.model.input_shape}")
-            logger.info(f"Model output shape: {self.model.output_shape}")
-            logger.info(f"Number of classes: {len(self.class_names)}")
-            
-            # Warm up model (first prediction is always slower)
-            self._warmup()
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to load model: {e}")
-            self.model = None
+        with self._reload_lock:
+            try:
+                requested_version = version
+                version, model_path = self.registry.resolve(version)
+                
+                if not model_path.exists() and not tflite_path_for(model_path).exists():
+                    logger.error(f"Model file not found: {model_path}")
+                    raise FileNotFoundError(f"Model not found at {model_path}")
+                
+                logger.info(f"Loading model {version} from {model_path}...")
+                start_time = time.time()
+                
+                # Load model (the mmapped .tflite artifact when one was exported)
+                model = load_model_file(model_path)
+                
+                load_time = (time.time() - start_time) * 1000
+                logger.info(f"✅ Model loaded successfully in {load_time:.2f}ms ({type(model).__name__})")
+                
+                # Log model info
+                logger.info(f"Model input shape: {model.input_shape}")
+                logger.info(f"Model output shape: {model.output_shape}")
+                logger.info(f"Number of classes: {len(self.class_names)}")
+                
+                # Cascade first stage, shipped alongside the full model
+                fast_model = None
+                fast_path = self.registry.resolve_fast(model_path) if self.cascade_enabled else None
+                if fast_path is not None:
+                    fast_model = load_model_file(fast_path)
+                    logger.info(f"Cascade model loaded from {fast_path} (threshold {self.cascade_threshold})")
+                elif self.cascade_enabled:
+                    logger.warning("Cascade enabled but no fast model found; using the full model only")
+                
+                # Warm up model before it takes traffic (first prediction is always slower)
+                self._warmup(model)
+                if fast_model is not None:
+                    self._warmup(fast_model)
+                
+                handle = LoadedModel(model, version, model_path, fast_model)
+                if self.preprocess_backend == TF:
+                    handle.fused = self._fuse(handle)
+                
+                self._swap(handle)
+                self.last_reload_error = None
+                
+                if self.pool is not None:
+                    self.pool.reload(requested_version)
+                
+                return True
+                
+            except Exception as e:
+                logger.error(f"Failed to load model: {e}")
+                self.last_reload_error = str(e)
+                return False
+    
+    def reload_in_background(self, version: Optional[str] = None) -> bool:
+        """
+        Load a model version on a background thread
+        
+        Args:
+            version: Registry version to load (None = current version)
+        
+        Returns:
+            bool: False if a reload is already running
+        """
+        if self._reload_lock.locked():
             return False
+        
+        thread = threading.Thread(
+            target=self.load_model,
+            args=(version,),
+            name="model-reload",
+            daemon=True
+        )
+        thread.start()
+        return True
+    
+    def unload(self):
+        """Stop serving and release the model once in-flight predictions finish (shutdown)"""
+        with self._lock:
+            old = self._active
+            self._active = None
+            if old is None:
+                return
+            old.retired = True
+            drained = old.in_flight == 0
+        
+        if drained:
+            old.release()
+            tf.keras.backend.clear_session()
     
-    def _warmup(self):
+    def is_reloading(self) -> bool:
+        """Check if a model version is being loaded"""
+        return self._reload_lock.locked()
+    
+    def _swap(self, new: LoadedModel):
+        """Make `new` the active version and retire the old one"""
+        with self._lock:
+            old = self._active
+            self._active = new
+            if old is not None:
+                old.retired = True
+                drained = old.in_flight == 0
+        
+        logger.info(f"🔄 Serving model version {new.version}")
+        
+        if old is not None:
+            if drained:
+                old.release()
+            else:
+                logger.info(
+                    f"Model version {old.version} draining "
+                    f"({old.in_flight} requests in flight)"
+                )
+    
+    @contextmanager
+    def _acquire(self) -> Iterator[LoadedModel]:
+        """Pin the active model version for the duration of a prediction"""
+        with self._lock:
+            handle = self._active
+            if handle is None or handle.model is None:
+                raise RuntimeError("Model not loaded. Call load_model() first.")
+            handle.in_flight += 1
+        
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                handle.in_flight -= 1
+                drained = handle.retired and handle.in_flight == 0
+            if drained:
+                handle.release()
+    
+    def _warmup(self, model: tf.keras.Model):
         """Warm up model with dummy prediction"""
         try:
             dummy_input = np.random.random((1, 224, 224, 3)).astype(np.float32)
-            _ = self.model.predict(dummy_input, verbose=0)
+            _ = model.predict(dummy_input, verbose=0)
             logger.info("Model warmed up with dummy prediction")
         except Exception as e:
             logger.warning(f"Model warmup failed: {e}")
     
-    def predict(self, image_array: np.ndarray) -> Tuple[str, float, Dict[str, float]]:
+    def _fuse(self, handle: LoadedModel) -> Optional[FusedModel]:
+        """
+        Put TF decode/resize/normalize in front of the model and trace it
+        
+        TFLite models and cascades are not fused; their encoded batches are
+        decoded by TF and then run like any other batch.
+        """
+        if isinstance(handle.model, TFLiteModel) or handle.fast_model is not None:
+            return None
+        
+        fused = self.tf_preprocessor.fuse(handle.model)
+        try:
+            start_time = time.time()
+            fused.predict_on_batch([tf.io.encode_png(tf.zeros((64, 64, 3), tf.uint8)).numpy()])
+            logger.info(f"Fused TF preprocessing traced in {(time.time() - start_time) * 1000:.0f}ms")
+        except Exception as e:
+            logger.warning(f"Fused model warmup failed: {e}")
+        return fused
+    
+    def predict(self, image_array: np.ndarray) -> Prediction:
         """
         Make prediction on preprocessed image
         
         Args:
-            image_array: Preprocessed image (1, 224, 224, 3)
+            image_array: Preprocessed image (1, 224, 224, 3), float32 in [0, 1] or uint8
             
         Returns:
-            Tuple of (predicted_class, confidence, all_probabilities)
+            Prediction: (predicted_class, confidence, all_probabilities, model_version)
         """
-        if self.model is None:
-            raise RuntimeError("Model not loaded. Call load_model() first.")
-        
         try:
             start_time = time.time()
             
             # Predict
-            predictions = self.model.predict(image_array, verbose=0)[0]
+            predictions, stages, versions = self._run(image_array)
             
-            # Get predicted class
-            predicted_idx = np.argmax(predictions)
-            predicted_class = self.class_names[predicted_idx]
-            confidence = float(predictions[predicted_idx])
-            
-            # All probabilities
-            all_probs = {
-                self.class_names[i]: float(predictions[i])
-                for i in range(len(self.class_names))
-            }
+            result = self._to_prediction(predictions[0], versions[0], stages[0])
             
             inference_time = (time.time() - start_time) * 1000
             logger.info(
-                f"Prediction: {predicted_class} ({confidence*100:.1f}%) "
-                f"in {inference_time:.2f}ms"
+                f"Prediction: {result.predicted_class} ({result.confidence*100:.1f}%) "
+                f"in {inference_time:.2f}ms [model {result.model_version}, {result.stage}]"
             )
             
-            return predicted_class, confidence, all_probs
+            return result
             
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"Prediction failed: {e}")
             raise
     
+    def predict_batch(self, image_batch: np.ndarray) -> List[Prediction]:
+        """
+        Make predictions on a batch of preprocessed images
+        
+        Args:
+            image_batch: Preprocessed images (N, 224, 224, 3), float32 in [0, 1] or uint8
+            
+        Returns:
+            List[Prediction]: One prediction per image, in input order
+        """
+        return self._predict_many(image_batch, self._run_chunk)
+    
+    def predict_encoded(self, encoded: List[bytes]) -> List[Prediction]:
+        """
+        Make predictions on encoded images, decoded inside TF (PREPROCESS_BACKEND=tf)
+        
+        Callers check each image's header first (ImageProcessor.inspect).
+        
+        Args:
+            encoded: PNG/JPEG/WEBP file contents
+            
+        Returns:
+            List[Prediction]: One prediction per image, in input order
+            
+        Raises:
+            UndecodableImageError: If TF could not decode an image of the batch
+        """
+        return self._predict_many(encoded, self._run_encoded_chunk)
+    
+    def _predict_many(self, inputs, run_chunk) -> List[Prediction]:
+        """Run a batch through `run_chunk` in lane-sized chunks and build Predictions"""
+        try:
+            start_time = time.time()
+            
+            predictions, stages, versions = self._run(inputs, run_chunk)
+            
+            results = [
+                self._to_prediction(row, version, stage)
+                for row, stage, version in zip(predictions, stages, versions)
+            ]
+            
+            inference_time = (time.time() - start_time) * 1000
+            escalated = stages.count("full")
+            logger.info(
+                f"Batch prediction: {len(results)} images in {inference_time:.2f}ms "
+                f"[model {', '.join(sorted(set(versions)))}, {escalated} on full model]"
+            )
+            
+            return results
+            
+        except (RequestAborted, UndecodableImageError):
+            raise
+        except Exception as e:
+            logger.error(f"Batch prediction failed: {e}")
+            raise
+    
+    def _run(self, images, run_chunk=None) -> Tuple[np.ndarray, List[str], List[str]]:
+        """
+        Run a batch in the current request's priority lane
+        
+        Bulk batches are split into chunks that each wait for an inference
+        slot, so interactive calls only ever wait behind one chunk. A model
+        reload between chunks can leave a batch on two versions.
+        
+        Args:
+            images: Image batch (or encoded images for _run_encoded_chunk)
+            run_chunk: Runs one chunk (default _run_chunk)
+        
+        Returns:
+            Tuple of (probabilities (N, num_classes), stage per image, model version per image)
+        """
+        run_chunk = run_chunk or self._run_chunk
+        lane = current_lane()
+        chunk = self.scheduler.chunk_size(lane) or max(len(images), 1)
+        
+        predictions, stages, versions = [], [], []
+        for offset in range(0, len(images), chunk):
+            part = images[offset:offset + chunk]
+            with self.scheduler.slot(lane):
+                part_predictions, part_stages, version = run_chunk(part)
+            predictions.append(part_predictions)
+            stages.extend(part_stages)
+            versions.extend([version] * len(part))
+        
+        if len(predictions) == 1:
+            return predictions[0], stages, versions
+        return np.concatenate(predictions), stages, versions
+    
+    def _run_chunk(self, images: np.ndarray) -> Tuple[np.ndarray, List[str], str]:
+        """
+        Run a batch on the inference workers if available, else in this process
+        
+        Only uint8 batches go to the workers (4x less to copy into shared
+        memory). If a worker fails, the batch is retried here.
+        
+        Returns:
+            Tuple of (probabilities (N, num_classes), stage per image, model version)
+        """
+        pool = self.pool
+        if pool is not None and images.dtype == np.uint8 and pool.available():
+            try:
+                with span("inference", worker=True, batch_size=len(images)):
+                    return pool.infer(images)
+            except InferenceWorkerError as e:
+                logger.warning(f"⚠️ Inference worker failed, running in process: {e}")
+        with span("inference", worker=False, batch_size=len(images)):
+            return self._run_local(images)
+    
+    def _run_encoded_chunk(self, encoded: List[bytes]) -> Tuple[np.ndarray, List[str], str]:
+        """
+        Run encoded images through the fused decode + model graph
+        
+        Without a fused model (TFLite, cascade), or while inference workers
+        serve the model, TF decodes the batch to uint8 and it runs as usual.
+        """
+        pool = self.pool
+        if pool is None or not pool.available():
+            with self._acquire() as handle:
+                if handle.fused is not None:
+                    with span("inference", worker=False, fused=True, batch_size=len(encoded)):
+                        predictions = handle.fused.predict_on_batch(encoded)
+                    return predictions, ["full"] * len(predictions), handle.version
+        
+        with span("decode", backend=TF, batch_size=len(encoded)):
+            images = self.tf_preprocessor.decode(encoded)
+        return self._run_chunk(images)
+    
+    def _run_local(self, images: np.ndarray) -> Tuple[np.ndarray, List[str], str]:
+        """Run a batch on this process's model"""
+        with self._acquire() as handle:
+            predictions, stages = self._forward(handle, self._as_model_input(images))
+        return predictions, stages, handle.version
+    
+    def _forward(self, handle: LoadedModel, model_input) -> Tuple[np.ndarray, List[str]]:
+        """
+        Run the model (or the cascade) on a batch
+        
+        With a cascade, the fast model answers every image whose confidence
+        reaches cascade_threshold; only the rest go through the full model.
+        
+        Returns:
+            Tuple of (probabilities (N, num_classes), stage per image)
+        """
+        # predict_on_batch skips the tf.data pipeline that predict() builds per call
+        if handle.fast_model is None:
+            predictions = np.asarray(handle.model.predict_on_batch(model_input))
+            return predictions, ["full"] * len(predictions)
+        
+        predictions = np.array(handle.fast_model.predict_on_batch(model_input))
+        stages = ["fast"] * len(predictions)
+        
+        unsure = np.flatnonzero(predictions.max(axis=1) < self.cascade_threshold)
+        if len(unsure) > 0:
+            escalated_input = tf.gather(model_input, unsure)
+            predictions[unsure] = np.asarray(handle.model.predict_on_batch(escalated_input))
+            for i in unsure:
+                stages[i] = "full"
+        
+        return predictions, stages
+    
+    @staticmethod
+    def _as_model_input(images: np.ndarray):
+        """
+        Scale uint8 tensor uploads inside TF instead of copying them in numpy
+        
+        float32 input (ImageProcessor.preprocess) is passed through unchanged.
+        """
+        if images.dtype == np.uint8:
+            return tf.cast(images, tf.float32) / 255.0
+        return images
+    
+    def _to_prediction(self, probabilities: np.ndarray, version: str, stage: str = "full") -> Prediction:
+        """Convert one row of model output to a Prediction"""
+        # Get predicted class
+        predicted_idx = int(np.argmax(probabilities))
+        predicted_class = self.class_names[predicted_idx]
+        confidence = float(probabilities[predicted_idx])
+        
+        # All probabilities
+        all_probs = {
+            self.class_names[i]: float(probabilities[i])
+            for i in range(len(self.class_names))
+        }
+        
+        return Prediction(predicted_class, confidence, all_probs, version, stage)
+    
     def is_loaded(self) -> bool:
         """Check if model is loaded"""
         return self.model is not None
@@ -144,9 +524,56 @@ class GarbageClassifier:
             "classes": self.class_names,
             "num_classes": len(self.class_names),
             "model_path": str(self.model_path),
+            "model_format": TFLITE if isinstance(self.model, TFLiteModel) else KERAS,
+            "preprocess_backend": self.preprocess_backend,
+            "model_version": self.model_version,
+            "cascade": self._active.fast_model is not None,
+            "cascade_threshold": self.cascade_threshold,
+            "available_versions": self.registry.list_versions(),
             "confidence_threshold": self.confidence_threshold
         }
 
 
+class ModelWatcher:
+    """
+    Poll the model registry and hot reload when the current version changes
+    """
+    
+    def __init__(self, clf: GarbageClassifier, interval: int):
+        self.classifier = clf
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._failed_version: Optional[str] = None
+    
+    def start(self):
+        """Start the watcher thread"""
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Model watcher started (every {self.interval}s)")
+    
+    def stop(self):
+        """Stop the watcher thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                wanted = self.classifier.registry.current_version()
+                if wanted is None or wanted == self.classifier.model_version:
+                    continue
+                if wanted == self._failed_version or self.classifier.is_reloading():
+                    continue
+                
+                logger.info(f"New model version detected: {wanted}")
+                if not self.classifier.load_model(wanted):
+                    # Don't retry a broken version every interval
+                    self._failed_version = wanted
+            except Exception as e:
+                logger.warning(f"Model watcher error: {e}")
+
+
 # Global classifier instance (singleton)
-classifier = GarbageClassifier()
\ No newline at end of file
+classifier = GarbageClassifier()
@@ -0,0 +1,132 @@
+"""
+Versioned model registry
+バージョン管理されたモデルレジストリ
+
+Layout:
+    models/registry/
+        CURRENT             <- optional, contains the version name to serve
+        v1/model.keras
+        v2/model.keras
+        v2/fast.keras       <- optional first stage of a model cascade
+
+Without a CURRENT file the highest version wins. When the registry
+directory is empty, the legacy MODEL_PATH file is served instead.
+"""
+
+from pathlib import Path
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _version_sort_key(version: str):
+    """Natural sort key so that v10 sorts after v9"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", version)]
+
+
+class ModelRegistry:
+    """Resolve model versions to files on disk"""
+
+    CURRENT_FILE = "CURRENT"
+
+    def __init__(self, root: str, filename: str, fallback_path: str):
+        self.root = Path(root)
+        self.filename = filename
+        self.fallback_path = Path(fallback_path)
+
+    def list_versions(self) -> List[str]:
+        """
+        List available versions (directories containing a model file)
+
+        Returns:
+            List[str]: Version names, oldest first
+        """
+        if not self.root.is_dir():
+            return []
+
+        versions = [
+            entry.name for entry in self.root.iterdir()
+            if entry.is_dir() and (entry / self.filename).exists()
+        ]
+        return sorted(versions, key=_version_sort_key)
+
+    def current_version(self) -> Optional[str]:
+        """
+        Version that should be served right now
+
+        Returns:
+            Optional[str]: Version name, or None if the registry is empty
+        """
+        versions = self.list_versions()
+        if not versions:
+            return None
+
+        pointer = self.root / self.CURRENT_FILE
+        if pointer.exists():
+            pinned = pointer.read_text(encoding="utf-8").strip()
+            if pinned in versions:
+                return pinned
+            logger.warning(f"CURRENT points to unknown version '{pinned}', using latest")
+
+        return versions[-1]
+
+    def resolve(self, version: Optional[str] = None) -> Tuple[str, Path]:
+        """
+        Resolve a version name to its model file
+
+        Args:
+            version: Version to load (None = current version)
+
+        Returns:
+            Tuple of (version, model_path)
+
+        Raises:
+            FileNotFoundError: If the version does not exist
+        """
+        if version is None:
+            version = self.current_version()
+
+        if version is None:
+            # Legacy single-file deployment
+            return self._fallback_version(), self.fallback_path
+
+        path = self.root / version / self.filename
+        if not path.exists():
+            raise FileNotFoundError(f"Model version '{version}' not found at {path}")
+
+        return version, path
+
+    def resolve_fast(self, model_path: Path) -> Optional[Path]:
+        """
+        Cascade first-stage model shipped with a full model, if any
+
+        Registry versions keep it next to the full model; the legacy
+        MODEL_PATH deployment uses CASCADE_MODEL_PATH.
+        """
+        if model_path != self.fallback_path:
+            candidate = model_path.parent / settings.CASCADE_MODEL_FILENAME
+            return candidate if candidate.exists() else None
+
+        if settings.CASCADE_MODEL_PATH and Path(settings.CASCADE_MODEL_PATH).exists():
+            return Path(settings.CASCADE_MODEL_PATH)
+        return None
+
+    def _fallback_version(self) -> str:
+        """Version label for the legacy MODEL_PATH file (name + mtime)"""
+        try:
+            mtime = int(self.fallback_path.stat().st_mtime)
+        except OSError:
+            return self.fallback_path.stem
+        return f"{self.fallback_path.stem}-{mtime}"
+
+
+# Global registry instance
+model_registry = ModelRegistry(
+    root=settings.MODEL_REGISTRY_DIR,
+    filename=settings.MODEL_FILENAME,
+    fallback_path=settings.MODEL_PATH,
+)
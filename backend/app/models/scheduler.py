@@ -0,0 +1,225 @@
+"""
+Priority lanes for model inference
+推論の優先レーン
+
+Interactive traffic (/predict, the WebSocket stream) and bulk traffic
+(/predict/batch, batch jobs) share one model. Every model call takes an
+inference slot from LaneScheduler first; when slots are busy, callers
+queue in their lane and freed slots are granted:
+
+    strict:   interactive first, bulk only when no interactive call waits
+    weighted: smooth weighted round robin over the lanes with waiters
+              (LANE_WEIGHT_INTERACTIVE : LANE_WEIGHT_BULK)
+
+A running model call cannot be interrupted, so bulk batches are split into
+chunks of at most BULK_CHUNK_SIZE images that each queue for a slot. An
+interactive request waits for at most one bulk chunk, never a whole batch.
+
+The lane is chosen per request (route default, or the X-Priority header)
+and carried to the worker thread in a context variable. Queued calls whose
+request deadline passes or whose client disconnects leave the queue.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+import threading
+import time
+from typing import Deque, Dict, Iterator, Optional
+
+from app.core.config import settings
+from app.core.metrics import INFERENCE_LANE_LATENCY, INFERENCE_QUEUE_DEPTH, INFERENCE_QUEUE_WAIT
+from app.core.tracing import span
+from app.utils.deadline import Deadline, check_deadline, current_deadline
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+STRICT = "strict"
+WEIGHTED = "weighted"
+
+# How often queued calls with a deadline look for a disconnected client
+DEADLINE_POLL_SECONDS = 0.1
+
+_current_lane: ContextVar[str] = ContextVar("inference_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def inference_lane(lane: str) -> Iterator[str]:
+    """Run model calls made in the enclosed block (and its threadpool calls) in `lane`"""
+    if lane not in LANES:
+        raise ValueError(f"Unknown inference lane: {lane}")
+    token = _current_lane.set(lane)
+    try:
+        yield lane
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+class _Ticket:
+    """A queued request for an inference slot"""
+
+    __slots__ = ("lane", "granted")
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.granted = False
+
+
+class LaneScheduler:
+    """Grant a fixed number of inference slots to queued callers by lane"""
+
+    def __init__(self, slots: int, policy: str = STRICT,
+                 weights: Optional[Dict[str, int]] = None, bulk_chunk_size: int = 8):
+        if policy not in (STRICT, WEIGHTED):
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.slots = max(1, slots)
+        self.policy = policy
+        self.weights = weights or {INTERACTIVE: 4, BULK: 1}
+        self.bulk_chunk_size = max(1, bulk_chunk_size)
+
+        self._free = self.slots
+        self._queues: Dict[str, Deque[_Ticket]] = {lane: deque() for lane in LANES}
+        self._credit = {lane: 0 for lane in LANES}
+        self._cond = threading.Condition()
+
+        self.granted = {lane: 0 for lane in LANES}
+        self.queued = {lane: 0 for lane in LANES}      # had to wait for a slot
+        self.passed_over = 0                            # bulk grants deferred for interactive work
+
+    def chunk_size(self, lane: str) -> Optional[int]:
+        """Largest batch run under one slot in `lane` (None = unlimited)"""
+        return self.bulk_chunk_size if lane == BULK else None
+
+    @contextmanager
+    def slot(self, lane: Optional[str] = None) -> Iterator[None]:
+        """
+        Hold an inference slot for the enclosed model call
+
+        Args:
+            lane: Priority lane (None = the current request's lane)
+        
+        Raises:
+            RequestAborted: If the request's deadline passed or its client
+                disconnected before the model call
+        """
+        lane = lane or current_lane()
+        check_deadline("queue")
+        start = time.perf_counter()
+
+        with self._cond:
+            if self._free > 0 and not any(self._queues.values()):
+                self._free -= 1
+                self.granted[lane] += 1
+                waited = False
+            else:
+                waited = True
+
+        if waited:
+            with span("queue", lane=lane):
+                self._wait(lane, current_deadline())
+
+        INFERENCE_QUEUE_WAIT.labels(lane).observe(time.perf_counter() - start)
+        try:
+            check_deadline("inference")
+            yield
+        finally:
+            with self._cond:
+                self._free += 1
+                self._grant()
+            INFERENCE_LANE_LATENCY.labels(lane).observe(time.perf_counter() - start)
+
+    def _wait(self, lane: str, deadline: Optional[Deadline]):
+        ticket = _Ticket(lane)
+        with self._cond:
+            self._queues[lane].append(ticket)
+            self.queued[lane] += 1
+            INFERENCE_QUEUE_DEPTH.labels(lane).inc()
+            self._grant()
+            try:
+                while not ticket.granted:
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        deadline.check("queue")
+                        self._cond.wait(min(deadline.remaining(), DEADLINE_POLL_SECONDS))
+            except BaseException:
+                # Abandoned or interrupted while queued: give back the slot if it was granted meanwhile
+                if ticket.granted:
+                    self._free += 1
+                else:
+                    self._queues[lane].remove(ticket)
+                    INFERENCE_QUEUE_DEPTH.labels(lane).dec()
+                self._grant()
+                raise
+
+    def _grant(self):
+        """Hand free slots to queued tickets (caller holds the lock)"""
+        woke = False
+        while self._free > 0:
+            lane = self._pick()
+            if lane is None:
+                break
+            ticket = self._queues[lane].popleft()
+            ticket.granted = True
+            self._free -= 1
+            self.granted[lane] += 1
+            INFERENCE_QUEUE_DEPTH.labels(lane).dec()
+            if lane == INTERACTIVE and self._queues[BULK]:
+                self.passed_over += 1
+            woke = True
+        if woke:
+            self._cond.notify_all()
+
+    def _pick(self) -> Optional[str]:
+        """Lane whose head ticket gets the next slot"""
+        waiting = [lane for lane in LANES if self._queues[lane]]
+        if not waiting:
+            return None
+        if self.policy == STRICT or len(waiting) == 1:
+            return waiting[0]
+
+        # Smooth weighted round robin (as in nginx): no lane waits more than one round
+        total = 0
+        for lane in waiting:
+            self._credit[lane] += self.weights.get(lane, 1)
+            total += self.weights.get(lane, 1)
+        chosen = max(waiting, key=lambda lane: self._credit[lane])
+        self._credit[chosen] -= total
+        return chosen
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "policy": self.policy,
+                "slots": self.slots,
+                "free": self._free,
+                "bulk_chunk_size": self.bulk_chunk_size,
+                "lanes": {
+                    lane: {
+                        "depth": len(self._queues[lane]),
+                        "granted": self.granted[lane],
+                        "queued": self.queued[lane],
+                        "weight": self.weights.get(lane, 1)
+                    }
+                    for lane in LANES
+                },
+                "bulk_passed_over": self.passed_over
+            }
+
+
+# Global instance: one slot per inference worker, or one for the in-process model
+lane_scheduler = LaneScheduler(
+    slots=settings.INFERENCE_SLOTS or max(1, settings.INFERENCE_WORKERS),
+    policy=settings.LANE_POLICY,
+    weights={INTERACTIVE: settings.LANE_WEIGHT_INTERACTIVE, BULK: settings.LANE_WEIGHT_BULK},
+    bulk_chunk_size=settings.BULK_CHUNK_SIZE
+)
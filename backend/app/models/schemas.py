@@ -76,6 +76,7 @@ class PredictionResult(BaseModel):
     
     # Metadata
     processing_time_ms: float = Field(..., description="Processing time in milliseconds")
+    model_version: Optional[str] = Field(None, description="Model version that produced the prediction")
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     
     @validator('confidence_percentage', always=True)
@@ -100,6 +101,35 @@ class PredictionResult(BaseModel):
             return "low"
 
 
+class BatchItemResult(BaseModel):
+    """Result for one file of a batch request"""
+    filename: Optional[str] = None
+    result: Optional[PredictionResult] = None
+    error: Optional[str] = None
+
+
+class BatchPredictionResponse(BaseModel):
+    """Batch prediction response"""
+    count: int
+    succeeded: int
+    processing_time_ms: float
+    results: List[BatchItemResult]
+
+
+class JobStatus(BaseModel):
+    """Batch job status and progress"""
+    job_id: str
+    status: str = Field(..., description="queued, running, completed, failed")
+    total: int
+    completed: int
+    failed: int
+    progress: float = Field(..., ge=0.0, le=1.0, description="Fraction of images processed")
+    model_version: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+
 class ErrorResponse(BaseModel):
     """Error response model"""
     error: str
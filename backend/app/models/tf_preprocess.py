@@ -0,0 +1,116 @@
+"""
+TF-native image preprocessing fused with the model call
+TensorFlowによる画像前処理 (モデル呼び出しと融合)
+
+The default path (PREPROCESS_BACKEND=pil) decodes and resizes every image
+with PIL in Python, then hands a numpy batch to the model. With
+PREPROCESS_BACKEND=tf the raw encoded bytes of a whole batch go into one
+tf.function instead: decode, Lanczos resize, scaling to [0, 1] and the
+model run as a single graph on TF's C++ thread pools, outside the GIL.
+Images are decoded in parallel (tf.map_fn) and the model sees one batch.
+
+PIL still reads the header of every upload first (format, size limits,
+decode budget); only pixel decoding moves into TF. The resize matches
+PIL's antialiased LANCZOS closely but not bit for bit: tests/test_tf_preprocess.py
+holds both paths to a stated tolerance, and `python -m benchmarks.bench_preprocess`
+measures the difference and speed on real photos.
+"""
+
+import logging
+import re
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+PIL = "pil"
+TF = "tf"
+
+# Images decoded concurrently inside one batch
+DECODE_PARALLELISM = 16
+
+ENCODED_BATCH = tf.TensorSpec(shape=[None], dtype=tf.string)
+
+
+class UndecodableImageError(ValueError):
+    """An image in the batch passed the header check but TF could not decode it"""
+
+
+def _undecodable(error: tf.errors.InvalidArgumentError) -> UndecodableImageError:
+    """Keep TF's reason (e.g. "Invalid PNG data, size 270701"), not the graph dump"""
+    match = re.search(r"^(?:\{\{[^}]*\}\} )?((?:Invalid|Input|Unknown|Got|Trying) [^\n]*?)(?:\s*\[\[|$)", error.message, re.M)
+    return UndecodableImageError(match.group(1) if match else "Could not decode image")
+
+
+def decode_resize(encoded: tf.Tensor, size: Tuple[int, int]) -> tf.Tensor:
+    """
+    Decode and resize a batch of encoded images inside the graph
+
+    Args:
+        encoded: (N,) tf.string of PNG/JPEG/WEBP/GIF bytes
+        size: (height, width)
+
+    Returns:
+        tf.Tensor: (N, height, width, 3) uint8, rounded like PIL's output
+    """
+    def decode_one(data):
+        image = tf.io.decode_image(data, channels=3, expand_animations=False)
+        image = tf.image.resize(image, size, method="lanczos3", antialias=True)
+        return tf.cast(tf.clip_by_value(tf.round(image), 0.0, 255.0), tf.uint8)
+
+    return tf.map_fn(
+        decode_one,
+        encoded,
+        fn_output_signature=tf.TensorSpec(shape=size + (3,), dtype=tf.uint8),
+        parallel_iterations=DECODE_PARALLELISM
+    )
+
+
+class TFPreprocessor:
+    """Compiled decode (and decode + model) functions for one target size"""
+
+    def __init__(self, target_size: Tuple[int, int] = (224, 224)):
+        # PIL sizes are (width, height); TF wants (height, width)
+        self.size = (target_size[1], target_size[0])
+        self._decode = tf.function(lambda encoded: decode_resize(encoded, self.size), input_signature=[ENCODED_BATCH])
+
+    def decode(self, encoded: Sequence[bytes]) -> np.ndarray:
+        """
+        Decode and resize a batch to uint8 (for models that cannot be fused)
+
+        Raises:
+            UndecodableImageError: If any image fails to decode
+        """
+        try:
+            return self._decode(tf.constant(list(encoded), dtype=tf.string)).numpy()
+        except tf.errors.InvalidArgumentError as e:
+            raise _undecodable(e) from e
+
+    def fuse(self, model) -> "FusedModel":
+        return FusedModel(model, self.size)
+
+
+class FusedModel:
+    """A Keras model with decode, resize and normalization in front of it, as one graph"""
+
+    def __init__(self, model, size: Tuple[int, int]):
+        def run(encoded):
+            images = tf.cast(decode_resize(encoded, size), tf.float32) / 255.0
+            return model(images, training=False)
+
+        self._run = tf.function(run, input_signature=[ENCODED_BATCH])
+
+    def predict_on_batch(self, encoded: List[bytes]) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Probabilities (N, num_classes)
+
+        Raises:
+            UndecodableImageError: If any image fails to decode
+        """
+        try:
+            return self._run(tf.constant(list(encoded), dtype=tf.string)).numpy()
+        except tf.errors.InvalidArgumentError as e:
+            raise _undecodable(e) from e
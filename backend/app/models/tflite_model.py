@@ -0,0 +1,171 @@
+"""
+Startup-optimized model artifact (TFLite flatbuffer)
+起動用に最適化したモデル成果物 (TFLite)
+
+`tf.keras.models.load_model` unzips the .keras archive, rebuilds the
+graph from its config and copies every weight into fresh variables. A
+.tflite flatbuffer is loaded by memory-mapping the file: the weights are
+read in place, the mapping is read-only, and every process on the node
+that serves the same file shares one copy through the page cache.
+
+The artifact is written next to the .keras file by
+`python -m app.cli.export_model` (model.keras -> model.tflite) and picked
+up by GarbageClassifier according to MODEL_FORMAT.
+
+TFLite's default XNNPACK delegate repacks weights into private memory for
+speed; set TFLITE_DEFAULT_DELEGATES=false to keep them purely mmap-backed.
+"""
+
+import logging
+from pathlib import Path
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+try:
+    from ai_edge_litert.interpreter import Interpreter, OpResolverType
+except ImportError:  # optional; fall back to the interpreter bundled with TensorFlow
+    Interpreter = None
+    OpResolverType = None
+
+logger = logging.getLogger(__name__)
+
+TFLITE_SUFFIX = ".tflite"
+
+KERAS = "keras"
+TFLITE = "tflite"
+AUTO = "auto"
+
+
+def tflite_path_for(model_path: Path) -> Path:
+    """Where the exported artifact for a .keras file lives"""
+    return Path(model_path).with_suffix(TFLITE_SUFFIX)
+
+
+def _interpreter_class():
+    if Interpreter is not None:
+        return Interpreter, OpResolverType
+    import tensorflow as tf
+    return tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+
+
+class TFLiteModel:
+    """
+    Run a .tflite artifact behind the part of the Keras model API the
+    classifier uses (predict_on_batch, predict, input_shape, output_shape)
+    """
+
+    def __init__(self, path: Path, num_threads: Optional[int] = None, default_delegates: bool = True):
+        interpreter_class, resolver = _interpreter_class()
+        options = {}
+        if not default_delegates:
+            options["experimental_op_resolver_type"] = resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+
+        # model_path (not model_content) makes TFLite mmap the file instead of copying it
+        self.path = Path(path)
+        self._interpreter = interpreter_class(
+            model_path=str(self.path),
+            num_threads=num_threads or None,
+            **options
+        )
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        self._lock = threading.Lock()  # an interpreter runs one call at a time
+
+    @property
+    def input_shape(self) -> Tuple:
+        return (None,) + tuple(int(dim) for dim in self._input["shape"][1:])
+
+    @property
+    def output_shape(self) -> Tuple:
+        return (None,) + tuple(int(dim) for dim in self._output["shape"][1:])
+
+    def predict_on_batch(self, batch) -> np.ndarray:
+        """
+        Run one batch
+
+        Args:
+            batch: (N, 224, 224, 3) float32 in [0, 1] (numpy or a TF tensor)
+
+        Returns:
+            np.ndarray: Probabilities (N, num_classes)
+        """
+        batch = np.asarray(batch, dtype=self._input["dtype"])
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                # Exported with a dynamic batch dimension; reallocating is cheap
+                self._interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input["index"], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output["index"]).copy()
+
+    def predict(self, batch, verbose: int = 0) -> np.ndarray:
+        return self.predict_on_batch(batch)
+
+
+def export_tflite(model_path: Path, output_path: Optional[Path] = None) -> Path:
+    """
+    Convert a .keras model to a float32 .tflite artifact with a dynamic batch size
+
+    Weights stay float32: quantized weights would be dequantized into
+    private memory at load time, which defeats sharing the mapping.
+
+    Returns:
+        Path: The written artifact
+    """
+    import tensorflow as tf
+
+    model_path = Path(model_path)
+    output_path = Path(output_path) if output_path is not None else tflite_path_for(model_path)
+
+    model = tf.keras.models.load_model(str(model_path))
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    flatbuffer = converter.convert()
+
+    # Write then rename, so a serving process never maps a half-written file
+    partial = output_path.with_name(output_path.name + ".partial")
+    partial.write_bytes(flatbuffer)
+    partial.replace(output_path)
+    logger.info(f"✅ Exported {model_path} -> {output_path} ({len(flatbuffer) / 2**20:.1f}MB)")
+    return output_path
+
+
+def load_model_file(model_path: Path, fmt: str = settings.MODEL_FORMAT):
+    """
+    Load a model for serving, preferring the startup-optimized artifact
+
+    Args:
+        model_path: The .keras file (or a .tflite file)
+        fmt: "keras", "tflite" or "auto" (the .tflite next to the .keras
+            file when it exists and is not older than it)
+
+    Returns:
+        A tf.keras.Model or TFLiteModel
+
+    Raises:
+        FileNotFoundError: If fmt is "tflite" and no artifact exists
+    """
+    model_path = Path(model_path)
+    artifact = model_path if model_path.suffix == TFLITE_SUFFIX else tflite_path_for(model_path)
+
+    use_tflite = fmt == TFLITE or model_path.suffix == TFLITE_SUFFIX
+    if fmt == AUTO and artifact.exists():
+        stale = model_path.exists() and artifact.stat().st_mtime < model_path.stat().st_mtime
+        if stale:
+            logger.warning(f"⚠️ Ignoring {artifact}: older than {model_path} (re-run export_model)")
+        use_tflite = not stale
+
+    if use_tflite:
+        if not artifact.exists():
+            raise FileNotFoundError(f"TFLite artifact not found at {artifact} (run app.cli.export_model)")
+        return TFLiteModel(artifact, settings.TFLITE_THREADS, settings.TFLITE_DEFAULT_DELEGATES)
+
+    import tensorflow as tf
+    return tf.keras.models.load_model(str(model_path))
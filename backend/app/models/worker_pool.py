@@ -0,0 +1,421 @@
+"""
+Inference worker processes fed through shared memory
+共有メモリ経由の推論ワーカープロセス
+
+Optional (INFERENCE_WORKERS > 0). Each worker is a spawned process with its
+own GarbageClassifier, pinned to its share of the CPUs, so TensorFlow no
+longer competes with request handling for the web process's GIL.
+
+Each worker owns one shared-memory block laid out as a ring of slots:
+
+    inputs:  (slots, slot_batch, 224, 224, 3) uint8
+    outputs: (slots, slot_batch, num_classes) float32
+
+The web process copies a uint8 batch into the next free slot and sends only
+(request id, slot, count) over a queue; the worker writes probabilities
+back into the same slot. Tensors are never pickled. Workers process their
+queue in order, so slots are freed in the order they were taken and the
+ring needs no free list.
+
+Requests go to the worker with the fewest requests in flight. A monitor
+thread restarts workers that die; requests they held fail over to the
+web process's own model (see GarbageClassifier._run_chunk).
+
+This module must not import the classifier at module level: worker
+processes import it, and must pin themselves before TensorFlow starts.
+"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SHAPE = (224, 224, 3)
+NUM_CLASSES = 5
+
+
+class InferenceWorkerError(RuntimeError):
+    """A worker could not answer (crashed, timed out or failed)"""
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to a block owned by the parent without registering it for cleanup"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _ring_views(buf, slots: int, slot_batch: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Input and output arrays over a worker's shared-memory block"""
+    inputs = np.ndarray((slots, slot_batch) + IMAGE_SHAPE, dtype=np.uint8, buffer=buf)
+    outputs = np.ndarray(
+        (slots, slot_batch, NUM_CLASSES), dtype=np.float32, buffer=buf, offset=inputs.nbytes
+    )
+    return inputs, outputs
+
+
+def _ring_bytes(slots: int, slot_batch: int) -> int:
+    image_bytes = int(np.prod(IMAGE_SHAPE))
+    return slots * slot_batch * (image_bytes + NUM_CLASSES * 4)
+
+
+def _worker_main(worker_id: int, shm_name: str, slots: int, slot_batch: int,
+                 cpus: Sequence[int], requests: mp.Queue, responses: mp.Queue):
+    """Worker process entry point"""
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Worker {worker_id}: could not pin to CPUs {list(cpus)}: {e}")
+
+    # Size TF's thread pools to the pinned cores before the model loads
+    import tensorflow as tf
+    threads = len(cpus) or os.cpu_count() or 1
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    from app.models.classifier import classifier
+
+    shm = _attach(shm_name)
+    inputs, outputs = _ring_views(shm.buf, slots, slot_batch)
+    responses.put(("ready", worker_id, os.getpid(), classifier.model_version))
+
+    try:
+        while True:
+            message = requests.get()
+            if message is None:
+                break
+
+            kind = message[0]
+            if kind == "infer":
+                _, request_id, slot, count = message
+                try:
+                    probabilities, stages, version = classifier._run_local(inputs[slot, :count])
+                    outputs[slot, :count] = probabilities
+                    responses.put(("result", worker_id, request_id, version, stages, None))
+                except Exception as e:
+                    responses.put(("result", worker_id, request_id, None, None, str(e)))
+            elif kind == "reload":
+                classifier.load_model(message[1])
+                responses.put(("ready", worker_id, os.getpid(), classifier.model_version))
+    finally:
+        del inputs, outputs
+        shm.close()
+
+
+class WorkerHandle:
+    """Web-process side of one worker: process, ring state and pending requests"""
+
+    def __init__(self, worker_id: int, slots: int, slot_batch: int, cpus: List[int]):
+        self.worker_id = worker_id
+        self.slots = slots
+        self.slot_batch = slot_batch
+        self.cpus = cpus
+        self.shm = shared_memory.SharedMemory(create=True, size=_ring_bytes(slots, slot_batch))
+        self.inputs, self.outputs = _ring_views(self.shm.buf, slots, slot_batch)
+
+        self.process: Optional[mp.Process] = None
+        self.requests: Optional[mp.Queue] = None
+        self.ready = False
+        self.model_version: Optional[str] = None
+        self.restarts = 0
+        self.consecutive_failures = 0
+        self.completed = 0
+
+        self.lock = threading.Lock()
+        self.head = 0
+        self.free_slots = threading.Semaphore(self.slots)
+        self.pending: Dict[int, Tuple[int, int, Future]] = {}
+
+    def _reset_ring(self):
+        """
+        Forget every request and give their slots back (call with the lock held)
+
+        The semaphore is kept, not replaced: callers already blocked in
+        free_slots.acquire() wake up, find their request gone and fail fast
+        instead of waiting out INFERENCE_WORKER_TIMEOUT on a stale semaphore.
+        """
+        held = sum(1 for slot, _, _ in self.pending.values() if slot >= 0)
+        self.pending = {}
+        self.head = 0
+        for _ in range(held):
+            self.free_slots.release()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self, ctx, responses: mp.Queue):
+        self.ready = False
+        self.requests = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(self.worker_id, self.shm.name, self.slots, self.slot_batch,
+                  self.cpus, self.requests, responses),
+            name=f"inference-worker-{self.worker_id}",
+            daemon=True
+        )
+        self.process.start()
+        logger.info(f"Inference worker {self.worker_id} started (pid {self.process.pid}, cpus {self.cpus or 'all'})")
+
+    def fail_pending(self, reason: str):
+        """Fail every outstanding request and reset the ring (worker is gone)"""
+        with self.lock:
+            pending = list(self.pending.values())
+            self._reset_ring()
+        for _, _, future in pending:
+            if not future.done():
+                future.set_exception(InferenceWorkerError(reason))
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive(),
+            "ready": self.ready,
+            "cpus": self.cpus,
+            "model_version": self.model_version,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "restarts": self.restarts
+        }
+
+
+class InferencePool:
+    """Dispatch uint8 batches to inference worker processes"""
+
+    def __init__(self, workers: int, slots: int, slot_batch: int, timeout: float, pin_cpus: bool):
+        self.num_workers = workers
+        self.slots = slots
+        self.slot_batch = slot_batch
+        self.timeout = timeout
+        self.pin_cpus = pin_cpus
+        self.workers: List[WorkerHandle] = []
+        self._ctx = mp.get_context("spawn")  # TensorFlow is not fork-safe
+        self._responses: Optional[mp.Queue] = None
+        self._request_ids = itertools.count()
+        self._dispatch_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self.workers) and not self._stop.is_set()
+
+    def _cpu_sets(self) -> List[List[int]]:
+        """Split the CPUs this process may use into one contiguous set per worker"""
+        if not self.pin_cpus or not hasattr(os, "sched_getaffinity"):
+            return [[] for _ in range(self.num_workers)]
+        cpus = sorted(os.sched_getaffinity(0))
+        if len(cpus) < self.num_workers:
+            return [[cpus[i % len(cpus)]] for i in range(self.num_workers)]
+        share = len(cpus) // self.num_workers
+        return [cpus[i * share:(i + 1) * share] for i in range(self.num_workers)]
+
+    def start(self):
+        """Spawn the workers and the result/monitor threads"""
+        self._stop.clear()
+        self._responses = self._ctx.Queue()
+        self.workers = [
+            WorkerHandle(i, self.slots, self.slot_batch, cpus)
+            for i, cpus in enumerate(self._cpu_sets())
+        ]
+        for worker in self.workers:
+            worker.start(self._ctx, self._responses)
+
+        self._threads = [
+            threading.Thread(target=self._collect, name="inference-results", daemon=True),
+            threading.Thread(target=self._monitor, name="inference-monitor", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Let workers finish queued requests, then shut them down"""
+        self._stop.set()
+        for worker in self.workers:
+            if worker.alive():
+                worker.requests.put(None)
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            worker.fail_pending("Inference pool stopped")
+        if self._responses is not None:
+            self._responses.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        for worker in self.workers:
+            del worker.inputs, worker.outputs
+            worker.shm.close()
+            worker.shm.unlink()
+        self.workers = []
+        logger.info("Inference pool stopped")
+
+    def available(self) -> bool:
+        """At least one worker is ready to take requests"""
+        return self.running and any(worker.ready and worker.alive() for worker in self.workers)
+
+    def reload(self, version: Optional[str]):
+        """Ask every worker to load a model version (after the web process did)"""
+        for worker in self.workers:
+            if worker.alive():
+                worker.requests.put(("reload", version))
+
+    def infer(self, images: np.ndarray) -> Tuple[np.ndarray, List[str], str]:
+        """
+        Run a uint8 batch on the workers
+
+        Batches larger than a slot are split and spread across workers.
+
+        Args:
+            images: (N, 224, 224, 3), dtype uint8
+
+        Returns:
+            Tuple of (probabilities (N, num_classes), stage per image, model version)
+
+        Raises:
+            InferenceWorkerError: If a worker crashed, failed or timed out
+        """
+        futures = [
+            self._submit(images[start:start + self.slot_batch])
+            for start in range(0, len(images), self.slot_batch)
+        ]
+
+        probabilities, stages, versions = [], [], set()
+        deadline = time.monotonic() + self.timeout
+        for future in futures:
+            try:
+                chunk_probs, chunk_stages, version = future.result(max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                raise InferenceWorkerError(f"No result within {self.timeout}s")
+            probabilities.append(chunk_probs)
+            stages.extend(chunk_stages)
+            versions.add(version)
+
+        if len(versions) > 1:
+            # Mid-reload: workers disagree, so the batch has no single version
+            raise InferenceWorkerError(f"Workers answered with different model versions: {sorted(versions)}")
+        return np.concatenate(probabilities), stages, versions.pop()
+
+    def _least_loaded(self) -> WorkerHandle:
+        candidates = [worker for worker in self.workers if worker.ready and worker.alive()]
+        if not candidates:
+            raise InferenceWorkerError("No inference worker available")
+        return min(candidates, key=lambda worker: (worker.in_flight, worker.completed))
+
+    def _submit(self, chunk: np.ndarray) -> Future:
+        """Copy a chunk into the chosen worker's next slot and queue it"""
+        with self._dispatch_lock:
+            worker = self._least_loaded()
+            # Reserve before releasing the dispatch lock so the next caller sees the load
+            request_id = next(self._request_ids)
+            future: Future = Future()
+            with worker.lock:
+                worker.pending[request_id] = (-1, len(chunk), future)
+
+        if not worker.free_slots.acquire(timeout=self.timeout):
+            with worker.lock:
+                worker.pending.pop(request_id, None)
+            raise InferenceWorkerError(f"Worker {worker.worker_id} ring is full")
+
+        with worker.lock:
+            if request_id not in worker.pending:  # worker died while we waited
+                worker.free_slots.release()
+                raise InferenceWorkerError(f"Worker {worker.worker_id} exited")
+            slot = worker.head
+            worker.head = (worker.head + 1) % worker.slots
+            worker.pending[request_id] = (slot, len(chunk), future)
+            worker.inputs[slot, :len(chunk)] = chunk
+            worker.requests.put(("infer", request_id, slot, len(chunk)))
+        return future
+
+    def _collect(self):
+        """Result thread: copy outputs out of their slots and resolve futures"""
+        while True:
+            message = self._responses.get()
+            if message is None:
+                return
+
+            kind, worker_id = message[0], message[1]
+            worker = self.workers[worker_id]
+
+            if kind == "ready":
+                _, _, pid, version = message
+                worker.model_version = version
+                worker.ready = version is not None
+                if worker.ready:
+                    worker.consecutive_failures = 0
+                logger.info(f"Inference worker {worker_id} (pid {pid}) ready with model {version}")
+                continue
+
+            _, _, request_id, version, stages, error = message
+            with worker.lock:
+                entry = worker.pending.pop(request_id, None)
+                if entry is None:
+                    continue  # ring was reset after a crash
+                slot, count, future = entry
+                probabilities = worker.outputs[slot, :count].copy()
+                worker.completed += 1
+                worker.free_slots.release()
+
+            if future.done():
+                continue  # caller already gave up
+            if error is not None:
+                future.set_exception(InferenceWorkerError(f"Worker {worker_id}: {error}"))
+            else:
+                future.set_result((probabilities, stages, version))
+
+    def _monitor(self, interval: float = 1.0):
+        """Restart workers that died, with backoff for crash loops"""
+        next_restart: Dict[int, float] = {}
+        while not self._stop.wait(interval):
+            for worker in self.workers:
+                if worker.alive() or self._stop.is_set():
+                    continue
+                if worker.ready or worker.in_flight:
+                    exit_code = worker.process.exitcode if worker.process else None
+                    logger.error(f"❌ Inference worker {worker.worker_id} exited (code {exit_code})")
+                    worker.ready = False
+                    worker.fail_pending(f"Inference worker {worker.worker_id} exited")
+
+                now = time.monotonic()
+                if now < next_restart.get(worker.worker_id, 0):
+                    continue
+                worker.restarts += 1
+                worker.consecutive_failures += 1
+                next_restart[worker.worker_id] = now + min(2 ** worker.consecutive_failures, 60)
+                worker.start(self._ctx, self._responses)
+
+    def stats(self) -> dict:
+        return {
+            "workers": [worker.stats() for worker in self.workers],
+            "slots": self.slots,
+            "slot_batch": self.slot_batch
+        }
+
+
+# Global instance (started from the app lifespan when INFERENCE_WORKERS > 0)
+inference_pool = InferencePool(
+    workers=settings.INFERENCE_WORKERS,
+    slots=settings.INFERENCE_RING_SLOTS,
+    slot_batch=max(settings.BATCH_MAX_FILES, settings.JOB_BATCH_SIZE),
+    timeout=settings.INFERENCE_WORKER_TIMEOUT,
+    pin_cpus=settings.INFERENCE_PIN_CPUS
+)
@@ -0,0 +1,141 @@
+"""
+Streaming iteration over image collections (directories, tar and zip archives)
+画像コレクションのストリーミング読み込み
+
+Members are yielded one at a time so memory stays flat regardless of how many
+images the source contains.
+"""
+
+from pathlib import Path
+import logging
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+from typing import IO, Iterator, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+# Raised while iterating an unsupported or damaged archive (corrupt members
+# surface part way through, e.g. zlib.error from a deflated zip member)
+ARCHIVE_ERRORS = (
+    ValueError, EOFError, OSError, zipfile.BadZipFile, tarfile.TarError, zlib.error, lzma.LZMAError
+)
+
+
+def is_image_name(name: str) -> bool:
+    """Check whether a file name looks like a supported image"""
+    base = os.path.basename(name)
+    if base.startswith('.') or base.startswith('__MACOSX'):
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_directory(root: Union[str, Path]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Walk a directory tree in a stable order
+
+    Yields:
+        Tuple of (relative_path, image_bytes)
+    """
+    root = Path(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not is_image_name(filename):
+                continue
+            path = Path(dirpath) / filename
+            try:
+                yield path.relative_to(root).as_posix(), path.read_bytes()
+            except OSError as e:
+                logger.warning(f"Skipping unreadable file {path}: {e}")
+
+
+def _limit(max_bytes: Optional[int]) -> int:
+    """read() size that still lets callers detect members over max_bytes"""
+    return -1 if max_bytes is None else max_bytes + 1
+
+
+def iter_tar(fileobj: IO[bytes], max_bytes: Optional[int] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Stream a (optionally compressed) tar archive without seeking
+
+    Args:
+        fileobj: Archive file
+        max_bytes: Read at most max_bytes + 1 bytes of each member, so an
+            oversized member can be rejected without holding all of it
+
+    Yields:
+        Tuple of (member_name, image_bytes)
+    """
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile() or not is_image_name(member.name):
+                continue
+            extracted = archive.extractfile(member)
+            if extracted is None:
+                continue
+            yield member.name, extracted.read(_limit(max_bytes))
+
+
+def iter_zip(fileobj: IO[bytes], max_bytes: Optional[int] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Iterate a zip archive member by member (needs a seekable file)
+
+    Args:
+        fileobj: Archive file
+        max_bytes: As for iter_tar
+
+    Yields:
+        Tuple of (member_name, image_bytes)
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_image_name(info.filename):
+                continue
+            with archive.open(info) as member:
+                yield info.filename, member.read(_limit(max_bytes))
+
+
+def iter_archive(fileobj: IO[bytes], max_bytes: Optional[int] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Iterate a tar or zip archive, detected from its content (max_bytes as for iter_tar)
+
+    Raises:
+        ValueError: If the file is neither a zip nor a tar archive
+    """
+    if fileobj.seekable():
+        position = fileobj.tell()
+        is_zip = zipfile.is_zipfile(fileobj)
+        fileobj.seek(position)
+        if is_zip:
+            return iter_zip(fileobj, max_bytes)
+
+    return _checked_tar(fileobj, max_bytes)
+
+
+def _checked_tar(fileobj: IO[bytes], max_bytes: Optional[int]) -> Iterator[Tuple[str, bytes]]:
+    """Stream a tar archive, reporting unreadable archives as ValueError"""
+    try:
+        yield from iter_tar(fileobj, max_bytes)
+    except tarfile.ReadError as e:
+        raise ValueError(f"Unsupported archive: {e}") from e
+
+
+def iter_source(source: Union[str, Path]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Iterate images from a directory or an archive path
+
+    Yields:
+        Tuple of (name, image_bytes)
+    """
+    path = Path(source)
+    if path.is_dir():
+        yield from iter_directory(path)
+        return
+
+    with open(path, 'rb') as f:
+        yield from iter_archive(f)
@@ -0,0 +1,365 @@
+"""
+In-process prediction cache
+予測結果のキャッシュ
+
+Keys combine the SHA-256 of the uploaded bytes with the model version, so a
+model reload never serves predictions from the previous version.
+
+The hottest entries (by hit count) are snapshotted to a local file
+periodically and at shutdown, so a new replica does not start cold:
+
+    header:  magic, header length, JSON (model version, class names, count)
+    records: sorted by digest; digest (32 bytes), hits, stage, probabilities
+
+At startup the file is only memory-mapped and its header checked; records
+are paged in on demand by a binary search on cache misses, and promoted
+into the LRU when hit. Readiness does not wait for the snapshot, and a
+snapshot from another model version is discarded.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import mmap
+import os
+from pathlib import Path
+import struct
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.models.classifier import Prediction
+
+logger = logging.getLogger(__name__)
+
+
+def image_hash(image_bytes: bytes) -> str:
+    """SHA-256 hex digest of raw image bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def cache_key(content_hash: str, model_version: str) -> str:
+    """Cache key for an image under a given model version"""
+    return f"{model_version}:{content_hash}"
+
+
+SNAPSHOT_MAGIC = b"GCPCSNAP"
+SNAPSHOT_FORMAT = 1
+STAGES = ["full", "fast"]
+
+
+def _record_dtype(num_classes: int) -> np.dtype:
+    return np.dtype([
+        ("digest", "S32"),
+        ("hits", "<u4"),
+        ("stage", "u1"),
+        ("probabilities", "<f4", (num_classes,)),
+    ])
+
+
+class CacheSnapshot:
+    """Read-only, memory-mapped snapshot of cached predictions for one model version"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, header_len = struct.unpack_from("<8sI", self._mmap, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("not a prediction cache snapshot")
+            header = json.loads(self._mmap[12:12 + header_len])
+            if header.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError(f"unsupported snapshot format {header.get('format')}")
+            self.model_version: str = header["model_version"]
+            self.class_names: List[str] = header["class_names"]
+            # A view over the mapping: records are paged in only when searched
+            self._records = np.frombuffer(
+                self._mmap, dtype=_record_dtype(len(self.class_names)),
+                count=header["count"], offset=12 + header_len
+            )
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def find(self, content_hash: str) -> Optional[np.void]:
+        """Binary search for an image's record"""
+        try:
+            digest = bytes.fromhex(content_hash)
+        except ValueError:
+            return None
+        index = int(np.searchsorted(self._records["digest"], digest))
+        if index < len(self._records) and self._records[index].tobytes()[:32] == digest:
+            return self._records[index]
+        return None
+
+    def records(self) -> np.ndarray:
+        return self._records
+
+    def close(self):
+        self._records = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # a record is still referenced; the mapping goes with it
+
+
+class PredictionCache:
+    """Thread-safe LRU cache of predictions"""
+
+    def __init__(self, max_entries: int = 2048, enabled: bool = True):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        # key -> [prediction, hits]
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._snapshot: Optional[CacheSnapshot] = None
+        self.hits = 0
+        self.misses = 0
+        self.snapshot_hits = 0
+
+    def get(self, content_hash: str, model_version: Optional[str]) -> Optional["Prediction"]:
+        """
+        Look up a cached prediction
+
+        Args:
+            content_hash: SHA-256 of the image bytes
+            model_version: Model version the prediction must come from
+
+        Returns:
+            Optional[Prediction]: Cached prediction or None
+        """
+        if not self.enabled or model_version is None:
+            return None
+
+        key = cache_key(content_hash, model_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] += 1
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            snapshot = self._snapshot
+
+        prediction = self._from_snapshot(snapshot, content_hash, model_version)
+        with self._lock:
+            if prediction is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.snapshot_hits += 1
+            self._store(key, prediction, hits=1)
+            return prediction
+
+    def set(self, content_hash: str, prediction: "Prediction"):
+        """Store a prediction under the version that produced it"""
+        if not self.enabled:
+            return
+
+        key = cache_key(content_hash, prediction.model_version)
+        with self._lock:
+            self._store(key, prediction)
+
+    def _store(self, key: str, prediction: "Prediction", hits: int = 0):
+        """Insert or replace an entry (caller holds the lock)"""
+        entry = self._entries.get(key)
+        self._entries[key] = [prediction, hits + (entry[1] if entry is not None else 0)]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _from_snapshot(snapshot: Optional[CacheSnapshot], content_hash: str,
+                       model_version: str) -> Optional["Prediction"]:
+        """Rebuild a prediction from the snapshot, if it has one for this version"""
+        if snapshot is None or snapshot.model_version != model_version:
+            return None
+        record = snapshot.find(content_hash)
+        if record is None:
+            return None
+
+        from app.models.classifier import Prediction
+
+        probabilities = record["probabilities"]
+        predicted_idx = int(np.argmax(probabilities))
+        return Prediction(
+            predicted_class=snapshot.class_names[predicted_idx],
+            confidence=float(probabilities[predicted_idx]),
+            all_probabilities={
+                name: float(probability) for name, probability in zip(snapshot.class_names, probabilities)
+            },
+            model_version=model_version,
+            stage=STAGES[int(record["stage"])]
+        )
+
+    def open_snapshot(self, path: str, model_version: Optional[str]) -> int:
+        """
+        Map a snapshot written by a previous process (no records are read yet)
+
+        A snapshot from another model version, or an unreadable one, is deleted.
+
+        Returns:
+            int: Entries available from the snapshot
+        """
+        path = Path(path)
+        if not self.enabled or model_version is None or not path.exists():
+            return 0
+        try:
+            snapshot = CacheSnapshot(path)
+        except Exception as e:
+            logger.warning(f"⚠️ Discarding unreadable cache snapshot {path}: {e}")
+            path.unlink(missing_ok=True)
+            return 0
+
+        if snapshot.model_version != model_version:
+            logger.info(
+                f"Discarding cache snapshot for model {snapshot.model_version} "
+                f"(serving {model_version})"
+            )
+            snapshot.close()
+            path.unlink(missing_ok=True)
+            return 0
+
+        with self._lock:
+            old, self._snapshot = self._snapshot, snapshot
+        if old is not None:
+            old.close()
+        logger.info(f"♻️ Cache snapshot mapped: {len(snapshot)} entries for model {model_version}")
+        return len(snapshot)
+
+    def save_snapshot(self, path: str, model_version: Optional[str], class_names: List[str],
+                      max_entries: int) -> int:
+        """
+        Write the hottest entries for `model_version` to `path` atomically
+
+        Entries still only in the previous snapshot are carried over at
+        half their hit count, so a snapshot taken soon after a restart does
+        not forget the entries that have not been requested again yet.
+
+        Returns:
+            int: Entries written
+        """
+        if not self.enabled or model_version is None:
+            return 0
+
+        prefix = f"{model_version}:"
+        with self._lock:
+            current = [
+                (key[len(prefix):], entry[0], entry[1])
+                for key, entry in self._entries.items()
+                if key.startswith(prefix)
+            ]
+            snapshot = self._snapshot
+
+        dtype = _record_dtype(len(class_names))
+        candidates: Dict[bytes, tuple] = {}
+        for content_hash, prediction, hits in current:
+            candidates[bytes.fromhex(content_hash)] = (
+                hits,
+                STAGES.index(prediction.stage) if prediction.stage in STAGES else 0,
+                [prediction.all_probabilities[name] for name in class_names]
+            )
+        if snapshot is not None and snapshot.model_version == model_version:
+            for record in snapshot.records():
+                digest = record.tobytes()[:32]
+                if digest not in candidates:
+                    candidates[digest] = (int(record["hits"]) // 2, int(record["stage"]), record["probabilities"])
+
+        hottest = sorted(candidates.items(), key=lambda item: item[1][0], reverse=True)[:max_entries]
+        records = np.zeros(len(hottest), dtype=dtype)
+        for i, (digest, (hits, stage, probabilities)) in enumerate(sorted(hottest)):
+            records[i] = (digest, min(hits, 2**32 - 1), stage, probabilities)
+
+        header = json.dumps({
+            "format": SNAPSHOT_FORMAT,
+            "model_version": model_version,
+            "class_names": list(class_names),
+            "count": len(records)
+        }).encode()
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f"{path.name}.{os.getpid()}.partial")
+        with open(partial, "wb") as f:
+            f.write(struct.pack("<8sI", SNAPSHOT_MAGIC, len(header)))
+            f.write(header)
+            f.write(records.tobytes())
+        # The mapped old file stays valid for readers until it is closed
+        partial.replace(path)
+        return len(records)
+
+    def stats(self) -> dict:
+        """Cache statistics"""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "snapshot_entries": len(self._snapshot) if self._snapshot is not None else 0,
+            "snapshot_hits": self.snapshot_hits
+        }
+
+
+class CacheSnapshotter:
+    """Snapshot the prediction cache periodically and once more on stop"""
+
+    def __init__(self, cache: PredictionCache, path: str, interval: int, max_entries: int,
+                 model_info: Callable[[], tuple]):
+        self.cache = cache
+        self.path = path
+        self.interval = interval
+        self.max_entries = max_entries
+        self.model_info = model_info  # -> (model_version, class_names)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the snapshot thread"""
+        self._thread = threading.Thread(target=self._run, name="cache-snapshot", daemon=True)
+        self._thread.start()
+        logger.info(f"Cache snapshots to {self.path} (every {self.interval}s)")
+
+    def stop(self):
+        """Stop the thread and write a final snapshot"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.snapshot()
+
+    def snapshot(self):
+        try:
+            model_version, class_names = self.model_info()
+            if model_version is None:
+                return
+            written = self.cache.save_snapshot(self.path, model_version, class_names, self.max_entries)
+            logger.info(f"Cache snapshot written: {written} entries")
+        except Exception as e:
+            logger.warning(f"⚠️ Cache snapshot failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.snapshot()
+
+
+# Global instance
+prediction_cache = PredictionCache(
+    max_entries=settings.CACHE_MAX_ENTRIES,
+    enabled=settings.CACHE_ENABLED
+)
@@ -0,0 +1,300 @@
+"""
+On-demand CPU profiling
+CPUプロファイリング
+
+Nothing runs until an admin starts a session, and only one session exists
+at a time. Two modes:
+
+- deterministic: cProfile around the next N matching requests, one request
+  at a time (cProfile cannot be enabled twice). Before Python 3.12 cProfile
+  only sees the thread that enabled it, i.e. the event loop: decode and
+  inference run in the threadpool and are missing, so use sampling mode
+  for them. From 3.12 (cProfile on sys.monitoring) every thread is
+  included while the request is in flight, so treat the result as a view
+  of the replica during the request rather than of the request alone.
+- sampling: a background thread records the stack of every Python thread
+  each SAMPLE_INTERVAL for T seconds. Overhead is bounded by the interval,
+  so this is the one to use under real load.
+
+Results are available as pstats text, collapsed stacks (flamegraph.pl /
+speedscope input) or, for deterministic sessions, a raw pstats dump.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import sys
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DETERMINISTIC = "deterministic"
+SAMPLING = "sampling"
+
+# cProfile hooks every thread only on sys.monitoring (3.12+)
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _collapse_stack(frame) -> str:
+    """Root-first, semicolon-separated stack for one thread"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class ProfileSession:
+    """One profiling run and its accumulated results"""
+
+    def __init__(self, mode: str, max_requests: int, seconds: float, path_prefix: str, interval: float):
+        self.mode = mode
+        self.max_requests = max_requests
+        self.seconds = seconds
+        self.path_prefix = path_prefix
+        self.interval = interval
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + seconds
+        self.finished_at: Optional[float] = None
+
+        self.requests = 0
+        self.samples = 0
+        self.stats: Optional[pstats.Stats] = None
+        self.stacks: Counter = Counter()
+
+        self._busy = threading.Lock()
+        self._results = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> bool:
+        return self.finished_at is None
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.time()
+            self._stop.set()
+            logger.info(
+                f"Profiling session finished: mode={self.mode}, "
+                f"requests={self.requests}, samples={self.samples}"
+            )
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    # ---- deterministic ----
+
+    def wants(self, path: str) -> bool:
+        """Whether the next request on `path` should be profiled"""
+        if not self.active or self.mode != DETERMINISTIC:
+            return False
+        if self.expired():
+            self.finish()
+            return False
+        return path.startswith(self.path_prefix)
+
+    @contextmanager
+    def profile_request(self):
+        """cProfile the enclosed request unless another one is being profiled"""
+        if not self._busy.acquire(blocking=False):
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiling tool is active
+            self._busy.release()
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if self.active:
+                with self._results:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profiler)
+                    else:
+                        self.stats.add(profiler)
+                    self.requests += 1
+                if self.requests >= self.max_requests or self.expired():
+                    self.finish()
+            self._busy.release()
+
+    # ---- sampling ----
+
+    def start_sampler(self):
+        self._thread = threading.Thread(target=self._sample_loop, name="cpu-sampler", daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self.expired():
+                break
+            stacks = [
+                _collapse_stack(frame)
+                for thread_id, frame in sys._current_frames().items()
+                if thread_id != own_id
+            ]
+            with self._results:
+                self.stacks.update(stacks)
+                self.samples += 1
+        self.finish()
+
+    # ---- output ----
+
+    def render(self, fmt: str, limit: int = 50):
+        """
+        Session results
+
+        Args:
+            fmt: "pstats", "collapsed" or "raw" (deterministic only)
+            limit: Rows in the pstats table
+
+        Returns:
+            str or bytes (raw)
+        """
+        with self._results:
+            return self._render(fmt, limit)
+
+    def _render(self, fmt: str, limit: int):
+        if fmt == "collapsed":
+            if self.mode == SAMPLING:
+                return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+            return self._collapsed_from_pstats()
+
+        if fmt == "raw":
+            if self.stats is None:
+                return b""
+            return marshal.dumps(self.stats.stats)
+
+        if self.mode == SAMPLING:
+            return self._sample_table(limit)
+
+        if self.stats is None:
+            return "No requests profiled yet\n"
+        out = io.StringIO()
+        self.stats.stream = out
+        self.stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def _collapsed_from_pstats(self) -> str:
+        """
+        Caller;callee pairs weighted by microseconds of internal time
+
+        cProfile keeps no full stacks, so the flame graph is two levels deep.
+        """
+        if self.stats is None:
+            return ""
+        lines = []
+        for (filename, line, name), (_, _, _, _, callers) in self.stats.stats.items():
+            callee = f"{name} ({filename}:{line})"
+            for (c_file, c_line, c_name), caller_stats in callers.items():
+                internal_time = caller_stats[2]
+                if internal_time > 0:
+                    lines.append(f"{c_name} ({c_file}:{c_line});{callee} {int(internal_time * 1e6)}")
+        return "\n".join(lines)
+
+    def _sample_table(self, limit: int) -> str:
+        """Per-function self and total sample counts"""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for label in set(frames):
+                total_counts[label] += count
+
+        out = io.StringIO()
+        out.write(f"{self.samples} samples every {self.interval * 1000:.1f}ms\n\n")
+        out.write(f"{'self':>8} {'total':>8}  function\n")
+        for label, total in total_counts.most_common(limit):
+            out.write(f"{self_counts[label]:>8} {total:>8}  {label}\n")
+        return out.getvalue()
+
+    def summary(self) -> dict:
+        return {
+            "mode": self.mode,
+            "active": self.active,
+            "path_prefix": self.path_prefix,
+            "max_requests": self.max_requests if self.mode == DETERMINISTIC else None,
+            "threads": "all" if self.mode == SAMPLING or PROFILES_ALL_THREADS else "event loop only",
+            "seconds": self.seconds,
+            "interval_ms": self.interval * 1000 if self.mode == SAMPLING else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "requests_profiled": self.requests,
+            "samples": self.samples
+        }
+
+
+class CPUProfiler:
+    """Holds the current (or last) profiling session"""
+
+    def __init__(self):
+        self.session: Optional[ProfileSession] = None
+        self._lock = threading.Lock()
+
+    def start(
+        self,
+        mode: str,
+        max_requests: int,
+        seconds: float,
+        path_prefix: str,
+        interval: float
+    ) -> Optional[ProfileSession]:
+        """
+        Start a session
+
+        Returns:
+            ProfileSession, or None if one is already running
+        """
+        with self._lock:
+            if self.session is not None and self.session.active:
+                return None
+            self.session = ProfileSession(mode, max_requests, seconds, path_prefix, interval)
+            if mode == SAMPLING:
+                self.session.start_sampler()
+
+        logger.info(
+            f"Profiling session started: mode={mode}, requests={max_requests}, "
+            f"seconds={seconds}, path={path_prefix}"
+        )
+        if mode == DETERMINISTIC and not PROFILES_ALL_THREADS:
+            logger.warning(
+                "⚠️ Deterministic profiling sees only the event-loop thread on this Python; "
+                "threadpool work (decode, inference) needs mode=sampling"
+            )
+        return self.session
+
+    def stop(self) -> Optional[ProfileSession]:
+        """Finish the current session early"""
+        session = self.session
+        if session is not None:
+            session.finish()
+        return session
+
+    def session_for(self, path: str) -> Optional[ProfileSession]:
+        """Session that wants to profile this request (cheap; runs on every request)"""
+        session = self.session
+        if session is not None and session.wants(path):
+            return session
+        return None
+
+
+# Global instance
+cpu_profiler = CPUProfiler()
@@ -0,0 +1,148 @@
+"""
+Request deadlines and cancellation of abandoned work
+リクエストの期限と放棄された処理のキャンセル
+
+Each predict request carries a Deadline: the X-Request-Timeout header (in
+seconds) or REQUEST_TIMEOUT, whichever is shorter, counted from when the
+request arrived (TimingMiddleware stamps the scope), so a slow upload uses
+up the budget too. While the request is being handled, a watcher task
+listens for the client disconnecting.
+
+Work checks the current deadline at the points where it would otherwise
+commit capacity: before decoding, while queued for an inference slot and
+before each model call. Expired or disconnected requests leave at the
+first check, so under overload nothing is spent on answers nobody reads.
+Code without a deadline (batch jobs, the CLI) is never cancelled.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+from starlette.requests import Request
+
+from app.core.metrics import REQUESTS_ABANDONED
+
+logger = logging.getLogger(__name__)
+
+# Scope key holding time.monotonic() at arrival (set by TimingMiddleware)
+ARRIVED_AT = "app.arrived_at"
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("request_deadline", default=None)
+
+
+class RequestAborted(RuntimeError):
+    """The request's work was cancelled before completion"""
+
+    reason = "aborted"
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request abandoned ({self.reason}) before {stage}")
+        self.stage = stage
+
+
+class DeadlineExceeded(RequestAborted):
+    """The request's deadline passed"""
+
+    reason = "deadline"
+
+
+class ClientDisconnected(RequestAborted):
+    """The client went away"""
+
+    reason = "disconnected"
+
+
+class Deadline:
+    """Time limit and disconnect flag for one request"""
+
+    def __init__(self, timeout: float, started_at: Optional[float] = None):
+        self.timeout = timeout
+        self.expires_at = (time.monotonic() if started_at is None else started_at) + timeout
+        self.disconnected = False
+        self.aborted: Optional[RequestAborted] = None
+
+    def remaining(self) -> float:
+        """Seconds left (0 once expired)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str):
+        """
+        Stop work for a request nobody is waiting for
+
+        Args:
+            stage: Where the work is being cancelled (decode, queue, inference)
+
+        Raises:
+            ClientDisconnected: If the client went away
+            DeadlineExceeded: If the deadline passed
+        """
+        if self.aborted is not None:
+            raise self.aborted
+        if self.disconnected:
+            error: RequestAborted = ClientDisconnected(stage)
+        elif self.expired:
+            error = DeadlineExceeded(stage)
+        else:
+            return
+
+        # Counted once per request, at the stage that first noticed
+        self.aborted = error
+        REQUESTS_ABANDONED.labels(error.reason, stage).inc()
+        logger.info(f"⏹️ Abandoned request ({error.reason}) before {stage}")
+        raise error
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def check_deadline(stage: str):
+    """Check the current request's deadline (no-op outside a request)"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def time_left(timeout: Optional[float]) -> Optional[float]:
+    """Cap a wait timeout (None = unbounded) by the current request's deadline"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return timeout
+    remaining = deadline.remaining()
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+async def _watch_disconnect(request: Request, deadline: Deadline):
+    """Flag the deadline when the client disconnects (the body is already read)"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            deadline.disconnected = True
+            return
+
+
+@asynccontextmanager
+async def request_deadline(request: Request, timeout: float) -> AsyncIterator[Deadline]:
+    """
+    Give the enclosed request handling (and its threadpool calls) a deadline
+
+    Must be entered after the request body has been read, since the
+    disconnect watcher consumes further ASGI receive messages. The time
+    spent receiving that body still counts: the deadline runs from arrival.
+    """
+    deadline = Deadline(timeout, request.scope.get(ARRIVED_AT))
+    token = _current_deadline.set(deadline)
+    watcher = asyncio.create_task(_watch_disconnect(request, deadline))
+    try:
+        yield deadline
+    finally:
+        watcher.cancel()
+        _current_deadline.reset(token)
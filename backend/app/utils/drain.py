@@ -0,0 +1,134 @@
+"""
+Graceful drain for rolling deploys
+ローリングデプロイ時のグレースフルドレイン
+
+Once draining starts, /ready fails so the load balancer stops routing here,
+new inference work is refused with 503 (clients retry on another replica)
+and work that was already accepted is allowed to finish.
+
+Draining is started by POST /admin/drain (use it as the preStop hook, so
+it runs before SIGTERM) or, at the latest, by the lifespan shutdown.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Admission:
+    """One admitted unit of inference work; release() is idempotent"""
+
+    def __init__(self, controller: "DrainController"):
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        with self._controller._lock:
+            if self._released:
+                return
+            self._released = True
+            self._controller._in_flight -= 1
+
+    def __enter__(self) -> "Admission":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class DrainController:
+    """Track accepted inference work and refuse new work while draining"""
+
+    def __init__(self):
+        self.draining = False
+        self.started_at: Optional[float] = None
+        self.refused = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def begin(self) -> bool:
+        """
+        Start draining
+
+        Returns:
+            bool: False if draining had already started
+        """
+        with self._lock:
+            if self.draining:
+                return False
+            self.draining = True
+            self.started_at = time.time()
+        logger.info(f"🚰 Draining: refusing new work, {self._in_flight} request(s) in flight")
+        return True
+
+    def refuse(self) -> bool:
+        """Count and report a refused request (True while draining)"""
+        if self.draining:
+            self.refused += 1
+            return True
+        return False
+
+    def admit(self) -> Optional[Admission]:
+        """
+        Accept new inference work unless draining, in one step
+
+        Checking and counting under the same lock means a drain that starts
+        right after cannot see the replica idle while this work is admitted.
+
+        Returns:
+            Admission to release when the work is done, or None (counted as
+            refused) while draining
+        """
+        with self._lock:
+            if self.draining:
+                self.refused += 1
+                return None
+            self._in_flight += 1
+        return Admission(self)
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Mark inference work as in flight (work already accepted, e.g. a WebSocket stream)"""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    async def wait_idle(self, timeout: float, poll_interval: float = 0.05) -> bool:
+        """
+        Wait until no accepted work is in flight
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        deadline = time.monotonic() + timeout
+        while self._in_flight > 0:
+            if time.monotonic() >= deadline:
+                logger.warning(f"⚠️ Drain timed out with {self._in_flight} request(s) in flight")
+                return False
+            await asyncio.sleep(poll_interval)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "draining": self.draining,
+            "draining_for_s": round(time.time() - self.started_at, 1) if self.started_at else None,
+            "in_flight": self._in_flight,
+            "refused": self.refused
+        }
+
+
+# Global instance
+drain = DrainController()
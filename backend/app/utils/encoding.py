@@ -0,0 +1,132 @@
+"""
+Response encoding: content negotiation and field projection
+レスポンスのエンコードとフィールド選択
+
+JSON stays the default. Clients that send `Accept: application/msgpack` or
+`Accept: application/cbor` get a binary body instead (when the optional
+msgpack / cbor2 packages are installed), and `fields=` / `compact=true`
+trim a prediction down to the fields they actually use.
+"""
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, Response
+import logging
+from typing import Any, Iterable, List, Optional, Set
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # optional
+    cbor2 = None
+
+logger = logging.getLogger(__name__)
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+MEDIA_TYPE_ALIASES = {
+    "application/json": JSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/cbor": CBOR,
+}
+
+# Fields returned by compact=true
+COMPACT_FIELDS = ("predicted_class", "confidence", "all_probabilities")
+
+
+def available_media_types() -> Set[str]:
+    """Encodings this process can produce"""
+    types = {JSON}
+    if msgpack is not None:
+        types.add(MSGPACK)
+    if cbor2 is not None:
+        types.add(CBOR)
+    return types
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Choose the response media type from an Accept header
+
+    Returns:
+        str: JSON, MSGPACK or CBOR
+
+    Raises:
+        HTTPException: 406 if only unavailable binary encodings are acceptable
+    """
+    if not accept:
+        return JSON
+
+    available = available_media_types()
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, _, params = part.strip().partition(";")
+        media_type = media_type.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, position, media_type))
+
+    wanted_binary = False
+    for _, _, media_type in sorted(candidates):
+        if media_type in ("*/*", "application/*"):
+            return JSON
+        canonical = MEDIA_TYPE_ALIASES.get(media_type)
+        if canonical in available:
+            return canonical
+        if canonical is not None:
+            wanted_binary = True
+
+    if wanted_binary or not candidates:
+        raise HTTPException(
+            status_code=406,
+            detail=f"Supported response types: {', '.join(sorted(available))}"
+        )
+    return JSON
+
+
+def parse_fields(fields: Optional[str], compact: bool, allowed: Iterable[str]) -> Optional[List[str]]:
+    """
+    Resolve the fields= / compact= query parameters
+
+    Returns:
+        Optional[List[str]]: Fields to include, or None for the full document
+
+    Raises:
+        HTTPException: 400 on unknown field names
+    """
+    if fields:
+        requested = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = set(requested) - set(allowed)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        return requested
+    if compact:
+        return list(COMPACT_FIELDS)
+    return None
+
+
+def encode(payload: Any, media_type: str, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Encode a JSON-compatible payload with the negotiated media type"""
+    headers = {**(headers or {}), "Vary": "Accept"}
+
+    if media_type == MSGPACK:
+        return Response(msgpack.packb(payload, use_bin_type=True), status_code=status_code,
+                        media_type=MSGPACK, headers=headers)
+    if media_type == CBOR:
+        return Response(cbor2.dumps(payload), status_code=status_code,
+                        media_type=CBOR, headers=headers)
+    return JSONResponse(payload, status_code=status_code, headers=headers)
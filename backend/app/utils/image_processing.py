@@ -5,78 +5,355 @@ Image preprocessing utilities
 
 from PIL import Image
 import numpy as np
+from contextlib import ExitStack, contextmanager
 from io import BytesIO
 import logging
+import threading
 from typing import Tuple, Optional
 
+from app.core.config import settings
+from app.core.metrics import DECODE_BYTES_IN_USE, DECODE_REJECTED
+from app.core.tracing import span
+from app.utils.deadline import RequestAborted, check_deadline, time_left
+
+# Pre-decoded uint8 tensors accepted from trusted clients
+NPY_CONTENT_TYPE = 'application/x-npy'
+RAW_CONTENT_TYPE = 'application/octet-stream'
+TENSOR_CONTENT_TYPES = {NPY_CONTENT_TYPE, RAW_CONTENT_TYPE}
+
+# PIL stores RGB/RGBA/L images in 4 bytes per pixel at most
+BYTES_PER_PIXEL = 4
+
 logger = logging.getLogger(__name__)
 
+# PIL's own guard (warns above this, raises DecompressionBombError above 2x)
+Image.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
+
+
+class ImageTooLargeError(ValueError):
+    """Image dimensions exceed MAX_IMAGE_PIXELS"""
+
+
+class DecodeBudgetExceeded(RuntimeError):
+    """No decode memory became available in time"""
+
+
+class DecodeBudget:
+    """
+    Process-wide cap on decoded image bytes in flight
+    
+    Every decode reserves its estimated footprint before touching pixel data,
+    so peak decode memory stays under `limit_bytes` however many requests
+    arrive at once. A single image larger than the whole budget still runs,
+    but only on its own.
+    """
+    
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self._cond = threading.Condition()
+    
+    @contextmanager
+    def reserve(self, nbytes: int, timeout: Optional[float]):
+        """
+        Hold `nbytes` of the budget for the duration of the block
+        
+        Args:
+            nbytes: Estimated decoded size
+            timeout: Seconds to wait for budget (None = wait indefinitely, 0 = fail fast)
+            
+        Raises:
+            DecodeBudgetExceeded: If the budget is still exhausted after `timeout`
+        """
+        nbytes = min(nbytes, self.limit_bytes)
+        with self._cond:
+            if self.in_use + nbytes > self.limit_bytes:
+                with span("decode_wait"):
+                    available = self._cond.wait_for(lambda: self.in_use + nbytes <= self.limit_bytes, timeout)
+                if not available:
+                    DECODE_REJECTED.labels("budget").inc()
+                    raise DecodeBudgetExceeded(
+                        f"Decode budget exhausted ({self.in_use // 2**20}MB of "
+                        f"{self.limit_bytes // 2**20}MB in use)"
+                    )
+            self.in_use += nbytes
+            DECODE_BYTES_IN_USE.set(self.in_use)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= nbytes
+                DECODE_BYTES_IN_USE.set(self.in_use)
+                self._cond.notify_all()
+    
+    def stats(self) -> dict:
+        """Current budget usage"""
+        return {"limit_bytes": self.limit_bytes, "in_use_bytes": self.in_use}
+
+
 class ImageProcessor:
     """Handle all image preprocessing for the model"""
     
-    def __init__(self, target_size: Tuple[int, int] = (224, 224)):
+    def __init__(
+        self,
+        target_size: Tuple[int, int] = (224, 224),
+        max_pixels: int = settings.MAX_IMAGE_PIXELS,
+        budget: Optional[DecodeBudget] = None
+    ):
         self.target_size = target_size
         self.supported_formats = {'PNG', 'JPEG', 'JPG', 'WEBP'}
+        self.max_pixels = max_pixels
+        self.budget = budget or DecodeBudget(settings.DECODE_MEMORY_BUDGET_MB * 1024 * 1024)
     
-    def preprocess(self, image_bytes: bytes) -> Optional[np.ndarray]:
+    def preprocess(self, image_bytes: bytes, block: bool = False) -> Optional[np.ndarray]:
         """
         Preprocess image for model prediction
         
         Args:
             image_bytes: Raw image bytes
+            block: Wait indefinitely for decode budget (see decode)
             
         Returns:
             np.ndarray: Preprocessed image array (1, 224, 224, 3)
         """
-        try:
-            # Validate input
-            if not image_bytes or len(image_bytes) == 0:
-                logger.error("Empty image bytes received")
-                return None
-            
-            logger.info(f"Processing image: {len(image_bytes)} bytes")
-            
-            # Create BytesIO from bytes
-            image_io = BytesIO(image_bytes)
+        img_array = self.decode(image_bytes, block=block)
+        if img_array is None:
+            return None
+        
+        img_array = self.normalize(img_array[np.newaxis])
+        logger.info(f"✅ Final preprocessed shape: {img_array.shape}, dtype: {img_array.dtype}")
+        
+        return img_array
+    
+    def _open(self, image_bytes: bytes) -> Optional[Tuple[Image.Image, int]]:
+        """
+        Open an image (reads the header only) and check its dimensions
+        
+        Returns:
+            Tuple of (image, estimated decoded size in bytes), or None if
+            the image is empty or too small
             
-            # Open image
-            image = Image.open(image_io)
+        Raises:
+            ImageTooLargeError: If the image has more than max_pixels pixels
+        """
+        # Validate input
+        if not image_bytes or len(image_bytes) == 0:
+            logger.error("Empty image bytes received")
+            return None
+        
+        logger.info(f"Processing image: {len(image_bytes)} bytes")
+        
+        # Create BytesIO from bytes
+        image_io = BytesIO(image_bytes)
+        
+        # Open image (reads the header only)
+        image = Image.open(image_io)
+        
+        # Log original format
+        logger.info(f"Original image: format={image.format}, mode={image.mode}, size={image.size}")
+        
+        # Validate dimensions
+        if image.size[0] < 50 or image.size[1] < 50:
+            logger.error(f"Image too small: {image.size}")
+            return None
+        
+        pixels = image.size[0] * image.size[1]
+        if pixels > self.max_pixels:
+            DECODE_REJECTED.labels("pixels").inc()
+            raise ImageTooLargeError(
+                f"Image too large: {image.size[0]}x{image.size[1]} "
+                f"({pixels / 1e6:.1f}MP, max {self.max_pixels / 1e6:.1f}MP)"
+            )
+        
+        # Decoded frame, plus a second copy while converting to RGB
+        decoded_bytes = pixels * BYTES_PER_PIXEL * (1 if image.mode == 'RGB' else 2)
+        return image, decoded_bytes
+    
+    def inspect(self, image_bytes: bytes) -> Optional[int]:
+        """
+        Check an image from its header without decoding it
+        
+        Used by the TF preprocessing backend, which decodes inside the
+        model's graph but applies the same limits as decode.
+        
+        Returns:
+            int: Estimated decoded size in bytes (for reserve), or None if
+                the image is unreadable or too small
             
-            # Log original format
-            logger.info(f"Original image: format={image.format}, mode={image.mode}, size={image.size}")
+        Raises:
+            ImageTooLargeError: If the image has more than max_pixels pixels
+        """
+        try:
+            opened = self._open(image_bytes)
+        except ImageTooLargeError as e:
+            logger.warning(f"⚠️ Image rejected: {e}")
+            raise
+        except Image.DecompressionBombError as e:
+            DECODE_REJECTED.labels("pixels").inc()
+            logger.warning(f"⚠️ Image rejected: {e}")
+            raise ImageTooLargeError(str(e)) from e
+        except Exception as e:
+            logger.error(f"❌ Image header check failed: {e}")
+            return None
+        return opened[1] if opened is not None else None
+    
+    @contextmanager
+    def reserve(self, nbytes: int, block: bool = False):
+        """
+        Hold decode budget for pixels decoded outside PIL (TF backend)
+        
+        Waits under the same rules as decode.
+        
+        Raises:
+            DecodeBudgetExceeded: If no budget became available in time
+            RequestAborted: If the request's deadline passed first
+        """
+        check_deadline("decode")
+        timeout = time_left(None if block else settings.DECODE_BUDGET_TIMEOUT)
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(self.budget.reserve(nbytes, timeout))
+            except DecodeBudgetExceeded:
+                # Budget wait cut short by the deadline: report the deadline
+                check_deadline("decode")
+                raise
+            yield
+    
+    def decode(self, image_bytes: bytes, block: bool = False) -> Optional[np.ndarray]:
+        """
+        Decode and resize an image without normalizing it
+        
+        Returning uint8 keeps the array 4x smaller than float32, which matters
+        when decoded images are passed between processes.
+        
+        Dimensions are read from the header first; oversized images are
+        rejected and the rest reserve their decoded size from the process-wide
+        budget before any pixel data is decoded.
+        
+        Args:
+            image_bytes: Raw image bytes
+            block: Wait indefinitely for decode budget (background work);
+                otherwise wait at most DECODE_BUDGET_TIMEOUT seconds
             
-            # Convert to RGB if needed
-            if image.mode != 'RGB':
-                logger.info(f"Converting from {image.mode} to RGB")
-                image = image.convert('RGB')
+        Returns:
+            np.ndarray: RGB image array (224, 224, 3), dtype uint8
             
-            # Validate dimensions
-            if image.size[0] < 50 or image.size[1] < 50:
-                logger.error(f"Image too small: {image.size}")
+        Raises:
+            ImageTooLargeError: If the image has more than max_pixels pixels
+            DecodeBudgetExceeded: If no budget became available in time
+            RequestAborted: If the request's deadline passed or its client
+                disconnected before decoding
+        """
+        try:
+            opened = self._open(image_bytes)
+            if opened is None:
                 return None
+            image, decoded_bytes = opened
             
-            # Resize to target size
-            logger.info(f"Resizing from {image.size} to {self.target_size}")
-            image = image.resize(self.target_size, Image.LANCZOS)
+            # Never wait for budget past the request's deadline
+            check_deadline("decode")
+            timeout = time_left(None if block else settings.DECODE_BUDGET_TIMEOUT)
+            
+            with self.budget.reserve(decoded_bytes, timeout):
+                with span("decode"):
+                    image.load()
+                    
+                    # Convert to RGB if needed
+                    if image.mode != 'RGB':
+                        logger.info(f"Converting from {image.mode} to RGB")
+                        image = image.convert('RGB')
+                
+                # Resize to target size
+                logger.info(f"Resizing from {image.size} to {self.target_size}")
+                with span("resize"):
+                    image = image.resize(self.target_size, Image.LANCZOS)
             
             # Convert to numpy array
-            img_array = np.array(image, dtype=np.float32)
+            img_array = np.asarray(image, dtype=np.uint8)
             logger.info(f"Array shape after conversion: {img_array.shape}")
             
-            # Normalize to [0, 1]
-            img_array = img_array / 255.0
-            
-            # Add batch dimension
-            img_array = np.expand_dims(img_array, axis=0)
-            
-            logger.info(f"✅ Final preprocessed shape: {img_array.shape}, dtype: {img_array.dtype}")
-            
             return img_array
             
+        except (ImageTooLargeError, DecodeBudgetExceeded) as e:
+            # Budget wait cut short by the deadline: report the deadline
+            check_deadline("decode")
+            logger.warning(f"⚠️ Image rejected: {e}")
+            raise
+        except RequestAborted:
+            raise
+        except Image.DecompressionBombError as e:
+            DECODE_REJECTED.labels("pixels").inc()
+            logger.warning(f"⚠️ Image rejected: {e}")
+            raise ImageTooLargeError(str(e)) from e
         except Exception as e:
             logger.error(f"❌ Image preprocessing failed: {e}", exc_info=True)
             return None
     
+    @staticmethod
+    def normalize(batch: np.ndarray) -> np.ndarray:
+        """
+        Scale a batch of uint8 images to float32 in [0, 1]
+        
+        Args:
+            batch: Image batch (N, 224, 224, 3), dtype uint8
+            
+        Returns:
+            np.ndarray: Normalized batch, dtype float32
+        """
+        img_array = batch.astype(np.float32)
+        img_array /= 255.0
+        return img_array
+    
+    def from_tensor(self, data: bytes, content_type: str) -> Optional[np.ndarray]:
+        """
+        Wrap a pre-decoded uint8 image without copying it
+        
+        Accepts a .npy file (application/x-npy) or raw HWC bytes
+        (application/octet-stream) of exactly the model input size. PIL is
+        skipped entirely; scaling to [0, 1] happens inside the model call.
+        
+        Args:
+            data: Uploaded tensor bytes
+            content_type: NPY_CONTENT_TYPE or RAW_CONTENT_TYPE
+            
+        Returns:
+            np.ndarray: Read-only view (1, 224, 224, 3), dtype uint8
+        """
+        height, width = self.target_size[1], self.target_size[0]
+        expected_shape = (height, width, 3)
+        
+        try:
+            if content_type == NPY_CONTENT_TYPE:
+                header = BytesIO(data)
+                version = np.lib.format.read_magic(header)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+                elif version == (2, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+                else:
+                    raise ValueError(f"unsupported .npy version {version}")
+                offset = header.tell()
+                
+                if dtype != np.uint8 or fortran_order:
+                    logger.error(f"Tensor rejected: dtype={dtype}, fortran_order={fortran_order}")
+                    return None
+                if tuple(shape) not in (expected_shape, (1,) + expected_shape):
+                    logger.error(f"Tensor rejected: shape={shape}, expected {expected_shape}")
+                    return None
+            else:
+                offset = 0
+            
+            if len(data) - offset != height * width * 3:
+                logger.error(f"Tensor rejected: {len(data) - offset} bytes, expected {height * width * 3}")
+                return None
+            
+            # frombuffer shares memory with the request body
+            return np.frombuffer(data, dtype=np.uint8, offset=offset).reshape((1,) + expected_shape)
+            
+        except ValueError as e:
+            logger.error(f"❌ Invalid tensor upload: {e}")
+            return None
+    
     def get_image_info(self, image_bytes: bytes) -> dict:
         """
         Get image metadata
@@ -0,0 +1,220 @@
+"""
+Persistent batch job store (SQLite)
+バッチジョブの永続ストア
+
+Job metadata and per-image results live in SQLite; uploaded images are kept
+as files under JOBS_DIR/<job_id>/ until they have been classified. Both
+survive a process restart, so interrupted jobs resume where they stopped.
+"""
+
+from pathlib import Path
+import json
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    model_version TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobStore:
+    """SQLite-backed store for batch jobs and their results"""
+
+    def __init__(self, db_path: str, jobs_dir: str):
+        self.db_path = Path(db_path)
+        self.jobs_dir = Path(jobs_dir)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Open the database (idempotent)"""
+        if self._conn is not None:
+            return
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        logger.info(f"Job store opened: {self.db_path}")
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- Job lifecycle ----------
+
+    def new_job_id(self) -> str:
+        """Generate a job id and create its input directory"""
+        job_id = uuid.uuid4().hex
+        self.input_dir(job_id).mkdir(parents=True, exist_ok=True)
+        return job_id
+
+    def input_dir(self, job_id: str) -> Path:
+        """Directory holding a job's not yet classified images"""
+        return self.jobs_dir / job_id
+
+    def input_path(self, job_id: str, seq: int) -> Path:
+        """File holding one input image"""
+        return self.input_dir(job_id) / f"{seq:08d}"
+
+    def create_job(self, job_id: str, names: List[str]):
+        """Register a job whose inputs have already been written to disk"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, len(names), now, now)
+            )
+            self._conn.executemany(
+                "INSERT INTO items (job_id, seq, name) VALUES (?, ?, ?)",
+                [(job_id, seq, name) for seq, name in enumerate(names)]
+            )
+
+    def discard_inputs(self, job_id: str):
+        """Delete a job's input directory"""
+        shutil.rmtree(self.input_dir(job_id), ignore_errors=True)
+
+    def requeue_interrupted(self) -> int:
+        """
+        Put jobs that were running when the process stopped back in the queue
+
+        Returns:
+            int: Number of jobs requeued
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'",
+                (time.time(),)
+            )
+            return cursor.rowcount
+
+    def next_job(self) -> Optional[str]:
+        """Claim the oldest queued job and mark it running"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), row["id"])
+            )
+            return row["id"]
+
+    def pending_items(self, job_id: str, limit: int) -> List[Tuple[int, str]]:
+        """Next unprocessed items of a job as (seq, name)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, name FROM items WHERE job_id = ? AND status = 'pending' ORDER BY seq LIMIT ?",
+                (job_id, limit)
+            ).fetchall()
+        return [(row["seq"], row["name"]) for row in rows]
+
+    def save_results(self, job_id: str, results: List[Tuple[int, Optional[dict], Optional[str]]],
+                     model_version: Optional[str]):
+        """
+        Store a batch of results in one transaction
+
+        Args:
+            job_id: Job id
+            results: (seq, result, error) per item; result is None on failure
+            model_version: Model version that produced the results
+        """
+        done = sum(1 for _, result, _ in results if result is not None)
+        failed = len(results) - done
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE items SET status = ?, result = ? WHERE job_id = ? AND seq = ?",
+                [
+                    (
+                        "done" if result is not None else "failed",
+                        json.dumps(result if result is not None else {"error": error}),
+                        job_id,
+                        seq
+                    )
+                    for seq, result, error in results
+                ]
+            )
+            self._conn.execute(
+                "UPDATE jobs SET completed = completed + ?, failed = failed + ?, "
+                "model_version = COALESCE(?, model_version), updated_at = ? WHERE id = ?",
+                (done, failed, model_version, time.time(), job_id)
+            )
+
+    def finish_job(self, job_id: str, status: str, error: Optional[str] = None):
+        """Mark a job completed or failed"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    # ---------- Queries ----------
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Job status and progress"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["job_id"] = job.pop("id")
+        processed = job["completed"] + job["failed"]
+        job["progress"] = processed / job["total"] if job["total"] else 1.0
+        return job
+
+    def get_results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[Dict]:
+        """Finished results of a job, in submission order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, name, status, result FROM items "
+                "WHERE job_id = ? AND status != 'pending' ORDER BY seq LIMIT ? OFFSET ?",
+                (job_id, limit, offset)
+            ).fetchall()
+
+        return [
+            {"seq": row["seq"], "id": row["name"], "status": row["status"], **json.loads(row["result"])}
+            for row in rows
+        ]
+
+
+# Global instance
+job_store = JobStore(db_path=settings.JOBS_DB_PATH, jobs_dir=settings.JOBS_DIR)
@@ -0,0 +1,167 @@
+"""
+Background worker for batch jobs
+バッチジョブのバックグラウンドワーカー
+
+Jobs run at lower priority than interactive /predict traffic: the worker
+thread is niced, and its model calls go through the bulk inference lane.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.models.classifier import Prediction, classifier
+from app.models.scheduler import BULK, inference_lane
+from app.utils.image_processing import ImageTooLargeError, image_processor
+from app.utils.job_store import JobStore, job_store
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """Process queued jobs on a background thread"""
+
+    def __init__(self, store: JobStore, batch_size: int = 32, poll_interval: float = 5.0,
+                 retry_attempts: int = 4, retry_backoff: float = 2.0):
+        self.store = store
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Resume interrupted jobs and start the worker thread"""
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted job(s)")
+
+        self._thread = threading.Thread(target=self._run, name="job-worker", daemon=True)
+        self._thread.start()
+        logger.info("Job worker started")
+
+    def stop(self, timeout: float = 30.0):
+        """Stop after the current batch; unfinished jobs resume on restart"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def notify(self):
+        """Wake the worker after a job was submitted"""
+        self._wakeup.set()
+
+    def _run(self):
+        # Lower this thread's CPU priority (Linux applies nice per thread)
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), settings.JOB_NICENESS)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not lower job worker priority: {e}")
+
+        while not self._stop.is_set():
+            job_id = self.store.next_job()
+            if job_id is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._process(job_id)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+                self.store.finish_job(job_id, "failed", error=str(e))
+                self.store.discard_inputs(job_id)
+
+    def _process(self, job_id: str):
+        logger.info(f"Processing job {job_id}")
+
+        while not self._stop.is_set():
+            items = self.store.pending_items(job_id, self.batch_size)
+            if not items:
+                self.store.finish_job(job_id, "completed")
+                self.store.discard_inputs(job_id)
+                logger.info(f"✅ Job {job_id} completed")
+                return
+
+            results, seqs, arrays = [], [], []
+            for seq, name in items:
+                try:
+                    image_bytes = self.store.input_path(job_id, seq).read_bytes()
+                except OSError:
+                    results.append((seq, None, "input_missing"))
+                    continue
+                try:
+                    array = image_processor.decode(image_bytes, block=True)
+                except ImageTooLargeError:
+                    results.append((seq, None, "image_too_large"))
+                    continue
+                if array is None:
+                    results.append((seq, None, "decode_failed"))
+                else:
+                    seqs.append(seq)
+                    arrays.append(array)
+
+            model_version = None
+            if arrays:
+                predictions = self._predict(job_id, np.stack(arrays))
+                if predictions is None:
+                    if self._stop.is_set():
+                        return  # stopped while backing off: the batch is redone after a restart
+                    results.extend((seq, None, "inference_failed") for seq in seqs)
+                else:
+                    model_version = predictions[0].model_version
+                    for seq, prediction in zip(seqs, predictions):
+                        results.append((seq, {
+                            "predicted_class": prediction.predicted_class,
+                            "confidence": prediction.confidence,
+                            "all_probabilities": prediction.all_probabilities,
+                            "model_version": prediction.model_version
+                        }, None))
+
+            self.store.save_results(job_id, results, model_version)
+            for seq, _ in items:
+                self.store.input_path(job_id, seq).unlink(missing_ok=True)
+
+        # Stopped mid-job: leave it running so requeue_interrupted() picks it up
+
+    def _predict(self, job_id: str, batch: np.ndarray) -> Optional[List[Prediction]]:
+        """
+        Classify one batch, retrying with backoff
+
+        Model calls fail transiently (a reload in progress, a crashed
+        inference worker), so one failure must not fail the whole job.
+
+        Returns:
+            Predictions, or None if every attempt failed or the worker is stopping
+        """
+        delay = self.retry_backoff
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                # Interactive traffic first: the batch runs in chunks behind it
+                with inference_lane(BULK):
+                    return classifier.predict_batch(batch)
+            except Exception as e:
+                if attempt == self.retry_attempts:
+                    logger.error(f"Job {job_id}: batch of {len(batch)} failed after {attempt} attempts: {e}")
+                    return None
+                logger.warning(f"⚠️ Job {job_id}: batch failed ({e}), retrying in {delay:g}s")
+            if self._stop.wait(delay):
+                return None
+            delay *= 2
+        return None
+
+
+# Global instance
+job_worker = JobWorker(
+    job_store,
+    batch_size=settings.JOB_BATCH_SIZE,
+    retry_attempts=settings.JOB_RETRY_ATTEMPTS,
+    retry_backoff=settings.JOB_RETRY_BACKOFF
+)
@@ -0,0 +1,276 @@
+"""
+Event-loop lag monitor and blocking-call detection
+イベントループ遅延の監視とブロッキング検出
+
+A watchdog thread posts a probe callback to the event loop every
+LOOP_MONITOR_INTERVAL seconds and measures how long it waits to run
+(event_loop_lag_seconds). That delay is what every ready request pays
+when something runs synchronously on the loop: model.predict, PIL decode,
+blocking file I/O. If a probe has not run after LOOP_BLOCK_THRESHOLD_MS,
+the watchdog captures the loop thread's stack while the blocking code is
+still on it, logs it and keeps the last few for GET /admin/loop.
+
+Debug mode (LOOP_BLOCK_BUDGET_MS > 0, meant for tests and CI) times every
+step of each request's own task. A request whose handler held the loop
+longer than the budget in one step raises LoopBlockedError once it
+finishes, naming the call that blocked; TestClient re-raises it in the
+test (see tests/test_loop_monitor.py).
+"""
+
+import asyncio
+from collections import deque
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from typing import Deque, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import EVENT_LOOP_BLOCKED, EVENT_LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+STACK_LIMIT = 30  # innermost frames kept per captured stack
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIBRARY_ROOTS = tuple({sysconfig.get_paths()[name] for name in ("stdlib", "platstdlib", "purelib", "platlib")})
+
+
+class LoopBlockedError(RuntimeError):
+    """A request held the event loop longer than LOOP_BLOCK_BUDGET_MS"""
+
+
+def _format_stack(frame) -> List[str]:
+    return [line.rstrip() for line in traceback.format_stack(frame, limit=STACK_LIMIT)]
+
+
+class EventLoopMonitor:
+    """Measure event-loop scheduling lag and capture the stack of long blocks"""
+
+    def __init__(self, interval: float, threshold: float, max_stalls: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.probes = 0
+        self.blocked = 0
+        self.max_lag = 0.0
+        self._stalls: Deque[dict] = deque(maxlen=max_stalls)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Start watching `loop` (call from the loop's thread)"""
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()  # a stopped watchdog may still be finishing its last probe
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._watch, args=(loop, self._stop), name="loop-monitor", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"⏱️ Event-loop monitor started (probe every {self.interval * 1000:.0f}ms, "
+            f"stack capture above {self.threshold * 1000:.0f}ms)"
+        )
+
+    def stop(self):
+        """Stop watching (without joining: that would block the loop it watches)"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread = None
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, stop: threading.Event):
+        while not stop.is_set():
+            ran = threading.Event()
+            sent = time.perf_counter()
+            ran_at = [0.0]
+
+            def probe():
+                ran_at[0] = time.perf_counter()
+                ran.set()
+
+            try:
+                loop.call_soon_threadsafe(probe)
+            except RuntimeError:
+                return  # loop closed
+
+            if not ran.wait(self.threshold):
+                if stop.is_set():
+                    return
+                # Still blocked: the culprit is on the loop thread right now
+                self._capture(sent)
+                while not ran.wait(self.interval):
+                    if stop.is_set() or loop.is_closed():
+                        return
+
+            lag = ran_at[0] - sent
+            self.probes += 1
+            self.max_lag = max(self.max_lag, lag)
+            EVENT_LOOP_LAG.observe(lag)
+            stop.wait(self.interval)
+
+    def _capture(self, sent: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = _format_stack(frame)
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+
+        self.blocked += 1
+        EVENT_LOOP_BLOCKED.inc()
+        stall = {
+            "at": time.time(),
+            "blocked_ms": round((time.perf_counter() - sent) * 1000, 1),
+            "task": task.get_name() if task is not None else None,
+            "stack": stack
+        }
+        self._stalls.append(stall)
+        logger.warning(
+            f"🐢 Event loop blocked for over {stall['blocked_ms']:.0f}ms "
+            f"(task {stall['task']}):\n" + "\n".join(stack[-10:])
+        )
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "budget_ms": settings.LOOP_BLOCK_BUDGET_MS or None,
+            "probes": self.probes,
+            "blocked": self.blocked,
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "recent_stalls": list(self._stalls)
+        }
+
+
+class BlockingGuard:
+    """
+    Await a coroutine while timing each of its steps on the loop
+
+    Only the wrapped coroutine's own steps are timed; work it hands to
+    other tasks or to the threadpool is not. While a step runs, a profile
+    hook times every call made on the loop thread: the first one to exceed
+    the budget is the blocking call, reported with the line of app code
+    that made it. The await the slowest step resumed from and the one it
+    stopped at are kept as well.
+    """
+
+    def __init__(self, coro, budget: float):
+        self._coro = coro
+        self.budget = budget
+        self.worst = 0.0
+        self.worst_span: Optional[tuple] = None
+        self.worst_call: Optional[str] = None
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        self._coro.close()
+
+    def _step(self, method, *args):
+        resumed_at = _await_location(self._coro)
+        slow_call = None
+        call_starts: List[float] = []
+
+        def profile(frame, event, arg):
+            nonlocal slow_call
+            if event == "call" or event == "c_call":
+                call_starts.append(time.perf_counter())
+            elif call_starts:
+                elapsed = time.perf_counter() - call_starts.pop()
+                # Calls return innermost first, so the first slow one is the culprit
+                if slow_call is None and elapsed > self.budget:
+                    slow_call = _caller_location(frame if event.startswith("c_") else frame.f_back)
+
+        previous = sys.getprofile()
+        sys.setprofile(profile)  # this thread only; cProfile sessions use sys.monitoring
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            sys.setprofile(previous)
+            elapsed = time.perf_counter() - start
+            if elapsed > self.worst:
+                self.worst = elapsed
+                self.worst_span = (resumed_at, _await_location(self._coro) or "end of request")
+                self.worst_call = slow_call
+
+    def check(self, method: str, route: str):
+        """
+        Raises:
+            LoopBlockedError: If any step exceeded the budget
+        """
+        if self.worst > self.budget:
+            resumed_at, stopped_at = self.worst_span
+            where = f"at {self.worst_call}, " if self.worst_call else ""
+            raise LoopBlockedError(
+                f"{method} {route} blocked the event loop for {self.worst * 1000:.1f}ms "
+                f"(budget {self.budget * 1000:.0f}ms) {where}between {resumed_at or 'start of request'} "
+                f"and {stopped_at}; move the blocking work to run_in_threadpool"
+            )
+
+
+def _location(frame) -> str:
+    return f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+
+def _caller_location(frame) -> Optional[str]:
+    """
+    The code that made a call, walking out from `frame` to BlockingGuard:
+    the innermost frame in this app, else the innermost outside the
+    standard library and site-packages (e.g. a route defined in a test)
+    """
+    outside_libraries = None
+    while frame is not None and frame.f_code.co_filename != __file__:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_ROOT):
+            return _location(frame)
+        if outside_libraries is None and not filename.startswith(LIBRARY_ROOTS) and not filename.startswith("<"):
+            outside_libraries = _location(frame)
+        frame = frame.f_back
+    return outside_libraries
+
+
+def _await_location(coro) -> Optional[str]:
+    """
+    Where a coroutine chain is suspended (file:line in function): the
+    innermost frame in this app's code if there is one, else the innermost
+    """
+    location = None
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        in_app = frame.f_code.co_filename.startswith(APP_ROOT)
+        if in_app or location is None or not location[0]:
+            location = (in_app, _location(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return location[1] if location is not None else None
+
+
+# Global instance (started from the app lifespan)
+loop_monitor = EventLoopMonitor(
+    interval=settings.LOOP_MONITOR_INTERVAL,
+    threshold=settings.LOOP_BLOCK_THRESHOLD_MS / 1000
+)
@@ -0,0 +1,226 @@
+"""
+Memory instrumentation (tracemalloc sampling)
+メモリ計測
+
+Opt-in: with MEMORY_PROFILING disabled tracemalloc is never started and
+stage() is a no-op apart from one context variable lookup. When enabled, a
+fraction of requests is sampled and the peak Python allocation of each
+stage (upload, decode, predict, response) is recorded.
+
+tracemalloc's peak counter is process-wide, so only one request is sampled
+at a time and its numbers also include whatever concurrent requests
+allocated meanwhile. Treat them as upper bounds. Allocations made inside
+TensorFlow's C++ runtime are not visible to tracemalloc; compare stage peaks
+against RSS to spot them.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import gc
+import logging
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Set while the current request is being sampled
+_sampled: ContextVar[bool] = ContextVar("memory_sampled", default=False)
+
+
+class StageStats:
+    """Peak allocation statistics for one stage"""
+
+    def __init__(self):
+        self.samples = 0
+        self.total_peak = 0
+        self.max_peak = 0
+        self.last_peak = 0
+
+    def add(self, peak: int):
+        self.samples += 1
+        self.total_peak += peak
+        self.max_peak = max(self.max_peak, peak)
+        self.last_peak = peak
+
+    def as_dict(self) -> dict:
+        return {
+            "samples": self.samples,
+            "mean_peak_kb": round(self.total_peak / self.samples / 1024, 1) if self.samples else 0.0,
+            "max_peak_kb": round(self.max_peak / 1024, 1),
+            "last_peak_kb": round(self.last_peak / 1024, 1)
+        }
+
+
+def rss_stats() -> dict:
+    """Current and peak resident set size of this process"""
+    stats = {"max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "RssAnon:", "RssFile:")):
+                    name, value = line.split(":", 1)
+                    stats[f"{name.lower()}_mb"] = int(value.split()[0]) / 1024
+    except OSError:  # not Linux
+        pass
+    return stats
+
+
+def gc_stats() -> dict:
+    """Garbage collector counters per generation"""
+    return {
+        "enabled": gc.isenabled(),
+        "counts": gc.get_count(),
+        "thresholds": gc.get_threshold(),
+        "generations": gc.get_stats(),
+        "uncollectable": len(gc.garbage)
+    }
+
+
+class MemoryProfiler:
+    """Sample requests with tracemalloc and keep per-stage peak allocations"""
+
+    def __init__(self, enabled: bool, sample_rate: float, frames: int):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.stages: Dict[str, StageStats] = {}
+        self.sampled_requests = 0
+        self._sampling = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_time: Optional[float] = None
+
+    def start(self):
+        """Start tracing (no-op unless enabled)"""
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.take_baseline()
+            logger.info(
+                f"Memory profiling enabled: sample_rate={self.sample_rate}, frames={self.frames}"
+            )
+
+    def stop(self):
+        """Stop tracing and drop the baseline snapshot"""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._baseline = None
+        self._baseline_time = None
+
+    @contextmanager
+    def request(self):
+        """Decide whether the enclosed request is sampled"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+        if not self._sampling.acquire(blocking=False):
+            yield  # another request is being sampled
+            return
+
+        token = _sampled.set(True)
+        try:
+            yield
+        finally:
+            _sampled.reset(token)
+            self.sampled_requests += 1
+            self._sampling.release()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the peak allocation of the enclosed block for sampled requests"""
+        if not _sampled.get():
+            yield
+            return
+
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            with self._stats_lock:
+                self.stages.setdefault(name, StageStats()).add(max(peak - start, 0))
+
+    def take_baseline(self):
+        """Snapshot current allocations; later reports can show growth since then"""
+        if tracemalloc.is_tracing():
+            self._baseline = tracemalloc.take_snapshot()
+            self._baseline_time = time.time()
+
+    def top_allocations(self, limit: int = 20, group_by: str = "lineno", since_baseline: bool = False) -> List[dict]:
+        """
+        Largest allocation sites
+
+        Args:
+            limit: Number of sites to return
+            group_by: "lineno", "filename" or "traceback"
+            since_baseline: Report growth since the last baseline snapshot
+
+        Returns:
+            List[dict]: Sites ordered by size (or size growth)
+        """
+        if not tracemalloc.is_tracing():
+            return []
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+        if since_baseline and self._baseline is not None:
+            stats = snapshot.compare_to(self._baseline, group_by)
+            return [
+                {
+                    "site": stat.traceback.format(),
+                    "size_kb": round(stat.size / 1024, 1),
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count": stat.count,
+                    "count_diff": stat.count_diff
+                }
+                for stat in stats[:limit]
+            ]
+
+        return [
+            {
+                "site": stat.traceback.format(),
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count
+            }
+            for stat in snapshot.statistics(group_by)[:limit]
+        ]
+
+    def stats(self) -> dict:
+        """Tracing state and per-stage peaks"""
+        traced, _ = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with self._stats_lock:
+            stages = {name: stats.as_dict() for name, stats in self.stages.items()}
+        return {
+            "enabled": self.enabled,
+            "tracing": tracemalloc.is_tracing(),
+            "sample_rate": self.sample_rate,
+            "sampled_requests": self.sampled_requests,
+            "traced_mb": round(traced / 2**20, 2),
+            "tracemalloc_overhead_mb": round(tracemalloc.get_tracemalloc_memory() / 2**20, 2),
+            "baseline_age_s": round(time.time() - self._baseline_time, 1) if self._baseline_time else None,
+            "stages": stages
+        }
+
+    def reset(self):
+        """Clear stage statistics and take a new baseline"""
+        with self._stats_lock:
+            self.stages.clear()
+            self.sampled_requests = 0
+        self.take_baseline()
+
+
+# Global instance
+memory_profiler = MemoryProfiler(
+    enabled=settings.MEMORY_PROFILING,
+    sample_rate=settings.MEMORY_PROFILE_SAMPLE_RATE,
+    frames=settings.MEMORY_PROFILE_FRAMES
+)
@@ -0,0 +1,287 @@
+"""
+Append-only columnar prediction log
+予測結果の列指向ログ
+
+Every prediction (image hash, class, per-class probabilities, confidence,
+latency, model version) is kept for analytics and retraining. The request
+path only appends a tuple to an in-memory buffer; a background thread
+converts buffered rows to Arrow record batches and appends them to the
+current file:
+
+    PREDICTION_LOG_DIR/predictions-<start time>-<pid>.parquet   (or .arrow)
+
+Files rotate after PREDICTION_LOG_ROTATE_ROWS rows or
+PREDICTION_LOG_ROTATE_SECONDS and are written under a `.inprogress` name
+until closed, so readers only ever see complete files. The buffer is
+bounded: if the writer falls behind, new rows are dropped and counted.
+
+Requires the optional pyarrow package.
+"""
+
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.metrics import PREDICTION_LOG_DROPPED, PREDICTION_LOG_ROWS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET = "parquet"
+ARROW = "arrow"
+
+IN_PROGRESS_SUFFIX = ".inprogress"
+
+# (timestamp, image_hash, class, confidence, probabilities, latency_ms,
+#  model_version, stage, source, cached)
+Row = Tuple[float, Optional[str], str, float, dict, float, str, str, str, bool]
+
+
+class PredictionLog:
+    """Buffer predictions in memory and append them to rotating columnar files"""
+
+    def __init__(self, directory: str, fmt: str = PARQUET,
+                 flush_rows: int = 1024, flush_interval: float = 10.0, max_buffer_rows: int = 50_000,
+                 rotate_rows: int = 1_000_000, rotate_seconds: float = 3600.0):
+        if fmt not in (PARQUET, ARROW):
+            raise ValueError(f"Unknown prediction log format: {fmt}")
+        self.directory = Path(directory)
+        self.class_names: List[str] = []
+        self.format = fmt
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_buffer_rows = max_buffer_rows
+        self.rotate_rows = rotate_rows
+        self.rotate_seconds = rotate_seconds
+
+        self.enabled = False
+        self.written = 0
+        self.dropped = 0
+        self.files = 0
+
+        self._buffer: List[Row] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._writer = None
+        self._path: Optional[Path] = None
+        self._file_rows = 0
+        self._file_opened = 0.0
+
+    def start(self, class_names: Sequence[str]) -> bool:
+        """
+        Start the writer thread
+
+        Args:
+            class_names: Model classes, one probability column each
+
+        Returns:
+            bool: False if pyarrow is not installed
+        """
+        if pa is None:
+            logger.warning("⚠️ Prediction log disabled: pyarrow is not installed")
+            return False
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.class_names = list(class_names)
+        self._schema = self._build_schema()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+        self.enabled = True
+        logger.info(f"Prediction log enabled: {self.directory} ({self.format})")
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        """Flush buffered rows, close the current file and stop"""
+        if self._thread is None:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record(self, content_hash: Optional[str], prediction, latency_ms: float,
+               source: str, cached: bool = False):
+        """
+        Queue one prediction (called on the request path; never blocks on I/O)
+
+        Args:
+            content_hash: SHA-256 of the image (None if not hashed)
+            prediction: Prediction from the classifier or the cache
+            latency_ms: Request processing time so far
+            source: Where the prediction was served (predict, batch, stream, ...)
+            cached: Whether it came from the prediction cache
+        """
+        if not self.enabled:
+            return
+
+        row = (
+            time.time(), content_hash, prediction.predicted_class, prediction.confidence,
+            prediction.all_probabilities, latency_ms, prediction.model_version,
+            prediction.stage, source, cached
+        )
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer_rows:
+                self.dropped += 1
+                PREDICTION_LOG_DROPPED.inc()
+                return
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_rows
+        if full:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "format": self.format,
+            "directory": str(self.directory),
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "files": self.files,
+            "current_file": str(self._path) if self._path is not None else None
+        }
+
+    def _category(self, index_type):
+        """
+        Type of a low-cardinality string column: dictionary-encoded in Parquet.
+        An Arrow IPC file allows one dictionary per field for the whole file,
+        and every flush would build a new one, so Arrow gets plain strings.
+        """
+        if self.format == ARROW:
+            return pa.string()
+        return pa.dictionary(index_type, pa.string())
+
+    def _build_schema(self):
+        fields = [
+            pa.field("timestamp", pa.timestamp("ms", tz="UTC")),
+            pa.field("image_hash", pa.string()),
+            pa.field("predicted_class", self._category(pa.int8())),
+            pa.field("confidence", pa.float32()),
+        ]
+        fields += [pa.field(f"prob_{name}", pa.float32()) for name in self.class_names]
+        fields += [
+            pa.field("latency_ms", pa.float32()),
+            pa.field("model_version", self._category(pa.int16())),
+            pa.field("stage", self._category(pa.int8())),
+            pa.field("source", self._category(pa.int8())),
+            pa.field("cached", pa.bool_()),
+        ]
+        return pa.schema(fields, metadata={"app_version": settings.APP_VERSION})
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush()
+        self._flush()
+        self._close_file()
+
+    def _flush(self):
+        """Write everything buffered as one record batch"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if rows:
+            try:
+                batch = self._to_batch(rows)
+                self._rotate_if_needed()
+                self._writer.write_batch(batch)  # one row group / IPC batch per flush
+                self._file_rows += len(rows)
+                self.written += len(rows)
+                PREDICTION_LOG_ROWS.inc(len(rows))
+            except Exception as e:
+                self.dropped += len(rows)
+                PREDICTION_LOG_DROPPED.inc(len(rows))
+                logger.error(f"❌ Prediction log write failed, {len(rows)} rows dropped: {e}")
+                self._close_file()
+        elif self._writer is not None and time.time() - self._file_opened >= self.rotate_seconds:
+            self._close_file()
+
+    def _column(self, name: str, values):
+        field_type = self._schema.field(name).type
+        array = pa.array(values, pa.string())
+        return array.dictionary_encode().cast(field_type) if pa.types.is_dictionary(field_type) else array
+
+    def _to_batch(self, rows: List[Row]):
+        columns = list(zip(*rows))
+        probabilities = columns[4]
+        arrays = [
+            pa.array([int(ts * 1000) for ts in columns[0]], pa.int64()).cast(pa.timestamp("ms", tz="UTC")),
+            pa.array(columns[1], pa.string()),
+            self._column("predicted_class", columns[2]),
+            pa.array(columns[3], pa.float32()),
+        ]
+        arrays += [
+            pa.array([probs.get(name) for probs in probabilities], pa.float32())
+            for name in self.class_names
+        ]
+        arrays += [
+            pa.array(columns[5], pa.float32()),
+            self._column("model_version", columns[6]),
+            self._column("stage", columns[7]),
+            self._column("source", columns[8]),
+            pa.array(columns[9], pa.bool_()),
+        ]
+        return pa.RecordBatch.from_arrays(arrays, schema=self._schema)
+
+    def _rotate_if_needed(self):
+        if self._writer is not None and (
+            self._file_rows >= self.rotate_rows
+            or time.time() - self._file_opened >= self.rotate_seconds
+        ):
+            self._close_file()
+        if self._writer is None:
+            self._open_file()
+
+    def _open_file(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        self._path = self.directory / f"predictions-{stamp}-{os.getpid()}.{self.format}"
+        partial = self._path.with_name(self._path.name + IN_PROGRESS_SUFFIX)
+        if self.format == PARQUET:
+            self._writer = pq.ParquetWriter(partial, self._schema, compression="zstd")
+        else:
+            options = pa.ipc.IpcWriteOptions(compression="zstd")
+            self._writer = pa.ipc.new_file(str(partial), self._schema, options=options)
+        self._file_rows = 0
+        self._file_opened = time.time()
+
+    def _close_file(self):
+        """Finish the current file and give it its final name"""
+        if self._writer is None:
+            return
+        partial = self._path.with_name(self._path.name + IN_PROGRESS_SUFFIX)
+        try:
+            self._writer.close()
+            partial.rename(self._path)
+            self.files += 1
+            logger.info(f"Prediction log file closed: {self._path} ({self._file_rows} rows)")
+        except Exception as e:
+            logger.error(f"❌ Failed to close prediction log {self._path}: {e}")
+        self._writer = None
+        self._path = None
+
+
+# Global instance (started from the app lifespan when PREDICTION_LOG_ENABLED)
+prediction_log = PredictionLog(
+    directory=settings.PREDICTION_LOG_DIR,
+    fmt=settings.PREDICTION_LOG_FORMAT,
+    flush_rows=settings.PREDICTION_LOG_FLUSH_ROWS,
+    flush_interval=settings.PREDICTION_LOG_FLUSH_SECONDS,
+    max_buffer_rows=settings.PREDICTION_LOG_MAX_BUFFER_ROWS,
+    rotate_rows=settings.PREDICTION_LOG_ROTATE_ROWS,
+    rotate_seconds=settings.PREDICTION_LOG_ROTATE_SECONDS
+)
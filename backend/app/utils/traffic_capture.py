@@ -0,0 +1,175 @@
+"""
+Production traffic capture for replay
+本番トラフィックの記録 (リプレイ用)
+
+Opt-in (TRAFFIC_CAPTURE_ENABLED). TimingMiddleware hands every request under
+TRAFFIC_CAPTURE_PATHS to the capture: arrival time, method, path, query,
+replay-relevant headers, body size, status and duration. A sampled
+fraction of requests (TRAFFIC_CAPTURE_PAYLOAD_RATE) also keeps its raw
+body, stored once per distinct body:
+
+    TRAFFIC_CAPTURE_DIR/requests-<pid>.jsonl
+    TRAFFIC_CAPTURE_DIR/payloads/<sha256>.bin
+
+`python -m app.cli.replay` re-drives a capture against an in-process app
+or a local server. Files are written by a background thread; if it falls
+behind, records are dropped and counted rather than slowing requests.
+Credentials (tokens, cookies) are never recorded.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import queue
+import random
+import threading
+import time
+from typing import List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Headers a replay needs to reproduce the request; everything else is dropped
+CAPTURED_HEADERS = {
+    b"content-type", b"accept", b"x-priority", b"x-request-timeout", b"x-content-sha256",
+}
+
+
+class CaptureRecord:
+    """One request being captured"""
+
+    __slots__ = ("entry", "body", "body_bytes", "max_body")
+
+    def __init__(self, entry: dict, keep_body: bool, max_body: int):
+        self.entry = entry
+        self.body: Optional[List[bytes]] = [] if keep_body else None
+        self.body_bytes = 0
+        self.max_body = max_body
+
+    def add_body(self, chunk: bytes):
+        self.body_bytes += len(chunk)
+        if self.body is not None:
+            if self.body_bytes > self.max_body:
+                self.body = None  # too large to keep; size is still recorded
+            else:
+                self.body.append(chunk)
+
+
+class TrafficCapture:
+    """Record request metadata (and sampled bodies) to local files"""
+
+    def __init__(self, directory: str, paths: List[str], payload_rate: float,
+                 max_payload_bytes: int, max_queue: int = 10_000):
+        self.directory = Path(directory)
+        self.paths = tuple(paths)
+        self.payload_rate = payload_rate
+        self.max_payload_bytes = max_payload_bytes
+        self.enabled = False
+        self.captured = 0
+        self.payloads = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        (self.directory / "payloads").mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+        self.enabled = True
+        logger.info(
+            f"🎥 Traffic capture enabled: {self.directory} "
+            f"(paths {', '.join(self.paths)}, payload rate {self.payload_rate})"
+        )
+
+    def stop(self, timeout: float = 10.0):
+        """Write out queued records and stop"""
+        if self._thread is None:
+            return
+        self.enabled = False
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info(f"Traffic capture stopped: {self.captured} requests, {self.payloads} payloads, {self.dropped} dropped")
+
+    def begin(self, scope) -> Optional[CaptureRecord]:
+        """Start capturing an HTTP request (None if it is not captured)"""
+        if not self.enabled or not scope["path"].startswith(self.paths):
+            return None
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"] if key in CAPTURED_HEADERS
+        }
+        entry = {
+            "ts": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "headers": headers,
+        }
+        keep_body = self.payload_rate > 0 and random.random() < self.payload_rate
+        return CaptureRecord(entry, keep_body, self.max_payload_bytes)
+
+    def finish(self, record: CaptureRecord, route: str, status: int, duration_ms: float):
+        """Queue a finished request for writing"""
+        record.entry.update(
+            route=route,
+            status=status,
+            duration_ms=round(duration_ms, 3),
+            body_bytes=record.body_bytes,
+        )
+        body = b"".join(record.body) if record.body is not None else None
+        try:
+            self._queue.put_nowait((record.entry, body))
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "directory": str(self.directory),
+            "captured": self.captured,
+            "payloads": self.payloads,
+            "dropped": self.dropped
+        }
+
+    def _write_payload(self, body: bytes) -> str:
+        """Store a body once per distinct content; returns its SHA-256"""
+        digest = hashlib.sha256(body).hexdigest()
+        payload_path = self.directory / "payloads" / f"{digest}.bin"
+        if not payload_path.exists():
+            partial = payload_path.with_name(f"{payload_path.name}.{os.getpid()}.partial")
+            partial.write_bytes(body)
+            partial.replace(payload_path)
+        return digest
+
+    def _run(self):
+        log_path = self.directory / f"requests-{os.getpid()}.jsonl"
+        with open(log_path, "a", encoding="utf-8") as sink:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                entry, body = item
+                try:
+                    if body is not None:
+                        entry["payload"] = self._write_payload(body)
+                        self.payloads += 1
+                    sink.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                    self.captured += 1
+                except OSError as e:
+                    self.dropped += 1
+                    logger.warning(f"⚠️ Traffic capture write failed: {e}")
+                if self._queue.empty():
+                    sink.flush()
+
+
+# Global instance (started from the app lifespan when TRAFFIC_CAPTURE_ENABLED)
+traffic_capture = TrafficCapture(
+    directory=settings.TRAFFIC_CAPTURE_DIR,
+    paths=settings.TRAFFIC_CAPTURE_PATHS,
+    payload_rate=settings.TRAFFIC_CAPTURE_PAYLOAD_RATE,
+    max_payload_bytes=settings.TRAFFIC_CAPTURE_MAX_PAYLOAD_MB * 1024 * 1024
+)
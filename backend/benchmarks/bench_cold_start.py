@@ -0,0 +1,146 @@
+"""
+Benchmark: cold start and memory of the .keras model vs the .tflite artifact
+コールドスタートとメモリ使用量の比較
+
+Starts fresh processes that each load the model in one format and run a
+first prediction, and reports import/load/first-prediction time plus
+memory. With --processes N, N processes per format are held alive at once
+so the page-cache sharing of the memory-mapped artifact shows up in PSS
+(proportional set size: shared pages are split between the processes
+mapping them).
+
+Usage (from backend/):
+    python -m app.cli.export_model                 # writes model.tflite first
+    python -m benchmarks.bench_cold_start --processes 4
+    python -m benchmarks.bench_cold_start --synthetic
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+
+def child(fmt: str, model_path: str):
+    """Runs in the measured process: load, predict once, report, then wait"""
+    start = time.perf_counter()
+    import numpy as np
+    import tensorflow as tf  # noqa: F401  (imported by the app in either format)
+    imported = time.perf_counter()
+
+    from app.models.tflite_model import load_model_file
+    model = load_model_file(Path(model_path), fmt)
+    loaded = time.perf_counter()
+
+    model.predict_on_batch(np.zeros((1, 224, 224, 3), dtype=np.float32))
+    predicted = time.perf_counter()
+
+    print(json.dumps({
+        "model": type(model).__name__,
+        "import_s": imported - start,
+        "load_s": loaded - imported,
+        "first_predict_s": predicted - loaded
+    }), flush=True)
+    sys.stdin.read()  # stay alive until the parent has measured memory
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    """RSS split into anonymous/file-backed pages, plus PSS (Linux)"""
+    result = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                result[key] = int(value.split()[0]) / 1024
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    result["Pss"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return result
+
+
+def measure(fmt: str, model_path: Path, processes: int) -> List[dict]:
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3")
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_cold_start", "--child", fmt, str(model_path)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env
+        )
+        for _ in range(processes)
+    ]
+    results = []
+    for proc in procs:
+        line = proc.stdout.readline()
+        if not line:
+            raise SystemExit(f"{fmt} child failed to load {model_path}")
+        results.append(json.loads(line))
+    # All processes hold the model now
+    for proc, result in zip(procs, results):
+        result.update(memory_mb(proc.pid))
+    for proc in procs:
+        proc.stdin.close()
+        proc.wait()
+    return results
+
+
+def build_synthetic_model(directory: Path) -> Path:
+    import tensorflow as tf
+    from app.models.tflite_model import export_tflite
+
+    model = tf.keras.applications.MobileNetV2(input_shape=(224, 224, 3), weights=None, classes=5)
+    path = directory / "synthetic.keras"
+    model.save(path)
+    export_tflite(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("model", nargs="?", help=".keras file with its exported .tflite (default: served model)")
+    parser.add_argument("--processes", type=int, default=1, help="Processes per format held alive together")
+    parser.add_argument("--synthetic", action="store_true", help="Use an untrained stand-in model")
+    parser.add_argument("--child", nargs=2, metavar=("FORMAT", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.synthetic:
+        model_path = build_synthetic_model(Path(tmp.name))
+    elif args.model:
+        model_path = Path(args.model)
+    else:
+        from app.models.registry import model_registry
+        _, model_path = model_registry.resolve()
+
+    from app.models.tflite_model import KERAS, TFLITE, tflite_path_for
+    if not tflite_path_for(model_path).exists():
+        raise SystemExit(f"No artifact for {model_path}; run python -m app.cli.export_model first")
+
+    print(f"model={model_path} processes={args.processes}")
+    print(f"{'format':>7} {'import s':>9} {'load s':>8} {'1st pred s':>10} {'RSS MB':>8} "
+          f"{'anon MB':>8} {'file MB':>8} {'PSS MB':>8}")
+    for fmt in (KERAS, TFLITE):
+        results = measure(fmt, model_path, args.processes)
+        mean = {key: sum(r.get(key, 0.0) for r in results) / len(results)
+                for key in ("import_s", "load_s", "first_predict_s", "VmRSS", "RssAnon", "RssFile", "Pss")}
+        print(
+            f"{fmt:>7} {mean['import_s']:>9.2f} {mean['load_s']:>8.3f} {mean['first_predict_s']:>10.3f} "
+            f"{mean['VmRSS']:>8.0f} {mean['RssAnon']:>8.0f} {mean['RssFile']:>8.0f} {mean['Pss']:>8.0f}"
+        )
+
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
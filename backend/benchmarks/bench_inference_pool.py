@@ -0,0 +1,115 @@
+"""
+Benchmark: inference worker processes vs in-process inference
+推論ワーカープロセスのスループット計測
+
+Drives classifier.predict_batch from several client threads (as the web
+process's threadpool would) with the model in process and with 1..N
+inference workers, and reports images/second and scaling efficiency.
+
+Usage (from backend/):
+    python -m benchmarks.bench_inference_pool --workers 0,1,2,4 --clients 8
+    python -m benchmarks.bench_inference_pool --synthetic   # no trained model needed
+
+--synthetic builds an untrained MobileNetV2 with the same input/output
+shape, which is close enough in cost for measuring dispatch and scaling.
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+def build_synthetic_model(directory: Path) -> Path:
+    import tensorflow as tf
+
+    model = tf.keras.applications.MobileNetV2(input_shape=(224, 224, 3), weights=None, classes=5)
+    path = directory / "synthetic.keras"
+    model.save(path)
+    return path
+
+
+def run_clients(classifier, clients: int, batch: int, seconds: float) -> int:
+    """Call predict_batch from `clients` threads for `seconds`; returns images classified"""
+    import numpy as np
+
+    images = np.random.randint(0, 256, (batch, 224, 224, 3), dtype=np.uint8)
+    deadline = time.monotonic() + seconds
+    counts = [0] * clients
+
+    def client(index: int):
+        while time.monotonic() < deadline:
+            classifier.predict_batch(images)
+            counts[index] += batch
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", default="0,1,2,4", help="Worker counts to test (0 = in process)")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--synthetic", action="store_true", help="Use an untrained stand-in model")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.synthetic:
+        # Settings are read from the environment at import, also by spawned workers
+        os.environ["MODEL_PATH"] = str(build_synthetic_model(Path(tmp.name)))
+        os.environ["MODEL_REGISTRY_DIR"] = str(Path(tmp.name) / "registry")
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+
+    from app.core.config import settings
+    from app.models.classifier import classifier
+    from app.models.worker_pool import InferencePool
+
+    if not classifier.is_loaded():
+        raise SystemExit(f"Model not loaded from {settings.MODEL_PATH}; use --synthetic")
+
+    print(f"cpus={len(os.sched_getaffinity(0))} clients={args.clients} batch={args.batch} seconds={args.seconds}")
+    print(f"{'workers':>8} {'images/s':>10} {'speedup':>8} {'efficiency':>10}")
+
+    baseline = None
+    for workers in [int(n) for n in args.workers.split(",")]:
+        pool = None
+        if workers > 0:
+            pool = InferencePool(workers, slots=4, slot_batch=args.batch, timeout=60.0, pin_cpus=True)
+            pool.start()
+            deadline = time.monotonic() + 300
+            while sum(worker.ready for worker in pool.workers) < workers:
+                if time.monotonic() > deadline:
+                    raise SystemExit("Workers did not become ready")
+                time.sleep(0.5)
+            classifier.pool = pool
+
+        run_clients(classifier, args.clients, args.batch, 2.0)  # warm up
+        throughput = run_clients(classifier, args.clients, args.batch, args.seconds) / args.seconds
+
+        classifier.pool = None
+        if pool is not None:
+            pool.stop()
+
+        if workers == 0:
+            print(f"{'in-proc':>8} {throughput:>10.1f} {'-':>8} {'-':>10}")
+            continue
+        if baseline is None or workers == 1:
+            baseline = throughput
+        speedup = throughput / baseline
+        print(f"{workers:>8} {throughput:>10.1f} {speedup:>8.2f} {speedup / workers:>10.0%}")
+
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
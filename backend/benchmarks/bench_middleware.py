@@ -0,0 +1,124 @@
+"""
+Benchmark: request middleware overhead
+ミドルウェアのオーバーヘッド計測
+
+Compares a bare app, the previous @app.middleware("http") logger
+(BaseHTTPMiddleware) and the pure ASGI TimingMiddleware. Requests are
+driven straight through the ASGI interface (no HTTP client or sockets), so
+the numbers are middleware overhead plus a trivial JSON endpoint. Log
+output is discarded to measure the middleware, not the handlers.
+
+Usage (from backend/):
+    python -m benchmarks.bench_middleware --requests 20000
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import tracemalloc
+
+from fastapi import FastAPI, Request
+
+from app.core.middleware import TimingMiddleware
+
+
+def build_app(variant: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    if variant == "base_http":
+        legacy_logger = logging.getLogger("bench.legacy")
+
+        # Same shape as the middleware that used to live in app/main.py
+        @app.middleware("http")
+        async def log_requests(request: Request, call_next):
+            start_time = time.time()
+            legacy_logger.info(f"➡️  {request.method} {request.url.path}")
+            response = await call_next(request)
+            duration = (time.time() - start_time) * 1000
+            legacy_logger.info(
+                f"⬅️  {request.method} {request.url.path} "
+                f"| Status: {response.status_code} | {duration:.2f}ms"
+            )
+            response.headers["X-Process-Time"] = f"{duration:.2f}ms"
+            return response
+
+    elif variant == "asgi":
+        app.add_middleware(TimingMiddleware)
+
+    return app
+
+
+async def drive(app, requests: int):
+    """Send `requests` GET /ping through the ASGI app; returns per-request seconds"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/ping", "raw_path": b"/ping",
+        "root_path": "", "query_string": b"", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # Run the lifespan-free app once so routing and middleware stacks are built
+    await app(dict(scope), receive, send)
+
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await app(dict(scope), receive, send)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def measure(variant: str, requests: int) -> dict:
+    app = build_app(variant)
+    timings = asyncio.run(drive(app, requests))
+
+    # Allocation profile on a smaller run (tracemalloc slows everything down)
+    tracemalloc.start()
+    asyncio.run(drive(app, min(requests, 2000)))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "variant": variant,
+        "mean_us": statistics.fmean(timings) * 1e6,
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+        "peak_kb": peak / 1024,
+        "retained_kb": current / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    # Keep log I/O out of the measurement; both variants format their lines
+    logging.basicConfig(handlers=[logging.NullHandler()], level=logging.INFO, force=True)
+
+    results = [measure(variant, args.requests) for variant in ("none", "base_http", "asgi")]
+    baseline = results[0]["mean_us"]
+
+    print(f"{'variant':<10} {'mean µs':>9} {'p50 µs':>9} {'p99 µs':>9} {'overhead µs':>12} {'peak KB':>9}")
+    for row in results:
+        print(
+            f"{row['variant']:<10} {row['mean_us']:>9.1f} {row['p50_us']:>9.1f} {row['p99_us']:>9.1f} "
+            f"{row['mean_us'] - baseline:>12.1f} {row['peak_kb']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark: PIL preprocessing vs TF decode/resize fused with the model
+前処理バックエンドの比較 (PIL / TensorFlow)
+
+For each batch size, times the two PREPROCESS_BACKEND paths from encoded
+bytes to probabilities:
+
+    pil  ImageProcessor.decode per image, then the model on the uint8 batch
+         (as /predict/batch does)
+    tf   one FusedModel call: decode, resize, scaling and model in one graph
+
+and checks parity first: decoded pixels and predictions of both backends
+on the same images. Exits with status 1 when predictions differ by more
+than --tolerance or the top-1 class disagrees on more than --max-disagree.
+
+Usage (from backend/):
+    python -m benchmarks.bench_preprocess --synthetic
+    python -m benchmarks.bench_preprocess --images photos/ --batch-sizes 1,8,32
+"""
+
+import argparse
+from io import BytesIO
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+
+def synthetic_photos(count: int, size=(1280, 960)) -> List[bytes]:
+    """Smooth random scenes with sensor-like noise, as JPEG, PNG and WEBP"""
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    formats = ["JPEG", "JPEG", "PNG", "WEBP"]
+    photos = []
+    for i in range(count):
+        coarse = Image.fromarray(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)).resize(size, Image.BICUBIC)
+        pixels = np.asarray(coarse, dtype=np.int16) + rng.integers(-12, 13, (size[1], size[0], 3))
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        buffer = BytesIO()
+        fmt = formats[i % len(formats)]
+        image.save(buffer, fmt, **({"quality": 90} if fmt != "PNG" else {}))
+        photos.append(buffer.getvalue())
+    return photos
+
+
+def load_photos(directory: Path, count: int) -> List[bytes]:
+    from app.utils.archive import iter_directory
+
+    photos = []
+    for _, image_bytes in iter_directory(directory):
+        photos.append(image_bytes)
+        if len(photos) == count:
+            break
+    return photos
+
+
+def pil_predict(model, image_processor, encoded: List[bytes]) -> np.ndarray:
+    import tensorflow as tf
+
+    batch = np.stack([image_processor.decode(image_bytes, block=True) for image_bytes in encoded])
+    return np.asarray(model.predict_on_batch(tf.cast(batch, tf.float32) / 255.0))
+
+
+def time_batches(run, photos: List[bytes], batch_size: int, repeats: int) -> List[float]:
+    """Seconds per batch over `repeats` batches cycling through the photos"""
+    timings = []
+    for r in range(repeats):
+        offset = (r * batch_size) % len(photos)
+        batch = (photos[offset:] + photos)[:batch_size]
+        start = time.perf_counter()
+        run(batch)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", help=".keras model (default: MODEL_PATH)")
+    parser.add_argument("--synthetic", action="store_true", help="Use an untrained stand-in model")
+    parser.add_argument("--images", help="Directory of photos (default: synthetic 1280x960 photos)")
+    parser.add_argument("--count", type=int, default=64, help="Photos to use")
+    parser.add_argument("--batch-sizes", default="1,4,16,32")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed batches per backend and size")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Max allowed probability difference")
+    parser.add_argument("--max-disagree", type=float, default=0.02, help="Max fraction of top-1 disagreements")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+
+    import tensorflow as tf
+    from app.core.config import settings
+    from app.models.tf_preprocess import TFPreprocessor
+    from app.utils.image_processing import image_processor
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.synthetic:
+        from benchmarks.bench_inference_pool import build_synthetic_model
+        model_path = build_synthetic_model(Path(tmp.name))
+    else:
+        model_path = Path(args.model or settings.MODEL_PATH)
+        if not model_path.exists():
+            raise SystemExit(f"Model not found at {model_path}; use --synthetic")
+    model = tf.keras.models.load_model(str(model_path))
+
+    photos = load_photos(Path(args.images), args.count) if args.images else synthetic_photos(args.count)
+    if not photos:
+        raise SystemExit("No photos found")
+
+    preprocessor = TFPreprocessor(image_processor.target_size)
+    fused = preprocessor.fuse(model)
+
+    # Parity on every photo, one at a time so both paths see the same batches
+    pil_pixels = np.stack([image_processor.decode(image_bytes, block=True) for image_bytes in photos])
+    tf_pixels = preprocessor.decode(photos)
+    pixel_diff = np.abs(pil_pixels.astype(np.int16) - tf_pixels.astype(np.int16))
+    expected = np.concatenate([pil_predict(model, image_processor, [p]) for p in photos])
+    actual = np.concatenate([fused.predict_on_batch([p]) for p in photos])
+    prob_diff = np.abs(expected - actual)
+    disagree = float(np.mean(expected.argmax(axis=1) != actual.argmax(axis=1)))
+
+    print(f"cpus={len(os.sched_getaffinity(0))} photos={len(photos)} model={'synthetic' if args.synthetic else model_path}")
+    print(
+        f"parity: pixels mean |Δ| {pixel_diff.mean():.2f} max {pixel_diff.max()} (0-255), "
+        f"probabilities mean |Δ| {prob_diff.mean():.2e} max {prob_diff.max():.2e}, "
+        f"top-1 disagreement {disagree:.1%}"
+    )
+
+    print(f"\n{'batch':>6} {'pil ms':>9} {'tf ms':>9} {'pil img/s':>10} {'tf img/s':>10}  winner")
+    for batch_size in [int(n) for n in args.batch_sizes.split(",")]:
+        runs = {
+            "pil": lambda batch: pil_predict(model, image_processor, batch),
+            "tf": fused.predict_on_batch,
+        }
+        medians = {}
+        for name, run in runs.items():
+            time_batches(run, photos, batch_size, 2)  # warm up (and trace this batch size)
+            medians[name] = float(np.median(time_batches(run, photos, batch_size, args.repeats)))
+        winner = min(medians, key=medians.get)
+        speedup = max(medians.values()) / min(medians.values())
+        print(
+            f"{batch_size:>6} {medians['pil'] * 1000:>9.1f} {medians['tf'] * 1000:>9.1f} "
+            f"{batch_size / medians['pil']:>10.1f} {batch_size / medians['tf']:>10.1f}  {winner} ({speedup:.2f}x)"
+        )
+
+    tmp.cleanup()
+    if prob_diff.max() > args.tolerance or disagree > args.max_disagree:
+        print(f"❌ Backends differ beyond tolerance ({args.tolerance}, {args.max_disagree:.0%} top-1)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
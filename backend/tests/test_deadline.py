@@ -0,0 +1,61 @@
+"""
+Request deadlines count from arrival, including the upload
+リクエスト期限のテスト
+"""
+
+import asyncio
+
+from fastapi import FastAPI, Request
+
+from app.core.middleware import TimingMiddleware
+from app.utils.deadline import DeadlineExceeded, check_deadline, request_deadline
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/work")
+    async def work(request: Request):
+        await request.body()
+        try:
+            async with request_deadline(request, 0.2) as deadline:
+                check_deadline("decode")
+                return {"remaining": deadline.remaining()}
+        except DeadlineExceeded:
+            return {"remaining": None}
+
+    return TimingMiddleware(app)
+
+
+async def _post(app, upload_seconds: float) -> bytes:
+    """POST /work whose body takes `upload_seconds` to arrive"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/work", "raw_path": b"/work", "root_path": "", "query_string": b"",
+        "headers": [(b"content-length", b"2")], "client": ("test", 1), "server": ("test", 80),
+    }
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            await asyncio.sleep(upload_seconds)
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+        await asyncio.Event().wait()  # connection stays open
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+
+
+def test_fast_upload_keeps_its_budget():
+    body = asyncio.run(_post(_app(), 0.0))
+    assert b'"remaining":null' not in body
+
+
+def test_slow_upload_is_charged_to_the_deadline():
+    assert asyncio.run(_post(_app(), 0.3)) == b'{"remaining":null}'
@@ -0,0 +1,47 @@
+"""
+Admission of inference work while draining
+ドレイン中のリクエスト受付テスト
+"""
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.deps import admit_inference, reject_when_draining
+from app.utils.drain import DrainController
+import app.api.deps as deps
+
+
+def test_drain_between_dependency_and_handler_refuses(monkeypatch):
+    controller = DrainController()
+    monkeypatch.setattr(deps, "drain", controller)
+
+    app = FastAPI()
+
+    def drain_starts():
+        controller.begin()  # e.g. POST /admin/drain lands right after the check
+
+    @app.post("/work", dependencies=[Depends(reject_when_draining), Depends(drain_starts)])
+    async def work():
+        with admit_inference():
+            return {"in_flight": controller.in_flight}
+
+    response = TestClient(app).post("/work")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert controller.in_flight == 0
+    assert controller.refused == 1
+
+
+def test_admission_counts_once_and_releases_once():
+    controller = DrainController()
+    admission = controller.admit()
+    assert controller.in_flight == 1
+
+    with admission:
+        pass
+    admission.release()
+    assert controller.in_flight == 0
+
+    controller.begin()
+    assert controller.admit() is None
+    assert controller.in_flight == 0
@@ -0,0 +1,68 @@
+"""
+Event-loop blocking checks (LOOP_BLOCK_BUDGET_MS)
+イベントループのブロッキング検出テスト
+
+Run from backend/: python -m pytest tests
+"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.middleware import TimingMiddleware
+from app.utils.loop_monitor import LoopBlockedError
+
+
+def slow_helper():
+    time.sleep(0.2)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "LOOP_BLOCK_BUDGET_MS", 50.0)
+
+    app = FastAPI()
+    app.add_middleware(TimingMiddleware)
+
+    @app.get("/blocking")
+    async def blocking():
+        time.sleep(0.2)
+        return {"ok": True}
+
+    @app.get("/blocking-helper")
+    async def blocking_helper():
+        slow_helper()
+        return {"ok": True}
+
+    @app.get("/awaiting")
+    async def awaiting():
+        await asyncio.sleep(0.2)
+        return {"ok": True}
+
+    @app.get("/threadpool")
+    async def threadpool():
+        await run_in_threadpool(time.sleep, 0.2)
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_blocking_route_names_the_blocking_line(client):
+    with pytest.raises(LoopBlockedError, match=r"at .*test_loop_monitor\.py:\d+ in blocking,"):
+        client.get("/blocking")
+
+
+def test_blocking_helper_is_reported_where_it_blocks(client):
+    with pytest.raises(LoopBlockedError, match=r"at .*test_loop_monitor\.py:\d+ in slow_helper,"):
+        client.get("/blocking-helper")
+
+
+@pytest.mark.parametrize("path", ["/awaiting", "/threadpool"])
+def test_non_blocking_routes_pass(client, path):
+    assert client.get(path).status_code == 200
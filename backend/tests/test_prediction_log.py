@@ -0,0 +1,58 @@
+"""
+Prediction log files (Parquet and Arrow IPC)
+予測ログのテスト
+"""
+
+import time
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from app.models.classifier import Prediction
+from app.utils.prediction_log import ARROW, PARQUET, PredictionLog
+
+CLASSES = ["glass", "metal", "organic", "paper", "plastic"]
+
+
+def _prediction(predicted_class: str, stage: str = "full") -> Prediction:
+    probabilities = {name: 0.9 if name == predicted_class else 0.025 for name in CLASSES}
+    return Prediction(predicted_class, 0.9, probabilities, "v1", stage)
+
+
+def _wait_for(log: PredictionLog, rows: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while log.written + log.dropped < rows and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _read(path):
+    if path.suffix == ".parquet":
+        return pq.read_table(path)
+    with pa.ipc.open_file(path) as reader:
+        return reader.read_all()
+
+
+@pytest.mark.parametrize("fmt", [PARQUET, ARROW])
+def test_batches_with_different_values_share_one_file(tmp_path, fmt):
+    log = PredictionLog(str(tmp_path), fmt=fmt, flush_rows=1, flush_interval=60.0)
+    assert log.start(CLASSES)
+    try:
+        # Separate flushes, so each batch sees different classes, stages and sources
+        log.record("a" * 64, _prediction("glass"), 12.0, "predict")
+        _wait_for(log, 1)
+        log.record("b" * 64, _prediction("paper", stage="fast"), 8.0, "batch", cached=True)
+        _wait_for(log, 2)
+    finally:
+        log.stop()
+
+    assert (log.written, log.dropped, log.files) == (2, 0, 1)
+    files = list(tmp_path.glob(f"predictions-*.{fmt}"))
+    assert len(files) == 1
+
+    table = _read(files[0])
+    assert table.column("predicted_class").to_pylist() == ["glass", "paper"]
+    assert table.column("stage").to_pylist() == ["full", "fast"]
+    assert table.column("source").to_pylist() == ["predict", "batch"]
+    assert table.column("prob_paper").to_pylist() == pytest.approx([0.025, 0.9])
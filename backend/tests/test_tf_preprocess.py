@@ -0,0 +1,117 @@
+"""
+Parity of the TF-native preprocessing path with the PIL path
+TensorFlow前処理とPIL前処理の一致テスト
+
+PREPROCESS_BACKEND=tf must classify like the default PIL path. Both decode
+the same bytes; they resize with different Lanczos implementations, so
+pixels may differ slightly. Tolerances:
+
+    pixels         mean |Δ| <= 1.5, max |Δ| <= 8   (0-255 scale; JPEG is ~0.9)
+    probabilities  max |Δ| <= 0.01, same top-1 class
+"""
+
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+from PIL import Image
+
+from app.models.tf_preprocess import TFPreprocessor, UndecodableImageError
+from app.utils.image_processing import ImageProcessor
+
+PIXEL_MEAN_TOLERANCE = 1.5
+PIXEL_MAX_TOLERANCE = 8
+PROBABILITY_TOLERANCE = 0.01
+
+
+def _scene(seed: int, size=(640, 480)) -> np.ndarray:
+    """Smooth random RGB scene with some noise, like a downscaled photo"""
+    rng = np.random.default_rng(seed)
+    coarse = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize(size, Image.BICUBIC)
+    pixels = np.asarray(coarse, dtype=np.int16) + rng.integers(-8, 9, (size[1], size[0], 3))
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def _encode(pixels: np.ndarray, mode: str, fmt: str) -> bytes:
+    image = Image.fromarray(pixels)
+    if mode == "RGBA":
+        alpha = Image.fromarray(np.linspace(0, 255, pixels.shape[1], dtype=np.uint8)[None, :].repeat(pixels.shape[0], 0))
+        image.putalpha(alpha)
+    elif mode != "RGB":
+        image = image.convert(mode)
+    buffer = BytesIO()
+    image.save(buffer, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+INPUTS = {
+    "jpeg": ("RGB", "JPEG"),
+    "png": ("RGB", "PNG"),
+    "rgba_png": ("RGBA", "PNG"),
+    "grayscale_png": ("L", "PNG"),
+    "grayscale_jpeg": ("L", "JPEG"),
+}
+
+
+@pytest.fixture(scope="module")
+def model():
+    """Small seeded CNN whose output follows the pixels (unlike an untrained MobileNet)"""
+    tf.keras.utils.set_random_seed(0)
+    inputs = tf.keras.Input((224, 224, 3))
+    x = tf.keras.layers.Conv2D(16, 5, strides=4, activation="relu")(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(5, activation="softmax")(x * 20.0)
+    return tf.keras.Model(inputs, outputs)
+
+
+@pytest.fixture(scope="module")
+def processor():
+    return ImageProcessor()
+
+
+@pytest.fixture(scope="module")
+def preprocessor(processor):
+    return TFPreprocessor(processor.target_size)
+
+
+def _pil_predict(model, processor, encoded):
+    batch = np.stack([processor.decode(image_bytes, block=True) for image_bytes in encoded])
+    return model.predict_on_batch(processor.normalize(batch)), batch
+
+
+@pytest.mark.parametrize("name", INPUTS)
+def test_tf_decode_matches_pil(name, processor, preprocessor):
+    mode, fmt = INPUTS[name]
+    encoded = [_encode(_scene(seed), mode, fmt) for seed in range(3)]
+
+    expected = np.stack([processor.decode(image_bytes, block=True) for image_bytes in encoded])
+    actual = preprocessor.decode(encoded)
+
+    assert actual.shape == expected.shape and actual.dtype == np.uint8
+    diff = np.abs(actual.astype(np.int16) - expected.astype(np.int16))
+    assert diff.mean() <= PIXEL_MEAN_TOLERANCE
+    assert diff.max() <= PIXEL_MAX_TOLERANCE
+
+
+@pytest.mark.parametrize("name", INPUTS)
+def test_fused_model_matches_pil_pipeline(name, model, processor, preprocessor):
+    mode, fmt = INPUTS[name]
+    encoded = [_encode(_scene(seed), mode, fmt) for seed in range(3, 7)]
+
+    expected, _ = _pil_predict(model, processor, encoded)
+    actual = preprocessor.fuse(model).predict_on_batch(encoded)
+
+    np.testing.assert_allclose(actual, expected, atol=PROBABILITY_TOLERANCE)
+    assert list(actual.argmax(axis=1)) == list(expected.argmax(axis=1))
+
+
+def test_undecodable_image_raises(model, preprocessor):
+    png = _encode(_scene(0), "RGB", "PNG")
+    corrupt = png[:64] + bytes(len(png) - 64)  # valid header, zeroed pixel data
+
+    with pytest.raises(UndecodableImageError):
+        preprocessor.decode([png, corrupt])
+    with pytest.raises(UndecodableImageError):
+        preprocessor.fuse(model).predict_on_batch([corrupt])
@@ -46,6 +46,15 @@ export async function classifyImage(
       fileToUpload = await compressImage(file);
     }
 
+    // Hash-first: skip the upload if the server already classified these bytes
+    const contentHash = await sha256Hex(fileToUpload);
+    if (contentHash) {
+      const cached = await lookupPrediction(contentHash);
+      if (cached) {
+        return cached;
+      }
+    }
+
     const formData = new FormData();
     formData.append("file", fileToUpload);
 
@@ -54,6 +63,7 @@ export async function classifyImage(
       formData,
       {
         timeout: 120000, // 2 minutes for classification
+        headers: contentHash ? { "X-Content-SHA256": contentHash } : undefined,
         onUploadProgress: (progressEvent) => {
           if (progressEvent.total) {
             const percentCompleted = Math.round(
@@ -110,6 +120,36 @@ export async function classifyImage(
   }
 }
 
+/**
+ * SHA-256 of a file as lowercase hex (null where Web Crypto is unavailable)
+ */
+async function sha256Hex(file: File): Promise<string | null> {
+  if (typeof crypto === "undefined" || !crypto.subtle) {
+    return null;
+  }
+  const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+/**
+ * Fetch a cached prediction by image hash (null on a miss)
+ */
+async function lookupPrediction(
+  contentHash: string,
+): Promise<PredictionResult | null> {
+  try {
+    const response = await apiClient.get<PredictionResult>(
+      `/predict/lookup/${contentHash}`,
+      { timeout: 10000 },
+    );
+    return response.data;
+  } catch {
+    return null;
+  }
+}
+
 /**
  * Compress image before upload
  */